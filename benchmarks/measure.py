@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+"""
+Runs a command and writes its resource usage as JSON to a file. It is mounted into the
+containers by `preprocessing.py` and runs inside them (with the Python of the container)
+so that the tools started by the entrypoint are measured instead of the `docker` client.
+The usage is taken from `wait4()` and therefore includes all descendants of the command
+that were waited for (which is the case for the pipelines in the containers); the peak
+RSS is that of the largest single process. The bytes read and written are the block I/O
+accounted by the kernel (i.e. excluding reads served from the page cache).
+
+Usage: python measure.py METRICS_FILE COMMAND [ARGS...]
+"""
+
+metrics_file, cmd = sys.argv[1], sys.argv[2:]
+start = time.perf_counter()
+p = subprocess.Popen(cmd)
+_, status, usage = os.wait4(p.pid, 0)
+wall_time = time.perf_counter() - start
+# decode the status by hand (`os.waitstatus_to_exitcode` needs Python 3.9, but some
+# containers have an older one)
+exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+with open(metrics_file, "w") as f:
+    json.dump(
+        {
+            "exit_code": exit_code,
+            "wall_time": wall_time,
+            "cpu_time": usage.ru_utime + usage.ru_stime,
+            "user_time": usage.ru_utime,
+            "system_time": usage.ru_stime,
+            # `ru_maxrss` is in kB on Linux
+            "max_rss_mb": usage.ru_maxrss / 1024,
+            "bytes_read": usage.ru_inblock * 512,
+            "bytes_written": usage.ru_oublock * 512,
+        },
+        f,
+    )
+sys.exit(exit_code if exit_code >= 0 else 128 - exit_code)
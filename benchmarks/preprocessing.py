@@ -0,0 +1,807 @@
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import numpy as np
+
+"""
+End-to-end benchmark of the preprocessing containers with simulated reads. Paired-end
+reads are simulated offline from the H37Rv reference (the one bundled with the
+containers) after planting known SNPs and indels in the target loci. Then the
+entrypoints of the containers (and the mapping pipeline on its own) are run for every
+combination of sequencing depth and number of threads so that the scaling can be
+followed. Every run is a separate `docker run` with the command wrapped by `measure.py`
+(which is mounted into the container), which reports the wall time, CPU time, peak RSS,
+and bytes read / written of all processes in the container. The per-stage reports of the
+containers (`--resource-report`) are included as well. The outputs are compared
+against the planted variants as a sanity check (a faster pipeline giving different
+results should not go unnoticed). The image names and versions are taken from the labels
+in the Dockerfiles; the images need to be built (or pulled) beforehand.
+
+The stages are
+
+* `mapping`: `mapping-pipeline.sh` (trimming, alignment, sorting) on its own
+* `one-hot-raw`: the one-hot-encoded sequences from raw reads container
+* `one-hot-raw-prefilter`: the same with the k-mer prefilter (`--prefilter`)
+* `consensus-raw`: the consensus sequences from raw reads container
+* `one-hot-aligned`: the one-hot-encoded sequences from aligned reads container
+* `variants-freebayes` / `variants-pileup`: the variants from aligned reads container
+  with both engines
+
+The aligned-read containers use the BAM produced by the `mapping` stage. The variants
+container is single-threaded and thus only run once per depth. The results are written
+as JSON (one record per run) after every run.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = {
+    "mapping": "one_hot_encoded_seqs_from_raw_reads",
+    "one-hot-raw": "one_hot_encoded_seqs_from_raw_reads",
+    "one-hot-raw-prefilter": "one_hot_encoded_seqs_from_raw_reads",
+    "consensus-raw": "consensus_sequences_from_raw_reads",
+    "one-hot-aligned": "one_hot_encoded_seqs_from_aligned_reads",
+    "variants-freebayes": "variants_from_aligned_reads",
+    "variants-pileup": "variants_from_aligned_reads",
+}
+THREADED_STAGES = [
+    "mapping",
+    "one-hot-raw",
+    "one-hot-raw-prefilter",
+    "consensus-raw",
+    "one-hot-aligned",
+]
+# bases are encoded as 0-3 (the complement of `x` is `3 - x`)
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+BASE_CODES = np.zeros(256, dtype=np.uint8)
+for i, base in enumerate(b"ACGT"):
+    BASE_CODES[base] = i
+    BASE_CODES[base + 32] = i
+# correct bases and sequencing errors get these base qualities
+QUAL_CORRECT = ord("F")  # Q37
+QUAL_ERROR = ord("+")  # Q10
+# minimum distance between planted variants (so that they are called separately)
+MIN_VARIANT_DISTANCE = 50
+# number of read pairs simulated at once
+CHUNK_SIZE = 100000
+# files written to the working directory of a run by the benchmark itself
+BENCHMARK_FILES = [
+    "stdout.txt",
+    "stderr.txt",
+    "metrics.json",
+    "resources.json",
+    "steps.jsonl",
+]
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def check_rate(val):
+    try:
+        val = float(val)
+        assert 0 <= val < 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(f"invalid value (must be in [0, 1)): '{val}'")
+    return val
+
+
+def log(msg):
+    print(f"[{datetime.datetime.now():%H:%M:%S}] {msg}", file=sys.stderr, flush=True)
+
+
+def read_dockerfile(container):
+    """
+    Reads the image name and version from the labels in the Dockerfile (like
+    `docker-check-version-build-push.sh`) and the entrypoint. Returns the image tag and
+    the entrypoint (as list).
+    """
+    with open(f"{REPO_DIR}/preprocessing/{container}/Dockerfile") as f:
+        dockerfile = f.read()
+    name = re.search(r'^LABEL image.name="(.+)"$', dockerfile, re.M).group(1)
+    version = re.search(r'^LABEL software.version="(.+)"$', dockerfile, re.M).group(1)
+    entrypoint = re.search(r"^ENTRYPOINT (\[.+\])$", dockerfile, re.M).group(1)
+    return f"{name}:v{version}", json.loads(entrypoint)
+
+
+def read_fasta(filename):
+    """
+    Reads the first sequence of a FASTA file and returns its name and the bases encoded
+    as 0-3 (the H37Rv reference only holds `ACGT`; other characters would become `A`).
+    """
+    with open(filename, "rb") as f:
+        name = f.readline()[1:].split()[0].decode()
+        seq = []
+        for line in f:
+            if line.startswith(b">"):
+                break
+            seq.append(line.strip())
+    return name, BASE_CODES[np.frombuffer(b"".join(seq), dtype=np.uint8)]
+
+
+def decode(codes):
+    return BASES[codes].tobytes().decode()
+
+
+def plant_variants(genome, loci, n_snps, n_indels, max_indel_length, rng):
+    """
+    Picks random SNPs and indels (insertions and deletions of 1 to `max_indel_length`
+    bases) inside the target loci (tuples of name, start, and end with 1-based
+    coordinates) and returns them as a sorted list of tuples of (POS, REF, ALT) like in
+    a VCF. Indels are only accepted if they can't be shifted to the left or right so
+    that their representation is unambiguous (i.e. the variant callers have to report
+    them at the same position).
+    """
+    candidates = np.concatenate(
+        [
+            np.arange(start + 10, end - max_indel_length - 10) - 1
+            for _, start, end in loci
+        ]
+    )
+    kinds = ["snp"] * n_snps + ["indel"] * n_indels
+    rng.shuffle(kinds)
+    variants = []
+    for kind in kinds:
+        while True:
+            pos = int(rng.choice(candidates))
+            if any(abs(pos + 1 - x[0]) < MIN_VARIANT_DISTANCE for x in variants):
+                continue
+            if kind == "snp":
+                ref = genome[pos : pos + 1]
+                alt = (ref + rng.integers(1, 4)) % 4
+                break
+            length = int(rng.integers(1, max_indel_length + 1))
+            if rng.random() < 0.5:
+                # deletion of the bases after `pos`
+                deleted = genome[pos + 1 : pos + 1 + length]
+                if deleted[-1] == genome[pos] or deleted[0] == genome[pos + 1 + length]:
+                    continue
+                ref, alt = genome[pos : pos + 1 + length], genome[pos : pos + 1]
+            else:
+                # insertion after `pos`
+                inserted = rng.integers(0, 4, length).astype(np.uint8)
+                if inserted[-1] == genome[pos] or inserted[0] == genome[pos + 1]:
+                    continue
+                ref = genome[pos : pos + 1]
+                alt = np.concatenate([ref, inserted])
+            break
+        variants.append((pos + 1, decode(ref), decode(alt)))
+    return sorted(variants)
+
+
+def apply_variants(genome, variants, start, end):
+    """
+    Returns the sequence between `start` and `end` (1-based, inclusive) with the
+    variants lying fully inside the region applied (like `bcftools consensus`).
+    """
+    pieces = []
+    built_until = start - 1
+    for pos, ref, alt in variants:
+        if pos < start or pos + len(ref) - 1 > end:
+            continue
+        pieces.append(genome[built_until : pos - 1])
+        pieces.append(BASE_CODES[np.frombuffer(alt.encode(), dtype=np.uint8)])
+        built_until = pos + len(ref) - 1
+    pieces.append(genome[built_until:end])
+    return np.concatenate(pieces)
+
+
+def expected_one_hot(genome, variants, loci):
+    """
+    Returns the consensus sequence expected from the one-hot-encoding containers: the
+    loci are concatenated in coordinate order (the ends in the CSV are exclusive there),
+    SNPs are applied, deleted positions are dropped, and insertions are ignored.
+    """
+    seq = genome.copy()
+    keep = np.ones(len(genome), dtype=bool)
+    for pos, ref, alt in variants:
+        if len(ref) == len(alt):
+            seq[pos - 1] = BASE_CODES[ord(alt)]
+        elif len(ref) > len(alt):
+            keep[pos : pos + len(ref) - 1] = False
+    return "".join(
+        decode(seq[start - 1 : end - 1][keep[start - 1 : end - 1]])
+        for _, start, end in sorted(loci, key=lambda x: x[1])
+    )
+
+
+def simulate_reads(seq, windows, depth, args, rng, prefix):
+    """
+    Simulates paired-end reads from the windows (tuples of 0-based, half-open start and
+    end) of `seq` and writes them to `{prefix}_1.fastq.gz` and `{prefix}_2.fastq.gz`.
+    Fragment lengths are drawn from a normal distribution and the reads are taken from
+    either strand. Sequencing errors are substitutions (with a low base quality).
+    Returns the number of read pairs.
+    """
+    offsets = np.arange(args.read_length)
+    n_total = 0
+    with gzip.open(f"{prefix}_1.fastq.gz", "wb", compresslevel=1) as fw, gzip.open(
+        f"{prefix}_2.fastq.gz", "wb", compresslevel=1
+    ) as rv:
+        for window_start, window_end in windows:
+            # the windows are in reference coordinates (`seq` might be shorter due to
+            # planted deletions)
+            window_end = min(window_end, len(seq))
+            n_pairs = round(depth * (window_end - window_start) / 2 / args.read_length)
+            for chunk_start in range(0, n_pairs, CHUNK_SIZE):
+                n = min(CHUNK_SIZE, n_pairs - chunk_start)
+                fragment_lengths = (
+                    rng.normal(args.fragment_length, args.fragment_sd, n)
+                    .round()
+                    .astype(int)
+                    .clip(args.read_length, window_end - window_start)
+                )
+                starts = rng.integers(window_start, window_end - fragment_lengths + 1)
+                left = seq[starts[:, None] + offsets]
+                ends = starts + fragment_lengths
+                right = 3 - seq[(ends - args.read_length)[:, None] + offsets][:, ::-1]
+                swap = (rng.random(n) < 0.5)[:, None]
+                for f, reads, mate in (
+                    (fw, np.where(swap, right, left), 1),
+                    (rv, np.where(swap, left, right), 2),
+                ):
+                    errors = rng.random(reads.shape) < args.error_rate
+                    substitutions = rng.integers(1, 4, errors.sum())
+                    reads[errors] = (reads[errors] + substitutions) % 4
+                    records = np.hstack(
+                        [
+                            BASES[reads],
+                            np.tile(np.frombuffer(b"\n+\n", dtype=np.uint8), (n, 1)),
+                            np.where(errors, QUAL_ERROR, QUAL_CORRECT).astype(np.uint8),
+                            np.full((n, 1), ord("\n"), dtype=np.uint8),
+                        ]
+                    )
+                    f.write(
+                        b"".join(
+                            b"@sim%d/%d\n%s" % (n_total + i, mate, record.tobytes())
+                            for i, record in enumerate(records)
+                        )
+                    )
+                n_total += n
+    return n_total
+
+
+def prepare_dataset(genome, variants, windows, depth, args, data_dir):
+    """
+    Simulates the reads for a depth unless they have been simulated with the same
+    parameters already. Returns a dict with info about the dataset.
+    """
+    params = {
+        "depth": depth,
+        "variants": variants,
+        "windows": windows,
+        "reference": os.path.abspath(args.reference),
+        **{
+            key: getattr(args, key)
+            for key in [
+                "error_rate",
+                "read_length",
+                "fragment_length",
+                "fragment_sd",
+                "seed",
+            ]
+        },
+    }
+    info_file = f"{data_dir}/dataset.json"
+    if os.path.exists(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        if info["params"] == json.loads(json.dumps(params)):
+            log(f"using the reads simulated previously for depth {depth}")
+            return info
+    os.makedirs(data_dir, exist_ok=True)
+    log(f"simulating reads for depth {depth}")
+    start = time.perf_counter()
+    n_pairs = simulate_reads(
+        apply_variants(genome, variants, 1, len(genome)),
+        windows,
+        depth,
+        args,
+        np.random.default_rng([args.seed, depth]),
+        f"{data_dir}/reads",
+    )
+    info = {
+        "params": params,
+        "read_pairs": n_pairs,
+        "simulation_time": time.perf_counter() - start,
+        "fastq_bytes": sum(
+            os.path.getsize(f"{data_dir}/reads_{i}.fastq.gz") for i in (1, 2)
+        ),
+    }
+    with open(info_file, "w") as f:
+        json.dump(info, f)
+    return info
+
+
+def stage_command(stage, entrypoint, data_dir, threads):
+    fastqs = [f"{data_dir}/reads_1.fastq.gz", f"{data_dir}/reads_2.fastq.gz"]
+    bam = f"{data_dir}/reads.sorted.bam"
+    regions = ["-r", f"{os.path.dirname(data_dir)}/regions.csv"]
+    if stage == "mapping":
+        return [
+            "bash",
+            "/mapping-pipeline.sh",
+            *fastqs,
+            "/internal_data/refgenome.fa",
+            str(threads),
+            "/internal_data/bwa-index",
+        ]
+    if stage in ("one-hot-raw", "one-hot-raw-prefilter"):
+        args = fastqs + regions + ["-t", str(threads), "-o", "one_hot.npy"]
+        if stage == "one-hot-raw-prefilter":
+            args.append("--prefilter")
+    elif stage == "consensus-raw":
+        args = fastqs + regions + ["-t", str(threads), "-o", "consensus.fa"]
+    elif stage == "one-hot-aligned":
+        args = ["-b", bam] + regions + ["-t", str(threads), "-o", "one_hot.npy"]
+    else:
+        args = [
+            "-b",
+            bam,
+            "-t",
+            f"{os.path.dirname(data_dir)}/target_vars.csv",
+            "-o",
+            "variants.csv",
+            "--engine",
+            stage.split("-")[1],
+        ]
+    return entrypoint + args + ["--resource-report", "resources.json"]
+
+
+def read_steps(run_dir):
+    """
+    Returns the stages recorded by the instrumentation of the containers: the report
+    written by the entrypoints (`--resource-report`) or the records of the tools of the
+    mapping pipeline (written to the log passed via the environment).
+    """
+    try:
+        with open(f"{run_dir}/resources.json") as f:
+            return json.load(f)["stages"]
+    except FileNotFoundError:
+        pass
+    try:
+        with open(f"{run_dir}/steps.jsonl") as f:
+            steps = [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+    start = min((step["start"] for step in steps), default=0)
+    for step in steps:
+        step["start"] -= start
+        del step["id"], step["parent"]
+    return sorted(steps, key=lambda x: x["start"])
+
+
+def run_stage(image, cmd, work_dir, run_dir, docker):
+    """
+    Runs a command in a container with `measure.py` and returns the metrics (with the
+    wall time including starting the container, the size of the files left in the
+    working directory, and the stages recorded by the container added).
+    """
+    os.makedirs(run_dir)
+    docker_cmd = [
+        docker,
+        "run",
+        "--rm",
+        "-v",
+        f"{work_dir}:{work_dir}",
+        "-v",
+        f"{BENCHMARKS_DIR}:/benchmarks:ro",
+        # record the tools of the shell pipelines (see `instrumentation.py` in the
+        # containers)
+        "-e",
+        f"INSTRUMENTATION_LOG={run_dir}/steps.jsonl",
+        "-w",
+        run_dir,
+        "--entrypoint",
+        "/usr/local/bin/_entrypoint.sh",
+        image,
+        "python",
+        "/benchmarks/measure.py",
+        f"{run_dir}/metrics.json",
+    ]
+    start = time.perf_counter()
+    with open(f"{run_dir}/stdout.txt", "wb") as stdout, open(
+        f"{run_dir}/stderr.txt", "wb"
+    ) as stderr:
+        p = subprocess.run(docker_cmd + cmd, stdout=stdout, stderr=stderr)
+    docker_wall_time = time.perf_counter() - start
+    try:
+        with open(f"{run_dir}/metrics.json") as f:
+            metrics = json.load(f)
+    except FileNotFoundError:
+        # the container didn't even start the command
+        metrics = {"exit_code": p.returncode}
+    metrics["docker_wall_time"] = docker_wall_time
+    metrics["output_bytes"] = sum(
+        entry.stat().st_size
+        for entry in os.scandir(run_dir)
+        if entry.name not in BENCHMARK_FILES
+    )
+    metrics["stages"] = read_steps(run_dir)
+    return metrics
+
+
+def evaluate(stage, run_dir, truth):
+    """
+    Compares the output of a stage (other than `mapping`) with the expected results and
+    returns a dict with the accuracy metrics.
+    """
+    if stage in ("one-hot-raw", "one-hot-raw-prefilter", "one-hot-aligned"):
+        one_hot = np.load(f"{run_dir}/one_hot.npy")
+        seq = decode(one_hot.argmax(axis=1))
+        result = {"length": len(seq), "expected_length": len(truth["one_hot"])}
+        if len(seq) == len(truth["one_hot"]):
+            result["mismatches"] = int(
+                (
+                    np.frombuffer(seq.encode(), dtype=np.uint8)
+                    != np.frombuffer(truth["one_hot"].encode(), dtype=np.uint8)
+                ).sum()
+            )
+        return result
+    if stage == "consensus-raw":
+        consensus = {}
+        with open(f"{run_dir}/consensus.fa") as f:
+            for line in f:
+                if line.startswith(">"):
+                    locus = line[1:].strip()
+                    consensus[locus] = []
+                else:
+                    consensus[locus].append(line.strip())
+        return {
+            "loci": len(truth["consensus"]),
+            "identical_loci": sum(
+                "".join(consensus.get(locus, [])) == seq
+                for locus, seq in truth["consensus"].items()
+            ),
+        }
+    if stage.startswith("variants"):
+        called = set()
+        with open(f"{run_dir}/variants.csv") as f:
+            for row in csv.DictReader(f):
+                if float(row["GT"]) == 1:
+                    called.add((int(row["POS"]), row["REF"], row["ALT"]))
+        return {
+            "planted_variants": len(truth["variants"]),
+            "recalled_variants": len(called & truth["variants"]),
+            "other_calls": len(called - truth["variants"]),
+        }
+
+
+parser = argparse.ArgumentParser(
+    description="""
+    End-to-end benchmark of the preprocessing containers with reads simulated from the
+    H37Rv reference (with known SNPs and indels in the target loci). Runs all stages for
+    every combination of depth and number of threads and writes the wall time, CPU time,
+    peak RSS, and bytes read / written of each run (as well as the accuracy of the
+    outputs) as JSON.
+    """
+)
+parser.add_argument(
+    "-w",
+    "--work-dir",
+    type=str,
+    default="preprocessing-benchmark",
+    metavar="DIR",
+    help=(
+        "directory for the simulated reads and the outputs of the runs (mounted into "
+        "the containers; simulated reads are reused by later invocations) "
+        "[default: %(default)s]"
+    ),
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    type=str,
+    metavar="FILE",
+    help="JSON file to write the results to [default: WORK_DIR/results.json]",
+)
+parser.add_argument(
+    "-d",
+    "--depth",
+    type=check_positive_int,
+    nargs="+",
+    default=[10, 30, 100],
+    metavar="INT",
+    help="sequencing depths to simulate [default: %(default)s]",
+)
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=check_positive_int,
+    nargs="+",
+    default=[1, 4],
+    metavar="INT",
+    help="numbers of threads to run the stages with [default: %(default)s]",
+)
+parser.add_argument(
+    "-s",
+    "--stage",
+    choices=list(STAGES),
+    action="append",
+    help="only run this stage (can be passed multiple times)",
+)
+parser.add_argument(
+    "-n",
+    "--runs",
+    type=check_positive_int,
+    default=1,
+    metavar="INT",
+    help=(
+        "number of runs per stage, depth, and number of threads "
+        "[default: %(default)d]"
+    ),
+)
+parser.add_argument(
+    "-e",
+    "--error-rate",
+    type=check_rate,
+    default=0.002,
+    metavar="FLOAT",
+    help="per-base substitution error rate of the reads [default: %(default)s]",
+)
+parser.add_argument(
+    "--read-length",
+    type=check_positive_int,
+    default=150,
+    metavar="INT",
+    help="[default: %(default)d]",
+)
+parser.add_argument(
+    "--fragment-length",
+    type=check_positive_int,
+    default=350,
+    metavar="INT",
+    help="mean fragment length [default: %(default)d]",
+)
+parser.add_argument(
+    "--fragment-sd",
+    type=float,
+    default=50,
+    metavar="FLOAT",
+    help="standard deviation of the fragment length [default: %(default)s]",
+)
+parser.add_argument(
+    "--snps",
+    type=int,
+    default=30,
+    metavar="INT",
+    help="number of SNPs to plant in the target loci [default: %(default)d]",
+)
+parser.add_argument(
+    "--indels",
+    type=int,
+    default=10,
+    metavar="INT",
+    help="number of indels to plant in the target loci [default: %(default)d]",
+)
+parser.add_argument(
+    "--max-indel-length",
+    type=check_positive_int,
+    default=6,
+    metavar="INT",
+    help="[default: %(default)d]",
+)
+parser.add_argument(
+    "--targets-only",
+    action="store_true",
+    help=(
+        "only simulate reads from the target loci (and their flanks) instead of the "
+        "whole genome; much faster for high depths, but the mapping is less realistic"
+    ),
+)
+parser.add_argument(
+    "--flank",
+    type=check_positive_int,
+    default=2000,
+    metavar="INT",
+    help="size of the flanks with '--targets-only' [default: %(default)d]",
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=42,
+    metavar="INT",
+    help="seed for the simulation [default: %(default)d]",
+)
+parser.add_argument(
+    "--reference",
+    type=str,
+    default=(
+        f"{REPO_DIR}/preprocessing/variants_from_aligned_reads/data_files/"
+        "MTB-h37rv_asm19595v2-eg18.fa"
+    ),
+    metavar="FILE",
+    help=(
+        "H37Rv reference FASTA (the one bundled with the containers) "
+        "[default: %(default)s]"
+    ),
+)
+parser.add_argument(
+    "--regions",
+    type=str,
+    default=(
+        f"{REPO_DIR}/predictors/neural_net_from_one_hot_encoded_seqs_13_drugs/"
+        "data_files/target_loci.csv"
+    ),
+    metavar="FILE",
+    help="CSV with the target loci ('locus,start,end') [default: %(default)s]",
+)
+parser.add_argument(
+    "--target-vars",
+    type=str,
+    default=(
+        f"{REPO_DIR}/predictors/random_forest_from_variants_streptomycin/data_files/"
+        "SM_RF_target_vars_AFs.csv"
+    ),
+    metavar="FILE",
+    help=(
+        "CSV with target variants ('POS,REF,ALT,AF') for the variants container (the "
+        "planted variants are added) [default: %(default)s]"
+    ),
+)
+parser.add_argument(
+    "--docker",
+    type=str,
+    default="docker",
+    metavar="CMD",
+    help="docker executable [default: %(default)s]",
+)
+args = parser.parse_args()
+
+work_dir = os.path.abspath(args.work_dir)
+output = args.output or f"{work_dir}/results.json"
+os.makedirs(work_dir, exist_ok=True)
+stages = [stage for stage in STAGES if stage in (args.stage or STAGES)]
+containers = {stage: read_dockerfile(STAGES[stage]) for stage in STAGES}
+
+# plant the variants (the same for all depths) and get the expected results
+chrom, genome = read_fasta(args.reference)
+with open(args.regions) as f:
+    loci = [
+        (row["locus"], int(row["start"]), int(row["end"])) for row in csv.DictReader(f)
+    ]
+variants = plant_variants(
+    genome,
+    loci,
+    args.snps,
+    args.indels,
+    args.max_indel_length,
+    np.random.default_rng(args.seed),
+)
+truth = {
+    "one_hot": expected_one_hot(genome, variants, loci),
+    "consensus": {
+        name: decode(apply_variants(genome, variants, start, end))
+        for name, start, end in loci
+    },
+    "variants": set(variants),
+}
+with open(f"{work_dir}/regions.csv", "w") as f:
+    f.writelines(
+        ["locus,start,end\n"] + [f"{name},{start},{end}\n" for name, start, end in loci]
+    )
+with open(args.target_vars) as f, open(f"{work_dir}/target_vars.csv", "w") as out:
+    target_vars = list(csv.DictReader(f))
+    planted = set(variants)
+    out.write("POS,REF,ALT,AF\n")
+    for row in target_vars:
+        if (int(row["POS"]), row["REF"], row["ALT"]) not in planted:
+            out.write(f"{row['POS']},{row['REF']},{row['ALT']},{row['AF']}\n")
+    for pos, ref, alt in variants:
+        out.write(f"{pos},{ref},{alt},0.5\n")
+with open(f"{work_dir}/planted_variants.csv", "w") as f:
+    f.writelines(
+        ["POS,REF,ALT\n"] + [f"{pos},{ref},{alt}\n" for pos, ref, alt in variants]
+    )
+
+if args.targets_only:
+    # merge the flanked loci into windows
+    windows = []
+    for _, start, end in sorted(loci, key=lambda x: x[1]):
+        start, end = max(start - 1 - args.flank, 0), min(end + args.flank, len(genome))
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+else:
+    windows = [[0, len(genome)]]
+
+results = {
+    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    "config": {
+        **{
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("work_dir", "output", "stage", "docker")
+        },
+        "stages": stages,
+        "images": {stage: containers[stage][0] for stage in stages},
+        "planted_variants": [list(x) for x in variants],
+    },
+    "datasets": [],
+    "results": [],
+}
+for depth in args.depth:
+    data_dir = f"{work_dir}/depth-{depth}"
+    dataset = prepare_dataset(genome, variants, windows, depth, args, data_dir)
+    results["datasets"].append(
+        {"depth": depth, **{k: v for k, v in dataset.items() if k != "params"}}
+    )
+    bam_stages = ["one-hot-aligned", "variants-freebayes", "variants-pileup"]
+    if any(stage in stages for stage in bam_stages):
+        # the aligned-read containers need the BAM of the mapping pipeline
+        bam_exists = os.path.exists(f"{data_dir}/reads.sorted.bam")
+        if "mapping" not in stages and not bam_exists:
+            log(f"aligning the reads for depth {depth}")
+            run_dir = f"{data_dir}/alignment-{time.time_ns()}"
+            image, _ = containers["mapping"]
+            cmd = stage_command("mapping", None, data_dir, max(args.threads))
+            run_stage(image, cmd, work_dir, run_dir, args.docker)
+            for ext in ("", ".bai"):
+                os.replace(
+                    f"{run_dir}/reads.sorted.bam{ext}",
+                    f"{data_dir}/reads.sorted.bam{ext}",
+                )
+    for threads in args.threads:
+        for stage in stages:
+            if stage not in THREADED_STAGES and threads != args.threads[0]:
+                continue
+            # the variants container is single-threaded
+            n_threads = threads if stage in THREADED_STAGES else 1
+            for run in range(args.runs):
+                image, entrypoint = containers[stage]
+                desc = f"depth {depth}, threads {n_threads}, run {run + 1}"
+                log(f"running {stage} ({desc})")
+                run_dir = f"{data_dir}/{stage}-t{n_threads}-{time.time_ns()}"
+                metrics = run_stage(
+                    image,
+                    stage_command(stage, entrypoint, data_dir, n_threads),
+                    work_dir,
+                    run_dir,
+                    args.docker,
+                )
+                if metrics["exit_code"] == 0 and stage == "mapping":
+                    # keep the BAM for the aligned-read containers
+                    for ext in ("", ".bai"):
+                        os.replace(
+                            f"{run_dir}/reads.sorted.bam{ext}",
+                            f"{data_dir}/reads.sorted.bam{ext}",
+                        )
+                elif metrics["exit_code"] == 0:
+                    metrics["accuracy"] = evaluate(stage, run_dir, truth)
+                else:
+                    log(f"{stage} failed (see {run_dir}/stderr.txt)")
+                results["results"].append(
+                    {
+                        "stage": stage,
+                        "image": image,
+                        "depth": depth,
+                        "threads": n_threads,
+                        "run": run + 1,
+                        **metrics,
+                    }
+                )
+                # write the results after every run so that they aren't lost if the
+                # benchmark is interrupted
+                with open(output, "w") as f:
+                    json.dump(results, f, indent=2)
+                log(
+                    f"{stage}: {metrics.get('wall_time', float('nan')):.1f}s wall, "
+                    f"{metrics.get('cpu_time', float('nan')):.1f}s CPU, "
+                    f"{metrics.get('max_rss_mb', float('nan')):.0f}MB peak RSS"
+                )
+log(f"wrote the results to {output}")
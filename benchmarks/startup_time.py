@@ -0,0 +1,130 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+"""
+Measures the start-up latency of the prediction containers for the different modes of
+their CLIs. Every run is a separate `docker run --rm ...` (like a pipeline would call
+the container), so the timings include starting the container. The image names and
+versions are taken from the labels in the Dockerfiles; the images need to be built (or
+pulled) beforehand.
+
+The modes are
+
+* `metadata`: `--get-target-loci` / `--get-target-vars` (queried by the orchestrator
+  for every job)
+* `help`: `--help`
+* `arg-error`: no arguments (the CLI exits with a usage error)
+* `predict`: a full prediction (only if an input file was passed with `--input`)
+
+For each image and mode, the time of the first run and the median, min, and max of the
+following runs are written to STDOUT as CSV.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREDICTORS = {
+    "neural_net_from_one_hot_encoded_seqs_13_drugs": "--get-target-loci",
+    "aggreen-mtb-cnn": "--get-target-loci",
+    "random_forest_from_variants_streptomycin": "--get-target-vars",
+}
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def get_image(container):
+    """
+    Reads the image name and version from the labels in the Dockerfile (like
+    `docker-check-version-build-push.sh`) and returns the image tag.
+    """
+    with open(f"{REPO_DIR}/predictors/{container}/Dockerfile") as f:
+        dockerfile = f.read()
+    name = re.search(r'^LABEL image.name="(.+)"$', dockerfile, re.M).group(1)
+    version = re.search(r'^LABEL software.version="(.+)"$', dockerfile, re.M).group(1)
+    return f"{name}:v{version}"
+
+
+def time_run(image, args, data_dir=None):
+    """
+    Runs the container once and returns the wall-clock time in seconds as well as the
+    exit code.
+    """
+    cmd = ["docker", "run", "--rm"]
+    if data_dir is not None:
+        cmd += ["-v", f"{data_dir}:/data"]
+    start = time.perf_counter()
+    p = subprocess.run(
+        cmd + [image] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start, p.returncode
+
+
+parser = argparse.ArgumentParser(
+    description="""
+    Benchmark the start-up time of the prediction containers for the metadata commands
+    ('--get-target-loci' / '--get-target-vars'), '--help', argument errors, and
+    (optionally) a full prediction. Writes the timings (in seconds) as CSV to STDOUT.
+    """
+)
+parser.add_argument(
+    "-n",
+    "--runs",
+    type=check_positive_int,
+    default=5,
+    metavar="INT",
+    help="number of runs per image and mode after the first [default: %(default)d]",
+)
+parser.add_argument(
+    "-c",
+    "--container",
+    choices=list(PREDICTORS),
+    action="append",
+    help="only benchmark this container (can be passed multiple times)",
+)
+parser.add_argument(
+    "--input",
+    action="append",
+    default=[],
+    metavar="CONTAINER=FILE",
+    help=(
+        "input file for benchmarking a full prediction with a container (its directory "
+        "is mounted as `/data`; can be passed multiple times)"
+    ),
+)
+args = parser.parse_args()
+
+inputs = dict(x.split("=", 1) for x in args.input)
+print("container,mode,exit_code,first_run,median,min,max")
+for container in args.container or PREDICTORS:
+    image = get_image(container)
+    modes = {
+        "metadata": ([PREDICTORS[container], "-o", "/tmp/out.csv"], None),
+        "help": (["--help"], None),
+        "arg-error": ([], None),
+    }
+    if container in inputs:
+        input_file = os.path.abspath(inputs[container])
+        modes["predict"] = (
+            [os.path.basename(input_file)],
+            os.path.dirname(input_file),
+        )
+    for mode, (cmd_args, data_dir) in modes.items():
+        first, exit_code = time_run(image, cmd_args, data_dir)
+        times = [time_run(image, cmd_args, data_dir)[0] for _ in range(args.runs)]
+        print(
+            f"{container},{mode},{exit_code},{first:.3f},"
+            f"{statistics.median(times):.3f},{min(times):.3f},{max(times):.3f}"
+        )
+        sys.stdout.flush()
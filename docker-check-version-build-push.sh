@@ -22,6 +22,21 @@ get_img_name_from_dockerfile() {
 
 }
 
+copy_shared_modules() {
+    # the modules and scripts in `shared` are used by several containers; copy them into
+    # the `scripts` directory of a build context so that the Dockerfile can pick them up
+    cp shared/*.py shared/*.sh "$1/scripts/"
+}
+
+smoke_test_image() {
+    # start the CLI (and the prediction server if the image has one) with `--help` so
+    # that an image missing any of the modules the scripts import isn't pushed
+    docker run --rm "$1" --help >/dev/null || return 1
+    if grep -q '"serve"' "$2/scripts/entrypoint.sh"; then
+        docker run --rm "$1" serve --help >/dev/null || return 1
+    fi
+}
+
 push_docker_if_new_version() {
     new_tag="v$(get_version_from_dockerfile "$1")"
     name="$(get_img_name_from_dockerfile  "$1")"
@@ -36,7 +51,12 @@ push_docker_if_new_version() {
         return
     else
         echo "Version changed for $img_tag --> build and push"
-        docker build -t "$img_tag" "$(dirname "$1")"
+        copy_shared_modules "$(dirname "$1")"
+        docker build -t "$img_tag" "$(dirname "$1")" || return 1
+        if ! smoke_test_image "$img_tag" "$(dirname "$1")"; then
+            echo "The smoke test of $img_tag failed --> don't push"
+            return 1
+        fi
         docker tag "$img_tag" "$name:latest"
         docker push "$img_tag"
         docker push "$name:latest"
@@ -46,6 +66,13 @@ push_docker_if_new_version() {
 export -f get_tags_from_docker_hub
 export -f get_version_from_dockerfile
 export -f get_img_name_from_dockerfile
+export -f copy_shared_modules
+export -f smoke_test_image
 export -f push_docker_if_new_version
-# get version
-find . -name Dockerfile -exec bash -c 'push_docker_if_new_version $1' shell {} \;
+# build, test, and push the images whose version changed (and fail if building or
+# testing any of them failed)
+status=0
+while read -r dockerfile; do
+    push_docker_if_new_version "$dockerfile" || status=1
+done < <(find . -name Dockerfile)
+exit $status
@@ -0,0 +1,604 @@
+import argparse
+import concurrent.futures
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+"""
+Runs a chain of containers (e.g. `--get-target-loci` --> one-hot-encoding of raw reads
+--> neural network) for all samples of a cohort. The chain is defined in a JSON file
+(see `chains/` for examples) with a list of stages that have one of three scopes:
+
+* `once`: runs a single time for the whole cohort (e.g. querying the target loci from a
+  predictor)
+* `sample`: runs once per sample (e.g. the preprocessing containers)
+* `batch`: runs for batches of samples (e.g. the predictors in batch mode); the samples
+  are collected as they become ready and are passed via a manifest file or a genotype
+  matrix created by the orchestrator
+
+The arguments of a stage can hold placeholders which are replaced before running it:
+`{out}` (the output directory of the job), `{threads}` (the number of cores assigned to
+it), `{cache}` (a cache directory shared by all jobs, e.g. for the result caches of the
+preprocessing containers), `{sample}` (the sample name), `{sample.COLUMN}` (a column of
+the sample sheet),
+`{STAGE.OUTPUT}` (an output of another stage for the same sample or of a `once` stage),
+and, for `batch` stages, `{manifest:STAGE.OUTPUT}` (a file listing that output for all
+samples in the batch) and `{matrix:STAGE.OUTPUT}` (a genotype matrix with one row per
+sample combined from per-sample `POS,REF,ALT,GT` CSVs).
+
+Jobs are started as soon as their inputs are ready and there are enough cores and
+memory left in the global budget. Stages later in the chain take precedence so that
+e.g. sample N is predicted while sample N + 1 is still being aligned. Every job runs in
+its own directory (`OUTDIR/STAGE/SAMPLE`, `OUTDIR/STAGE`, or `OUTDIR/STAGE/batch-*`)
+which is also the working directory of the container. A marker file is written when a
+job has finished successfully and jobs with a marker for the same command are skipped
+when the cohort is run again (unless one of their inputs has been recomputed). Failed
+samples don't stop the other samples. The results of `batch` stages (CSV files with the
+sample names in the first column) are merged into `OUTDIR/STAGE/OUTPUT` at the end.
+"""
+
+SCOPES = ["once", "sample", "batch"]
+DONE_MARKER = ".done"
+PLACEHOLDER = re.compile(r"\{([^{}]+)\}")
+SAMPLE_NAME = re.compile(r"^[\w.-]+$")
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def log(msg):
+    print(f"[{time.strftime('%H:%M:%S')}] {msg}", file=sys.stderr, flush=True)
+
+
+def job_name(name, sample):
+    return name if sample is None else f"{name} {sample}"
+
+
+def read_chain(filename):
+    """
+    Reads the chain definition, fills in the defaults, and checks that the stages only
+    reference outputs they can use. Returns the stages as a dict keyed by stage name (in
+    the order of the chain).
+    """
+    with open(filename) as f:
+        chain = json.load(f)
+    stages = {}
+    for stage in chain["stages"]:
+        name = stage["name"]
+        if name in stages:
+            raise ValueError(f"Duplicate stage name '{name}'")
+        stage = {
+            "scope": "sample",
+            "cores": 1,
+            "memory": 1,
+            "batch_size": 32,
+            "outputs": {},
+            **stage,
+        }
+        if stage["scope"] not in SCOPES:
+            raise ValueError(f"Scope of stage '{name}' must be one of {SCOPES}")
+        if stage["cores"] < 1 or stage["memory"] <= 0 or stage["batch_size"] < 1:
+            raise ValueError(f"Invalid resources or batch size for stage '{name}'")
+        # get the stages referenced in the arguments (they need to run first)
+        stage["deps"] = []
+        for arg in stage["args"]:
+            for token in PLACEHOLDER.findall(arg):
+                kind, _, ref = token.rpartition(":")
+                dep, _, output = ref.partition(".")
+                if dep in ("out", "threads", "cache", "sample"):
+                    if kind or (dep == "sample" and stage["scope"] != "sample"):
+                        raise ValueError(f"Invalid placeholder '{{{token}}}' in {name}")
+                    continue
+                if dep not in stages or output not in stages[dep]["outputs"]:
+                    raise ValueError(
+                        f"Stage '{name}' references unknown output '{ref}' (only "
+                        "outputs of earlier stages can be used)"
+                    )
+                dep_scope = stages[dep]["scope"]
+                # per-sample outputs can only be used by `sample` stages directly and
+                # by `batch` stages via a manifest / matrix
+                valid = (
+                    dep_scope == "once"
+                    and not kind
+                    or dep_scope == "sample"
+                    and (
+                        stage["scope"] == "sample"
+                        and not kind
+                        or stage["scope"] == "batch"
+                        and kind in ("manifest", "matrix")
+                    )
+                )
+                if not valid:
+                    raise ValueError(f"Invalid placeholder '{{{token}}}' in {name}")
+                if dep not in stage["deps"]:
+                    stage["deps"].append(dep)
+        stage["hash"] = hashlib.sha1(
+            json.dumps(
+                {k: stage[k] for k in ("image", "args", "outputs")}, sort_keys=True
+            ).encode()
+        ).hexdigest()
+        stages[name] = stage
+    return stages
+
+
+def read_sample_sheet(filename):
+    """
+    Reads the sample sheet (a CSV with a `sample` column and arbitrary further columns,
+    e.g. `fastq_1,fastq_2` or `bam`). Values that are paths of existing files (relative
+    to the directory of the sample sheet or absolute) are turned into absolute paths.
+    Returns a dict of dicts keyed by sample name.
+    """
+    sheet_dir = os.path.dirname(os.path.abspath(filename))
+    samples = {}
+    with open(filename, newline="") as f:
+        for row in csv.DictReader(f):
+            name = row.pop("sample")
+            if not SAMPLE_NAME.match(name) or name in samples:
+                raise ValueError(f"Sample names must be unique and valid: '{name}'")
+            for col, val in row.items():
+                path = os.path.join(sheet_dir, val)
+                if val and os.path.exists(path):
+                    row[col] = os.path.abspath(path)
+            samples[name] = row
+    return samples
+
+
+def write_matrix(files, filename):
+    """
+    Combines per-sample variant files (`POS,REF,ALT,GT` as written by
+    `variants_from_aligned_reads`) into a genotype matrix with one row per sample and
+    one column per variant (named `POS_REF_ALT`) as expected by the random forest
+    predictor.
+    """
+    columns = None
+    with open(filename, "w", newline="") as f_out:
+        writer = csv.writer(f_out)
+        for sample, file in files.items():
+            with open(file, newline="") as f:
+                rows = list(csv.DictReader(f))
+            cols = ["_".join((r["POS"], r["REF"], r["ALT"])) for r in rows]
+            if columns is None:
+                columns = cols
+                writer.writerow(["sample"] + columns)
+            elif cols != columns:
+                raise ValueError(f"Variants in {file} differ from the other samples")
+            writer.writerow([sample] + [r["GT"] for r in rows])
+
+
+def write_marker(workdir, marker):
+    # write to a temporary file first so that there is never a partial marker
+    tmp_file = f"{workdir}/{DONE_MARKER}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(marker, f)
+    os.replace(tmp_file, f"{workdir}/{DONE_MARKER}")
+
+
+def read_marker(workdir):
+    try:
+        with open(f"{workdir}/{DONE_MARKER}") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+class Cohort:
+    """
+    Holds the chain, the samples, and the state of all jobs (one per `once` stage and
+    one per sample for `sample` and `batch` stages), and builds and runs the docker
+    commands.
+    """
+
+    def __init__(
+        self, stages, samples, outdir, cache_dir, docker="docker", docker_args=()
+    ):
+        self.stages = stages
+        self.samples = samples
+        self.outdir = outdir
+        self.cache_dir = cache_dir
+        self.docker = docker
+        self.docker_args = list(docker_args)
+        # the state of each job is one of 'pending', 'running', 'done', or 'failed'
+        self.state = {}
+        for name, stage in stages.items():
+            for sample in [None] if stage["scope"] == "once" else samples:
+                self.state[(name, sample)] = "pending"
+        # jobs run in this invocation (jobs depending on them are never skipped) and
+        # jobs that have been checked for results of previous runs already
+        self.executed = set()
+        self.checked = set()
+        self.n_batches = 0
+        # the samples in the completed batches of previous runs
+        self.previous_batches = {
+            name: {
+                sample: marker
+                for marker in self.batch_markers(name).values()
+                for sample in marker["samples"]
+            }
+            for name, stage in stages.items()
+            if stage["scope"] == "batch"
+        }
+        # the output directory, the cache directory, and the directories of the input
+        # files are mounted at the same paths inside the containers
+        self.mounts = [outdir, cache_dir] + sorted(
+            {
+                os.path.dirname(val)
+                for sample in samples.values()
+                for val in sample.values()
+                if os.path.isabs(val) and os.path.exists(val)
+            }
+        )
+
+    def workdir(self, name, sample):
+        if self.stages[name]["scope"] == "once":
+            return f"{self.outdir}/{name}"
+        return f"{self.outdir}/{name}/{sample}"
+
+    def new_batch_dir(self, name):
+        # the counter starts at 1 in every run --> skip the directories of previous
+        # runs started within the same second
+        while True:
+            self.n_batches += 1
+            batch_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{self.n_batches}"
+            batch_dir = f"{self.outdir}/{name}/batch-{batch_id}"
+            if not os.path.exists(batch_dir):
+                return batch_dir
+
+    def output(self, name, sample, output):
+        template = self.stages[name]["outputs"][output]
+        return f"{self.workdir(name, sample)}/{template.format(sample=sample)}"
+
+    def dep_keys(self, name, sample):
+        return [
+            (dep, None if self.stages[dep]["scope"] == "once" else sample)
+            for dep in self.stages[name]["deps"]
+        ]
+
+    def deps_state(self, name, sample):
+        """
+        Returns 'failed' if any of the inputs of a job have failed, 'done' if all of
+        them are done, and 'waiting' otherwise.
+        """
+        states = [self.state[key] for key in self.dep_keys(name, sample)]
+        if "failed" in states:
+            return "failed"
+        return "done" if all(state == "done" for state in states) else "waiting"
+
+    def is_done(self, name, sample):
+        """
+        Checks whether a job has been completed in a previous run (with the same stage
+        definition and command) and none of its inputs have been recomputed since.
+        """
+        if any(key in self.executed for key in self.dep_keys(name, sample)):
+            return False
+        stage = self.stages[name]
+        if stage["scope"] == "batch":
+            marker = self.previous_batches[name].get(sample)
+            return marker is not None and marker["stage"] == stage["hash"]
+        workdir = self.workdir(name, sample)
+        marker = read_marker(workdir)
+        return (
+            marker is not None
+            and marker["stage"] == stage["hash"]
+            and marker["command"] == self.build_command(name, sample, workdir, False)
+        )
+
+    def ready_jobs(self):
+        """
+        Returns the jobs whose inputs are ready (as tuples of stage name and sample or
+        list of samples for `batch` stages) in the order of precedence (later stages
+        first). Jobs with failed inputs are marked as failed and jobs completed in a
+        previous run as done on the way. Samples of `batch` stages are grouped into full
+        batches (or a smaller batch if no more samples can become ready).
+        """
+        while True:
+            jobs = []
+            changed = False
+            for name in reversed(self.stages):
+                stage = self.stages[name]
+                ready = []
+                waiting = False
+                for sample in [None] if stage["scope"] == "once" else self.samples:
+                    key = (name, sample)
+                    if self.state[key] != "pending":
+                        continue
+                    deps = self.deps_state(name, sample)
+                    if deps == "waiting":
+                        waiting = True
+                        continue
+                    if deps == "failed":
+                        self.state[key] = "failed"
+                        changed = True
+                        continue
+                    if key not in self.checked:
+                        self.checked.add(key)
+                        if self.is_done(name, sample):
+                            log(f"{job_name(name, sample)}: done in a previous run")
+                            self.state[key] = "done"
+                            changed = True
+                            continue
+                    ready.append(sample)
+                if stage["scope"] != "batch":
+                    jobs.extend((name, sample) for sample in ready)
+                    continue
+                size = stage["batch_size"]
+                while len(ready) >= size or ready and not waiting:
+                    jobs.append((name, ready[:size]))
+                    ready = ready[size:]
+            # skipped or failed jobs might make other jobs ready or fail too
+            if not changed:
+                return jobs
+
+    def build_command(self, name, samples, workdir, write_inputs=True):
+        """
+        Replaces the placeholders in the arguments of a stage and returns the docker
+        command. The manifest files and genotype matrices of `batch` stages are written
+        to the working directory (unless `write_inputs=False`).
+        """
+        stage = self.stages[name]
+
+        def replace(match):
+            kind, _, ref = match.group(1).rpartition(":")
+            dep, _, output = ref.partition(".")
+            if dep == "out":
+                return workdir
+            if dep == "threads":
+                return str(stage["cores"])
+            if dep == "cache":
+                return self.cache_dir
+            if dep == "sample":
+                return self.samples[samples][output] if output else samples
+            if not kind:
+                return self.output(dep, samples, output)
+            files = {sample: self.output(dep, sample, output) for sample in samples}
+            if kind == "manifest":
+                filename = f"{workdir}/manifest-{dep}-{output}.txt"
+                if write_inputs:
+                    with open(filename, "w") as f:
+                        f.writelines(f"{file}\n" for file in files.values())
+            else:
+                filename = f"{workdir}/matrix-{dep}-{output}.csv"
+                if write_inputs:
+                    write_matrix(files, filename)
+            return filename
+
+        args = [PLACEHOLDER.sub(replace, arg) for arg in stage["args"]]
+        cmd = [self.docker, "run", "--rm"]
+        cmd += ["--cpus", str(stage["cores"]), "--memory", f"{stage['memory']}g"]
+        for mount in self.mounts:
+            cmd += ["-v", f"{mount}:{mount}"]
+        return cmd + ["-w", workdir] + self.docker_args + [stage["image"]] + args
+
+    def run_job(self, name, samples, workdir, dry_run=False):
+        """
+        Runs a single job in a fresh working directory (STDOUT and STDERR of the
+        container go to `stdout.txt` and `stderr.txt` in there) and writes the marker if
+        it succeeded. Returns the exit code. Only prints the command with `dry_run`.
+        """
+        if dry_run:
+            print(" ".join(self.build_command(name, samples, workdir, False)))
+            return 0
+        # files written by the containers might belong to root and can't always be
+        # removed --> they are overwritten instead
+        shutil.rmtree(workdir, ignore_errors=True)
+        os.makedirs(workdir, exist_ok=True)
+        cmd = self.build_command(name, samples, workdir)
+        with open(f"{workdir}/stdout.txt", "w") as out, open(
+            f"{workdir}/stderr.txt", "w"
+        ) as err:
+            returncode = subprocess.run(cmd, stdout=out, stderr=err).returncode
+        if returncode == 0:
+            marker = {"stage": self.stages[name]["hash"], "command": cmd}
+            if self.stages[name]["scope"] == "batch":
+                marker.update(samples=samples, finished=time.time())
+            write_marker(workdir, marker)
+        return returncode
+
+    def batch_markers(self, name):
+        """
+        Returns the markers of the completed batches of a `batch` stage with the current
+        stage definition as a dict keyed by the batch directories (oldest first).
+        """
+        stage_dir = f"{self.outdir}/{name}"
+        markers = {}
+        if os.path.isdir(stage_dir):
+            for batch_dir in os.listdir(stage_dir):
+                if not batch_dir.startswith("batch-"):
+                    continue
+                marker = read_marker(f"{stage_dir}/{batch_dir}")
+                if marker is not None and marker["stage"] == self.stages[name]["hash"]:
+                    markers[f"{stage_dir}/{batch_dir}"] = marker
+        return dict(sorted(markers.items(), key=lambda x: x[1]["finished"]))
+
+    def merge_batches(self, name):
+        """
+        Merges the outputs of the batches of a `batch` stage (CSV files with the sample
+        names in the first column) into `OUTDIR/STAGE/OUTPUT` in the order of the sample
+        sheet. Samples that have been processed more than once (because their inputs
+        were recomputed) are taken from the latest batch.
+        """
+        for template in self.stages[name]["outputs"].values():
+            header, rows = None, {}
+            for batch_dir in self.batch_markers(name):
+                with open(f"{batch_dir}/{template}", newline="") as f:
+                    reader = csv.reader(f)
+                    header = next(reader)
+                    rows.update((row[0], row) for row in reader)
+            if header is None:
+                continue
+            with open(f"{self.outdir}/{name}/{template}", "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows[s] for s in self.samples if s in rows)
+
+
+def run_cohort(cohort, cores, memory, dry_run=False):
+    """
+    Runs all jobs within the budget of cores and memory (in GB) and returns the number
+    of failed jobs.
+    """
+    free = {"cores": cores, "memory": memory}
+    running = {}
+    n_failed = 0
+    with concurrent.futures.ThreadPoolExecutor(cores) as pool:
+        while True:
+            # start the ready jobs in the order of precedence as long as they fit into
+            # the budget; the first job that doesn't fit reserves its resources so that
+            # it isn't starved by smaller jobs further down the list
+            reserved = dict.fromkeys(free, 0)
+            for name, samples in cohort.ready_jobs():
+                stage = cohort.stages[name]
+                if any(stage[res] > free[res] - reserved[res] for res in free):
+                    if not any(reserved.values()):
+                        reserved = {res: stage[res] for res in free}
+                    continue
+                if stage["scope"] == "batch":
+                    keys = [(name, sample) for sample in samples]
+                    workdir = cohort.new_batch_dir(name)
+                    desc = f"{name} ({len(samples)} samples)"
+                else:
+                    keys = [(name, samples)]
+                    workdir = cohort.workdir(name, samples)
+                    desc = job_name(name, samples)
+                for key in keys:
+                    cohort.state[key] = "running"
+                for res in free:
+                    free[res] -= stage[res]
+                log(f"starting {desc}")
+                future = pool.submit(cohort.run_job, name, samples, workdir, dry_run)
+                running[future] = (name, keys, desc, workdir, time.time())
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                name, keys, desc, workdir, start = running.pop(future)
+                for res in free:
+                    free[res] += cohort.stages[name][res]
+                try:
+                    returncode = future.result()
+                except Exception as e:
+                    returncode = repr(e)
+                state = "done" if returncode == 0 else "failed"
+                for key in keys:
+                    cohort.state[key] = state
+                    cohort.executed.add(key)
+                if state == "done":
+                    log(f"finished {desc} in {time.time() - start:.1f}s")
+                else:
+                    n_failed += 1
+                    log(f"FAILED {desc} ({returncode}); see {workdir}/stderr.txt")
+    return n_failed
+
+
+parser = argparse.ArgumentParser(
+    description="""
+    Run a chain of containers (defined in a JSON file) for all samples in a sample sheet
+    (a CSV with a 'sample' column and the input files of each sample). Stages are
+    pipelined across samples within a global budget of cores and memory, predictor
+    stages can be run on batches of samples, and completed jobs are skipped when the
+    same cohort is run again (e.g. after a failure).
+    """
+)
+parser.add_argument("chain", metavar="CHAIN", help="chain definition (JSON) [required]")
+parser.add_argument(
+    "sample_sheet", metavar="SAMPLE_SHEET", help="sample sheet (CSV) [required]"
+)
+parser.add_argument(
+    "-o",
+    "--outdir",
+    type=str,
+    required=True,
+    metavar="DIR",
+    help="output directory (one subdirectory per stage) [required]",
+)
+parser.add_argument(
+    "-c",
+    "--cores",
+    type=check_positive_int,
+    default=os.cpu_count(),
+    metavar="INT",
+    help="number of cores to use for all jobs together [default: %(default)d]",
+)
+parser.add_argument(
+    "-m",
+    "--memory",
+    type=float,
+    default=os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3,
+    metavar="GB",
+    help="memory to use for all jobs together [default: all (%(default).1f)]",
+)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "cache directory shared by all jobs (e.g. between cohorts) and passed to the "
+        "stages via '{cache}' [default: OUTDIR/cache]"
+    ),
+)
+parser.add_argument(
+    "--docker",
+    type=str,
+    default="docker",
+    metavar="CMD",
+    help="docker executable (e.g. 'podman') [default: %(default)s]",
+)
+parser.add_argument(
+    "--docker-arg",
+    action="append",
+    default=[],
+    dest="docker_args",
+    metavar="ARG",
+    help="extra argument for 'docker run' (e.g. '--docker-arg=--user=1000:1000')",
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="only print the commands (as if all jobs succeeded)",
+)
+args = parser.parse_args()
+
+try:
+    stages = read_chain(args.chain)
+    samples = read_sample_sheet(args.sample_sheet)
+except (ValueError, KeyError) as e:
+    parser.error(f"Invalid chain definition or sample sheet: {e}")
+for name, stage in stages.items():
+    if stage["cores"] > args.cores or stage["memory"] > args.memory:
+        parser.error(f"Stage '{name}' needs more cores or memory than available")
+
+outdir = os.path.abspath(args.outdir)
+cache_dir = os.path.abspath(args.cache_dir or f"{outdir}/cache")
+if not args.dry_run:
+    os.makedirs(cache_dir, exist_ok=True)
+cohort = Cohort(stages, samples, outdir, cache_dir, args.docker, args.docker_args)
+n_failed = run_cohort(cohort, args.cores, args.memory, args.dry_run)
+if not args.dry_run:
+    for name, stage in stages.items():
+        if stage["scope"] == "batch":
+            cohort.merge_batches(name)
+
+# summarize the state of all stages
+for name, stage in stages.items():
+    states = [state for (job, _), state in cohort.state.items() if job == name]
+    log(
+        f"{name}: {states.count('done')} done, {states.count('failed')} failed "
+        f"({stage['scope']})"
+    )
+if n_failed:
+    sys.exit(f"{n_failed} job(s) failed")
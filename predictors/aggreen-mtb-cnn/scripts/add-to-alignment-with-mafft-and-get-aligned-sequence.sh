@@ -1,15 +1,18 @@
 #!/bin/bash
+# set flags for "strict" mode
+set -Eeuo pipefail
 
 input_fasta=$1
 alignment_file=$2
 
-input_seq_id=$(sed -n '1s/>//p' "$input_fasta")
+# `measure NAME CMD [ARGS...]` records the resource usage of a command if
+# instrumentation is enabled
+source "$(dirname "${BASH_SOURCE[0]}")/measure.sh"
 
-# add the consensus to the MSA
-mafft --add "$input_fasta" \
-    --keeplength \
-    "$alignment_file" \
-    >alignment.fa
+input_seq_id=$(sed -n '1s/>//p' "$input_fasta" | cut -d ' ' -f 1)
 
-samtools faidx alignment.fa
-samtools faidx alignment.fa "$input_seq_id" | sed 1d
+# add the consensus to the MSA and only print the aligned input sequence (without header)
+measure mafft mafft --add "$input_fasta" \
+    --keeplength \
+    "$alignment_file" |
+    awk -v id="$input_seq_id" '/^>/ {keep = (substr($1, 2) == id); next} keep'
@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import hashlib
+import functools
+import threading
+
+"""
+On-disk cache for sequences that were added to the alignments with mafft. Entries are
+keyed by the locus, the hash of the input sequence, and the checksum of the alignment
+file and hold the aligned sequence. Each entry is a separate file that is written
+atomically (write to a temporary file + rename) so that the cache can be shared between
+concurrent container runs via a mounted volume. Reading an entry updates its mtime; when
+the cache grows beyond the size limit, the least recently used entries are removed.
+Temporary files left behind by interrupted writes are removed as well.
+"""
+
+# temporary files older than this (in seconds) are left over from interrupted writes
+# (writing an entry only takes milliseconds)
+STALE_TMP_AGE = 3600
+
+
+@functools.lru_cache(maxsize=None)
+def file_checksum(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        # already removed by a concurrent run
+        pass
+
+
+class AlignmentCache:
+    def __init__(self, cache_dir, max_size_mb):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024**2
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # clean up after runs that were interrupted
+        self.evict()
+
+    def path(self, locus, seq, alignment_file):
+        key = hashlib.sha256(
+            f"{locus}\0{file_checksum(alignment_file)}\0{seq}".encode()
+        ).hexdigest()
+        return f"{self.cache_dir}/{locus}-{key}.aln"
+
+    def get(self, locus, seq, alignment_file):
+        """
+        Returns the cached aligned sequence or `None` if there is no entry.
+        """
+        path = self.path(locus, seq, alignment_file)
+        try:
+            with open(path) as f:
+                aligned = f.read()
+            # mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # the entry might also have been evicted by another run in the meantime
+            aligned = None
+        with self._lock:
+            if aligned is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return aligned
+
+    def put(self, locus, seq, alignment_file, aligned):
+        path = self.path(locus, seq, alignment_file)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(aligned)
+            os.replace(tmp_path, path)
+        except BaseException:
+            # e.g. a full disk or an interrupt (a killed process still leaves the file
+            # behind, which is removed by `evict` later)
+            remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes stale temporary files and then the least recently used entries until the
+        cache (including the temporary files of writes still in progress) is below the
+        size limit.
+        """
+        entries = []
+        total_size = 0
+        now = time.time()
+        for entry in os.scandir(self.cache_dir):
+            is_tmp = entry.name.endswith(".tmp")
+            if not is_tmp and not entry.name.endswith(".aln"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if is_tmp and now - stat.st_mtime > STALE_TMP_AGE:
+                remove(entry.path)
+                continue
+            total_size += stat.st_size
+            # temporary files of concurrent writes are counted, but not removed
+            if not is_tmp:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            remove(path)
+            total_size -= size
+
+    def report(self):
+        print(
+            f"alignment cache: {self.hits} hits, {self.misses} misses",
+            file=sys.stderr,
+        )
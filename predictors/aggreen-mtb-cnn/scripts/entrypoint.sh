@@ -1,3 +1,11 @@
 #!/bin/bash
 
-/usr/local/bin/_entrypoint.sh python /scripts/main.py "$@"
\ No newline at end of file
+# start the prediction server if the first argument is `serve` and run the CLI otherwise
+if [[ $1 == "serve" ]]; then
+    shift
+    exec /usr/local/bin/_entrypoint.sh python /scripts/server.py "$@"
+fi
+
+# replace the shell so that signals (e.g. from `docker stop`) reach Python and the
+# intermediate files are cleaned up
+exec /usr/local/bin/_entrypoint.sh python /scripts/main.py "$@"
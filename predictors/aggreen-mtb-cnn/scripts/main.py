@@ -1,12 +1,19 @@
 # %% ###################################################################
 import argparse
-import subprocess
-import pandas as pd
-import numpy as np
-import tensorflow as tf
 import shutil
 import sys
-from Bio import SeqIO
+import instrumentation
+from alignment_cache import AlignmentCache
+from model import (
+    TARGET_LOCI_FILE,
+    check_input_seqs,
+    align_seqs,
+    one_hot_encode,
+    load_model,
+    predict,
+    format_prediction,
+)
+from workdir import make_workdir
 
 """
 Entrypoint for a Docker container holding a convolutional neural network created by
@@ -22,75 +29,16 @@ Run with the name of the input FASTA file as sole argument to generate the predi
 and write the result to STDOUT.
 """
 
-# mapping to use for one-hot encoding
-ONE_HOT_BASE_ORDER = {"A": 0, "C": 1, "T": 2, "G": 3, "-": 4}
-# order of loci as expected by the model
-LOCUS_ORDER = [
-    "acpM-kasA",
-    "gid",
-    "rpsA",
-    "clpC",
-    "embCAB",
-    "aftB-ubiA",
-    "rrs-rrl",
-    "ethAR",
-    "oxyR-ahpC",
-    "tlyA",
-    "katG",
-    "rpsL",
-    "rpoBC",
-    "fabG1-inhA",
-    "eis",
-    "gyrBA",
-    "panD",
-    "pncA",
-]
-# order of drugs in the predicted vector of resistance status
-DRUGS_ORDER = [
-    "RIFAMPICIN",
-    "ISONIAZID",
-    "PYRAZINAMIDE",
-    "ETHAMBUTOL",
-    "STREPTOMYCIN",
-    "LEVOFLOXACIN",
-    "CAPREOMYCIN",
-    "AMIKACIN",
-    "MOXIFLOXACIN",
-    "OFLOXACIN",
-    "KANAMYCIN",
-    "ETHIONAMIDE",
-    "CIPROFLOXACIN",
-]
-# directory where the alignments are stored (not the complete MSAs but only the
-# reference sequence; this is enough for introducing gaps into the target sequences with
-# `mafft --add`)
-ALIGNMENTS_DIR = "/internal_data/alignments"
-
-
-# function of Green et al. used for one-hot encoding
-# (https://github.com/aggreen/MTB-CNN/blob/d1a30ad7464334460dd807b71ea101d9ef6f5e13/sd_cnn/deeplift/tb_cnn_codebase.py#L47)
-def get_one_hot(sequence):
-    """
-    Creates a one-hot encoding of a sequence
-    Parameters
-    ----------
-    sequence: iterable of str
-            Sequence containing only ACTG- characters
-
-    Returns
-    -------
-    np.ndarray of int
-            L (seq len) x 5 one-hot encoded sequence
-    """
 
-    seq_len = len(sequence)
-    seq_in_index = [ONE_HOT_BASE_ORDER.get(b, b) for b in sequence]
-    one_hot = np.zeros((seq_len, 5))
-
-    # Assign the found positions to 1
-    one_hot[np.arange(seq_len), np.array(seq_in_index)] = 1
-
-    return one_hot
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
 
 
 # parse command line arguments
@@ -117,6 +65,42 @@ parser.add_argument(
     nargs="?",
     help="input FASTA file with sequences of the 18 target loci",
 )
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=check_positive_int,
+    metavar="INT",
+    help="number of loci to align with mafft in parallel [default: %(default)d]",
+    default=1,
+)
+parser.add_argument(
+    "--no-fast-path",
+    action="store_false",
+    dest="fast_path",
+    help=(
+        "always add the sequences to the alignments with mafft (by default, sequences "
+        "with only SNPs are projected into the alignments directly)"
+    ),
+)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory for caching sequences aligned with mafft (can be shared between "
+        "runs via a mounted volume); no caching if not provided"
+    ),
+)
+parser.add_argument(
+    "--cache-size",
+    type=check_positive_int,
+    metavar="INT",
+    default=1024,
+    help=(
+        "maximum size of the cache in MB (least recently used entries are removed) "
+        "[default: %(default)d]"
+    ),
+)
 parser.add_argument(
     "-o",
     "--output",
@@ -124,12 +108,38 @@ parser.add_argument(
     metavar="FILE",
     help="file to write the target loci to (required with '--get-target-loci')",
 )
+parser.add_argument(
+    "--workdir",
+    "--scratch",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory in which a unique directory for the intermediate files is created "
+        "and removed afterwards (e.g. a tmpfs mount to keep them in memory) "
+        "[default: $TMPDIR or /tmp]"
+    ),
+)
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage (and of each mafft run) as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="profile the Python code with cProfile and write the stats to this file",
+)
 args = parser.parse_args()
 # check if there are conflicting arguments
 try:
     if args.get_target_loci:
         assert args.file is None and args.output is not None
-        shutil.copyfile("/internal_data/target_loci.csv", args.output)
+        shutil.copyfile(TARGET_LOCI_FILE, args.output)
         sys.exit(0)
     else:
         assert args.file is not None and args.output is None
@@ -139,54 +149,34 @@ except AssertionError:
         "'--get-target-loci' and an output file to get the coordinates of the target "
         "loci."
     )
+instrumentation.init(args.resource_report, args.profile)
+make_workdir(args.workdir)
 
 # we need to add the individual sequences to the alignments used in training with
-# `mafft --add input_seq.fa --keeplength MSA.fa` in order to make sure that gaps are at
-# the right positions etc. --> read the input FASTA first
-input_seqs = list(SeqIO.parse(args.file, "fasta"))
-# make sure the input contains a sequence for each target locus
-if set(r.id for r in input_seqs) != set(LOCUS_ORDER):
-    raise ValueError("Sequence IDs in input FASTA not matching target loci")
-
-# now, for each input sequence use mafft to add it to the corresponding alignment in
-# order to introduce the gaps and one-hot-encode the resulting sequence
-one_hot_seqs = {}
-for seq in input_seqs:
-    alignment_file = f"{ALIGNMENTS_DIR}/{seq.id}.fasta"
-    SeqIO.write(seq, "input-seq.fa", "fasta")
-    aligned_seq = "".join(
-        subprocess.run(
-            [
-                "/bin/bash",
-                "/scripts/add-to-alignment-with-mafft-and-get-aligned-sequence.sh",
-                "input-seq.fa",
-                alignment_file,
-            ],
-            capture_output=True,
-            text=True,
-        ).stdout.split()
-    )
-    one_hot_seqs[seq.id] = get_one_hot(aligned_seq.upper())
-
-# make sure that the length of longest sequence is as expected
-assert (
-    max(len(x) for x in one_hot_seqs.values()) == 10291
-), "Longest aligned sequence has unexpected length"
-
-# combine one-hot-encoded sequences into single np.array of dimensions (1, 5, 10291, 18)
-# while making sure that the order is as expected by the model
-X = np.zeros((1, 5, 10291, 18))
-for i, locus in enumerate(LOCUS_ORDER):
-    one_hot_seq = one_hot_seqs[locus]
-    X[0, :, : len(one_hot_seq), i] = one_hot_seq.T
-
-# now load the model and predict resistance
-m = tf.keras.models.load_model("/internal_data/MDCNN_saved_model", compile=False)
-pred = m.predict(X).ravel()
-# Green et al. encoded resistance as `0` and susceptibility as `1` --> reverse
-res = pd.Series(1 - pred, index=DRUGS_ORDER)
-# determine resistance status ('R', or 'S') and write result to STDOUT
-res = pd.concat((res, res.apply(lambda x: "R" if x > 0.5 else "S")), axis=1)
-res.index.name = "drug"
-res.columns = ["prediction", "resistance_status"]
+# `mafft --add input_seq.fa --keeplength MSA.fa` (or project them directly if they only
+# contain SNPs) in order to make sure that gaps are at the right positions etc. --> read
+# the input FASTA first (Biopython is imported here so that it isn't loaded for
+# `--get-target-loci`)
+with instrumentation.stage("reading input"):
+    from Bio import SeqIO
+
+    input_seqs = list(SeqIO.parse(args.file, "fasta"))
+    check_input_seqs(input_seqs)
+cache = (
+    AlignmentCache(args.cache_dir, args.cache_size)
+    if args.cache_dir is not None
+    else None
+)
+with instrumentation.stage("alignment"):
+    aligned_seqs = align_seqs(input_seqs, args.threads, args.fast_path, cache)
+with instrumentation.stage("one-hot encoding"):
+    X = one_hot_encode([aligned_seqs])
+if cache is not None:
+    cache.report()
+
+# now load the model, predict resistance and write the result to STDOUT
+with instrumentation.stage("loading model"):
+    m = load_model()
+with instrumentation.stage("predicting"):
+    res = format_prediction(predict(m, X)[0])
 res.to_csv(sys.stdout)
@@ -0,0 +1,222 @@
+import tempfile
+import functools
+import concurrent.futures
+import pandas as pd
+import numpy as np
+import instrumentation
+
+"""
+Model-related code shared by the CLI (`main.py`) and the prediction server
+(`server.py`): adding the input sequences to the MSAs, one-hot encoding, loading the
+model, and predicting. TensorFlow and Biopython are only imported in the functions that
+need them so that `--get-target-loci` and argument errors return quickly.
+"""
+
+# mapping to use for one-hot encoding
+ONE_HOT_BASE_ORDER = {"A": 0, "C": 1, "T": 2, "G": 3, "-": 4}
+# order of loci as expected by the model
+LOCUS_ORDER = [
+    "acpM-kasA",
+    "gid",
+    "rpsA",
+    "clpC",
+    "embCAB",
+    "aftB-ubiA",
+    "rrs-rrl",
+    "ethAR",
+    "oxyR-ahpC",
+    "tlyA",
+    "katG",
+    "rpsL",
+    "rpoBC",
+    "fabG1-inhA",
+    "eis",
+    "gyrBA",
+    "panD",
+    "pncA",
+]
+# order of drugs in the predicted vector of resistance status
+DRUGS_ORDER = [
+    "RIFAMPICIN",
+    "ISONIAZID",
+    "PYRAZINAMIDE",
+    "ETHAMBUTOL",
+    "STREPTOMYCIN",
+    "LEVOFLOXACIN",
+    "CAPREOMYCIN",
+    "AMIKACIN",
+    "MOXIFLOXACIN",
+    "OFLOXACIN",
+    "KANAMYCIN",
+    "ETHIONAMIDE",
+    "CIPROFLOXACIN",
+]
+# directory where the alignments are stored (not the complete MSAs but only the
+# reference sequence; this is enough for introducing gaps into the target sequences with
+# `mafft --add`)
+ALIGNMENTS_DIR = "/internal_data/alignments"
+MODEL_DIR = "/internal_data/MDCNN_saved_model"
+TARGET_LOCI_FILE = "/internal_data/target_loci.csv"
+MAFFT_SCRIPT = "/scripts/add-to-alignment-with-mafft-and-get-aligned-sequence.sh"
+# input sequences with the same length as the reference sequence of the corresponding
+# alignment, at most this fraction of mismatches, and no two mismatches closer than
+# `FAST_PATH_MIN_SNP_DISTANCE` are considered to hold only SNPs and are projected into
+# the alignment directly (without running mafft)
+FAST_PATH_MAX_MISMATCH_FRACTION = 0.01
+FAST_PATH_MIN_SNP_DISTANCE = 10
+# length of the longest aligned sequence (i.e. the second dimension of the model input)
+ALIGNMENT_LENGTH = 10291
+
+# lookup table from ASCII code to the index of the one-hot encoding (same order as in
+# Green et al.: https://github.com/aggreen/MTB-CNN/blob/d1a30ad7464334460dd807b71ea101d9ef6f5e13/sd_cnn/deeplift/tb_cnn_codebase.py#L47);
+# `-1` marks invalid characters
+ONE_HOT_LUT = np.full(256, -1, dtype=np.int8)
+for base, idx in ONE_HOT_BASE_ORDER.items():
+    ONE_HOT_LUT[ord(base)] = idx
+    ONE_HOT_LUT[ord(base.lower())] = idx
+
+
+def check_input_seqs(input_seqs):
+    """
+    Makes sure the input contains a sequence for each target locus.
+    """
+    if set(r.id for r in input_seqs) != set(LOCUS_ORDER):
+        raise ValueError("Sequence IDs in input FASTA not matching target loci")
+
+
+@functools.lru_cache(maxsize=None)
+def get_column_map(locus):
+    """
+    Reads the (gapped) reference sequence from the alignment of a locus and returns the
+    ungapped reference (as `np.ndarray` of bytes), the indices of the alignment columns
+    holding its bases, and the length of the alignment. Computed once per locus.
+    """
+    from Bio import SeqIO
+
+    ref_row = next(SeqIO.parse(f"{ALIGNMENTS_DIR}/{locus}.fasta", "fasta"))
+    ref_row = np.frombuffer(str(ref_row.seq).upper().encode(), np.uint8)
+    columns = np.flatnonzero(ref_row != ord("-"))
+    return ref_row[columns], columns, len(ref_row)
+
+
+def project_seq(seq):
+    """
+    Fast path for sequences without indels: if the input sequence has the same length as
+    the ungapped reference and differs from it only by a few isolated substitutions, it
+    is scattered into the alignment columns of the reference (which is what `mafft --add
+    --keeplength` would do as well). Returns `None` if the fast path can't be used.
+    """
+    ref, columns, alignment_len = get_column_map(seq.id)
+    query = np.frombuffer(str(seq.seq).upper().encode(), np.uint8)
+    if len(query) != len(ref):
+        return None
+    mismatches = np.flatnonzero(query != ref)
+    if len(mismatches) > FAST_PATH_MAX_MISMATCH_FRACTION * len(ref):
+        return None
+    # an insertion and a deletion close to each other keep the length, but shift the
+    # bases in between, which shows up as a cluster of mismatches (mafft would add gaps
+    # there instead) --> only accept isolated substitutions
+    if (np.diff(mismatches) < FAST_PATH_MIN_SNP_DISTANCE).any():
+        return None
+    aligned = np.full(alignment_len, ord("-"), dtype=np.uint8)
+    aligned[columns] = query
+    return aligned.tobytes().decode()
+
+
+def align_seq(seq, fast_path=True, cache=None):
+    """
+    Adds a single input sequence to the corresponding alignment in order to introduce
+    the gaps and returns the aligned sequence. Sequences with only SNPs are projected
+    into the alignment directly (unless `fast_path=False`); all others are looked up in
+    the `AlignmentCache` (if provided) or added with mafft. Uses its own temporary
+    directory so that it can run concurrently with other loci.
+    """
+    if fast_path and (aligned := project_seq(seq)) is not None:
+        return aligned
+    alignment_file = f"{ALIGNMENTS_DIR}/{seq.id}.fasta"
+    seq_str = str(seq.seq).upper()
+    if cache is not None and (
+        aligned := cache.get(seq.id, seq_str, alignment_file)
+    ) is not None:
+        return aligned
+    from Bio import SeqIO
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_fasta = f"{tmp_dir}/input-seq.fa"
+        SeqIO.write(seq, input_fasta, "fasta")
+        aligned = "".join(
+            instrumentation.run(
+                f"mafft ({seq.id})",
+                ["/bin/bash", MAFFT_SCRIPT, input_fasta, alignment_file],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.split()
+        )
+    if cache is not None:
+        cache.put(seq.id, seq_str, alignment_file, aligned)
+    return aligned
+
+
+def align_seqs(input_seqs, threads=1, fast_path=True, cache=None):
+    """
+    Adds the input sequences to the corresponding alignments (running up to `threads`
+    mafft processes at once). Returns a dict mapping the loci to the aligned sequences.
+    """
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        aligned_seqs = pool.map(
+            functools.partial(align_seq, fast_path=fast_path, cache=cache), input_seqs
+        )
+        return {seq.id: aligned for seq, aligned in zip(input_seqs, aligned_seqs)}
+
+
+def one_hot_encode(samples):
+    """
+    One-hot-encodes the aligned sequences of a list of samples (each a dict as returned
+    by `align_seqs`). The bytes of the sequences are mapped with a lookup table and the
+    ones are scattered straight into a single `np.ndarray` of dimensions
+    (N, 5, 10291, 18) as expected by the model (with the loci in `LOCUS_ORDER`).
+    """
+    X = np.zeros((len(samples), 5, ALIGNMENT_LENGTH, len(LOCUS_ORDER)), dtype=np.float32)
+    for n, aligned_seqs in enumerate(samples):
+        # make sure that the length of longest sequence is as expected
+        assert (
+            max(len(x) for x in aligned_seqs.values()) == ALIGNMENT_LENGTH
+        ), "Longest aligned sequence has unexpected length"
+        for i, locus in enumerate(LOCUS_ORDER):
+            idx = ONE_HOT_LUT[np.frombuffer(aligned_seqs[locus].encode(), np.uint8)]
+            if (idx < 0).any():
+                raise ValueError(
+                    f"Aligned sequence of {locus} contains characters other than ACGT-"
+                )
+            X[n, idx, np.arange(len(idx)), i] = 1
+    return X
+
+
+def load_model():
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(MODEL_DIR, compile=False)
+
+
+def predict(m, X):
+    """
+    Predicts the probabilities of resistance against the 13 drugs (in `DRUGS_ORDER`) for
+    a batch of one-hot-encoded samples. Returns an `np.ndarray` of shape (N, 13).
+    """
+    pred = np.asarray(m.predict(X)).reshape(len(X), -1)
+    # Green et al. encoded resistance as `0` and susceptibility as `1` --> reverse
+    return 1 - pred
+
+
+def format_prediction(pred):
+    """
+    Turns the predicted probabilities of a single sample into a `pd.DataFrame` with the
+    probabilities and resistance status ('R' or 'S') for each drug.
+    """
+    res = pd.Series(pred, index=DRUGS_ORDER)
+    # determine resistance status ('R', or 'S')
+    res = pd.concat((res, res.apply(lambda x: "R" if x > 0.5 else "S")), axis=1)
+    res.index.name = "drug"
+    res.columns = ["prediction", "resistance_status"]
+    return res
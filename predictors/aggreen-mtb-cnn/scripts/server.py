@@ -0,0 +1,107 @@
+import io
+import argparse
+import prediction_server
+from Bio import SeqIO
+from alignment_cache import AlignmentCache
+from prediction_server import check_positive_int
+from model import (
+    TARGET_LOCI_FILE,
+    check_input_seqs,
+    align_seqs,
+    one_hot_encode,
+    load_model,
+    predict,
+    format_prediction,
+)
+from workdir import make_workdir
+
+"""
+Long-lived prediction server for the CNN container. The model is loaded only once at
+startup and kept in memory. Prediction requests are accepted over HTTP (on a TCP port or
+a Unix socket) so that clients don't have to pay the TensorFlow import and model loading
+for every sample (see `prediction_server.py` for the server). Endpoints:
+
+GET  /health        returns 'ok'
+GET  /target-loci   returns the target loci CSV (like `--get-target-loci`)
+POST /predict       expects the FASTA file with the sequences of the 18 target loci as
+                    request body and returns the prediction in the same CSV format as the
+                    CLI (or as JSON when called with `?format=json`)
+
+Requests are handled one at a time.
+"""
+
+
+def read_target_loci():
+    with open(TARGET_LOCI_FILE) as f:
+        return f.read()
+
+
+def predict_sample(body):
+    input_seqs = list(SeqIO.parse(io.StringIO(body.decode()), "fasta"))
+    check_input_seqs(input_seqs)
+    aligned_seqs = align_seqs(input_seqs, args.threads, args.fast_path, cache)
+    if cache is not None:
+        cache.report()
+    X = one_hot_encode([aligned_seqs])
+    return format_prediction(predict(model, X)[0])
+
+
+parser = argparse.ArgumentParser(
+    description="""
+        Starts a server that keeps the model in memory and accepts prediction requests
+        via HTTP. Listens on a TCP port by default or on a Unix socket if '--socket' is
+        passed. POST the FASTA file with the sequences of the 18 target loci to
+        '/predict' to get the prediction.
+        """
+)
+prediction_server.add_arguments(parser)
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=check_positive_int,
+    default=1,
+    metavar="INT",
+    help="Number of loci to align with mafft in parallel [default: %(default)d]",
+)
+parser.add_argument(
+    "--no-fast-path",
+    action="store_false",
+    dest="fast_path",
+    help="Always add the sequences to the alignments with mafft",
+)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help="Directory for caching sequences aligned with mafft (no caching by default)",
+)
+parser.add_argument(
+    "--cache-size",
+    type=check_positive_int,
+    default=1024,
+    metavar="INT",
+    help="Maximum size of the cache in MB [default: %(default)d]",
+)
+parser.add_argument(
+    "--workdir",
+    "--scratch",
+    type=str,
+    metavar="DIR",
+    help=(
+        "Directory for the intermediate files of the requests (e.g. a tmpfs mount) "
+        "[default: $TMPDIR or /tmp]"
+    ),
+)
+args = parser.parse_args()
+make_workdir(args.workdir)
+
+# load the model once and keep it in memory
+model = load_model()
+cache = (
+    AlignmentCache(args.cache_dir, args.cache_size)
+    if args.cache_dir is not None
+    else None
+)
+prediction_server.serve(
+    args, predict_sample, {"/target-loci": read_target_loci}, csv_header=True
+)
@@ -1,3 +1,9 @@
 #!/bin/bash
 
+# start the prediction server if the first argument is `serve` and run the CLI otherwise
+if [[ $1 == "serve" ]]; then
+    shift
+    exec python /server.py "$@"
+fi
+
 python /main.py "$@"
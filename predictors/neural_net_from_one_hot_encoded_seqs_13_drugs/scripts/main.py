@@ -1,8 +1,18 @@
-import tensorflow as tf
 import pandas as pd
 import sys
-import subprocess
+import os
+import glob
+import shutil
 import argparse
+import instrumentation
+from model import (
+    DRUGS,
+    TARGET_LOCI_FILE,
+    load_model,
+    read_one_hot,
+    predict,
+    format_prediction,
+)
 
 """
 This is the entrypoint script for a Docker container holding a neural network that
@@ -31,31 +41,60 @@ panD:4043041-4045210
 pncA:2287883-2289599
 
 It expects a CSV file containing the one-hot-encoded sequences with ['A', 'C', 'G', 'T']
-as columns. Run with `--get-target-loci` to write the target loci as CSV (with header
-'locus,start,end' to the output file (specified with `-o` or `--output`). Run with a
-filename as positional argument to run the prediction and write the result to the output
-file or STDOUT (if no output file was specified).
+as columns (or the same data as binary `.npy`/`.npz` uint8 array). Run with
+`--get-target-loci` to write the target loci as CSV (with header 'locus,start,end' to the
+output file (specified with `-o` or `--output`). Run with a filename as positional
+argument to run the prediction and write the result to the output file or STDOUT (if no
+output file was specified).
+
+Multiple input files (or glob patterns or a manifest file with one path per line passed
+with `--manifest`) can be provided to run in batch mode. The model is then only loaded
+once and the inputs are predicted in batches (of size `--batch-size`). The result is
+written as a single table with one row per sample and one column per drug.
 """
 
-# ignore tf warnings
-tf.get_logger().setLevel("ERROR")
-
-# define globals
-DRUGS = [
-    "AMIKACIN",
-    "CAPREOMYCIN",
-    "CIPROFLOXACIN",
-    "ETHAMBUTOL",
-    "ETHIONAMIDE",
-    "ISONIAZID",
-    "KANAMYCIN",
-    "LEVOFLOXACIN",
-    "MOXIFLOXACIN",
-    "OFLOXACIN",
-    "PYRAZINAMIDE",
-    "RIFAMPICIN",
-    "STREPTOMYCIN",
-]
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def get_input_files(patterns, manifest):
+    """
+    Resolves the positional arguments (file names or glob patterns) and the lines of the
+    manifest file (if provided) into a list of input files.
+    """
+    if manifest is not None:
+        with open(manifest) as f:
+            patterns = patterns + [line.strip() for line in f if line.strip()]
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise FileNotFoundError(f"No input files matching '{pattern}'")
+        files.extend(matches)
+    return files
+
+
+def sample_names(files):
+    """
+    Returns the sample names (the filenames without directory and extension) of the
+    input files and makes sure that they are unique.
+    """
+    names = [os.path.splitext(os.path.basename(file))[0] for file in files]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(
+            f"Sample names (filenames) of the input files are not unique: {duplicates}"
+        )
+    return names
+
 
 # parse arguments
 parser = argparse.ArgumentParser(
@@ -79,8 +118,24 @@ parser.add_argument(
     "file",
     metavar="FILE",
     type=str,
-    nargs="?",
-    help="Input CSV file with one hot-encoded sequence data [required]",
+    nargs="*",
+    help=(
+        "Input CSV (or binary .npy/.npz) file with one hot-encoded sequence data "
+        "[required]; pass multiple files or glob patterns to run in batch mode"
+    ),
+)
+parser.add_argument(
+    "--manifest",
+    type=str,
+    metavar="FILE",
+    help="File with one input CSV per line (enables batch mode)",
+)
+parser.add_argument(
+    "--batch-size",
+    type=check_positive_int,
+    metavar="INT",
+    default=32,
+    help="Number of samples to predict at once in batch mode [default: %(default)d]",
 )
 
 parser.add_argument(
@@ -93,35 +148,65 @@ parser.add_argument(
         "(required if '--get-target-loci' was passed; otherwise optional)"
     ),
 )
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "Write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage (loading the model, reading the input, etc.) as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="Profile the Python code with cProfile and write the stats to this file",
+)
 args = parser.parse_args()
+has_input = bool(args.file) or args.manifest is not None
 # make sure there are no conflicting arguments
-if not args.get_target_loci and args.file is None:
+if not args.get_target_loci and not has_input:
     parser.error("Provide a filename or pass '--get-target-loci'.")
-if args.get_target_loci and args.file is not None:
+if args.get_target_loci and has_input:
     parser.error("Don't provide an input file when passing '--get-target-loci'.")
 if args.get_target_loci and args.output is None:
     parser.error("Provide an output file when passing '--get-target-loci'.")
+instrumentation.init(args.resource_report, args.profile)
 
 # write the target loci if requested
 if args.get_target_loci:
-    subprocess.call(["cp", "/internal_data/target_loci.csv", args.output])
+    shutil.copyfile(TARGET_LOCI_FILE, args.output)
 else:
-    # load the model
-    m = tf.keras.models.load_model("/internal_data/model", compile=False)
+    input_files = get_input_files(args.file, args.manifest)
+    # we are in batch mode unless a single input file was passed directly
+    batch_mode = not (
+        len(args.file) == 1
+        and args.manifest is None
+        and not glob.has_magic(args.file[0])
+    )
 
-    # read the input data
-    input = pd.read_csv(args.file)
-    if list(input.columns) != list("ACGT"):
-        raise ValueError(
-            f"Input file must have columns {list('ACGT')}, "
-            f"but has {list(input.columns)}"
-        )
+    if batch_mode:
+        # fail before loading the model if the sample names are not unique
+        names = sample_names(input_files)
 
-    # predict
-    res = pd.Series(
-        tf.sigmoid(m.predict(tf.expand_dims(input, 0))).numpy().flatten(), index=DRUGS
-    )
+    # load the model
+    with instrumentation.stage("loading model"):
+        m = load_model()
 
-    res = pd.concat((res, res.apply(lambda x: "R" if x > 0.5 else "S")), axis=1)
-    # write the result
-    res.to_csv(sys.stdout if args.output is None else args.output, header=False)
+    # read the input data and predict
+    with instrumentation.stage("reading input"):
+        X = [read_one_hot(f) for f in input_files]
+    with instrumentation.stage("predicting"):
+        preds = predict(m, X, args.batch_size)
+
+    if batch_mode:
+        # write one row per sample (named after the input file) and one column per drug
+        res = pd.DataFrame(preds, index=names, columns=DRUGS)
+        res.index.name = "sample"
+        res.to_csv(sys.stdout if args.output is None else args.output)
+    else:
+        # write the result
+        format_prediction(preds[0]).to_csv(
+            sys.stdout if args.output is None else args.output, header=False
+        )
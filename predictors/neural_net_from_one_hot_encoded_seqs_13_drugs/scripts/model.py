@@ -0,0 +1,113 @@
+import pandas as pd
+import numpy as np
+
+"""
+Model-related code shared by the CLI (`main.py`) and the prediction server
+(`server.py`): loading the model, reading the one-hot-encoded input, and predicting.
+TensorFlow is only imported when the model is loaded so that cheap commands like
+`--get-target-loci` don't have to wait several seconds for the import.
+"""
+
+MODEL_DIR = "/internal_data/model"
+TARGET_LOCI_FILE = "/internal_data/target_loci.csv"
+
+# define globals
+DRUGS = [
+    "AMIKACIN",
+    "CAPREOMYCIN",
+    "CIPROFLOXACIN",
+    "ETHAMBUTOL",
+    "ETHIONAMIDE",
+    "ISONIAZID",
+    "KANAMYCIN",
+    "LEVOFLOXACIN",
+    "MOXIFLOXACIN",
+    "OFLOXACIN",
+    "PYRAZINAMIDE",
+    "RIFAMPICIN",
+    "STREPTOMYCIN",
+]
+
+
+def load_model():
+    import tensorflow as tf
+
+    # ignore tf warnings
+    tf.get_logger().setLevel("ERROR")
+    return tf.keras.models.load_model(MODEL_DIR, compile=False)
+
+
+def read_one_hot(filename):
+    """
+    Reads one-hot-encoded sequences and returns them as `np.ndarray` of shape (L, 4).
+    Accepts a CSV file (or file-like object) with the columns A, C, G, T or a binary
+    uint8 array as written by the one-hot-encoding containers: `.npy` files are
+    memory-mapped and `.npz` files are checked against the target loci.
+    """
+    if isinstance(filename, str) and filename.endswith(".npy"):
+        input = np.load(filename, mmap_mode="r")
+    elif isinstance(filename, str) and filename.endswith(".npz"):
+        with np.load(filename) as data:
+            if "loci" in data:
+                # the loci are concatenated in coordinate order
+                target_loci = (
+                    pd.read_csv(TARGET_LOCI_FILE).sort_values("start")["locus"].tolist()
+                )
+                if data["loci"].tolist() != target_loci:
+                    raise ValueError(
+                        f"Loci in input file {data['loci'].tolist()} don't match the "
+                        f"target loci {target_loci} ({filename})"
+                    )
+            input = data["one_hot"]
+    else:
+        input = pd.read_csv(filename)
+        if list(input.columns) != list("ACGT"):
+            source = f" ({filename})" if isinstance(filename, str) else ""
+            raise ValueError(
+                f"Input file must have columns {list('ACGT')}, "
+                f"but has {list(input.columns)}{source}"
+            )
+        return input.to_numpy(dtype=np.float32)
+    if input.ndim != 2 or input.shape[1] != 4:
+        raise ValueError(
+            f"Input array must have shape (L, 4), but has {input.shape} ({filename})"
+        )
+    return input
+
+
+def predict(m, inputs, batch_size):
+    """
+    Predicts the resistance probabilities for a list of one-hot-encoded sequences. Only
+    inputs of the same length are stacked into batches of at most `batch_size` samples
+    (if the model has a fixed input length, all inputs are zero-padded to that length
+    instead). Padding the inputs to the longest one in a batch would change the
+    predictions (the padded positions can raise the maximum of the global pooling), so
+    that the result of a sample would depend on the other samples in its batch. Returns
+    an `np.ndarray` of shape (len(inputs), len(DRUGS)) in the same order as the inputs.
+    """
+    import tensorflow as tf
+
+    model_len = m.input_shape[1]
+    preds = np.empty((len(inputs), len(DRUGS)), dtype=np.float32)
+    # group the inputs by the length they are passed to the model with
+    lengths = np.array([model_len or len(x) for x in inputs], dtype=int)
+    for batch_len in np.unique(lengths):
+        group = np.flatnonzero(lengths == batch_len)
+        for i in range(0, len(group), batch_size):
+            idx = group[i : i + batch_size]
+            batch = np.zeros((len(idx), batch_len, 4), dtype=np.float32)
+            for k, j in enumerate(idx):
+                batch[k, : len(inputs[j])] = inputs[j]
+            preds[idx] = tf.sigmoid(m.predict(batch, batch_size=len(idx))).numpy()
+    return preds
+
+
+def format_prediction(pred):
+    """
+    Turns the predicted probabilities of a single sample into a `pd.DataFrame` with the
+    probabilities and the resistance status ('R' or 'S') for each drug.
+    """
+    res = pd.Series(pred, index=DRUGS)
+    res = pd.concat((res, res.apply(lambda x: "R" if x > 0.5 else "S")), axis=1)
+    res.columns = ["prediction", "resistance_status"]
+    return res
@@ -0,0 +1,44 @@
+import io
+import argparse
+import prediction_server
+from model import TARGET_LOCI_FILE, load_model, read_one_hot, predict, format_prediction
+
+"""
+Long-lived prediction server for the neural network container. The model is loaded only
+once at startup and kept in memory. Prediction requests are accepted over HTTP (on a TCP
+port or a Unix socket) so that clients don't have to pay the TensorFlow import and
+model loading for every sample (see `prediction_server.py` for the server). Endpoints:
+
+GET  /health        returns 'ok'
+GET  /target-loci   returns the target loci CSV (like `--get-target-loci`)
+POST /predict       expects the one-hot-encoded sequences CSV as request body and
+                    returns the prediction in the same CSV format as the CLI (or as JSON
+                    when called with `?format=json`)
+
+Requests are handled one at a time.
+"""
+
+
+def read_target_loci():
+    with open(TARGET_LOCI_FILE) as f:
+        return f.read()
+
+
+def predict_sample(body):
+    return format_prediction(predict(model, [read_one_hot(io.BytesIO(body))], 1)[0])
+
+
+parser = argparse.ArgumentParser(
+    description="""
+        Starts a server that keeps the model in memory and accepts prediction requests
+        via HTTP. Listens on a TCP port by default or on a Unix socket if '--socket' is
+        passed. POST the CSV file with the one-hot-encoded sequences to '/predict' to
+        get the prediction.
+        """
+)
+prediction_server.add_arguments(parser)
+args = parser.parse_args()
+
+# load the model once and keep it in memory
+model = load_model()
+prediction_server.serve(args, predict_sample, {"/target-loci": read_target_loci})
@@ -1,3 +1,9 @@
 #!/bin/bash
 
-/usr/local/bin/_entrypoint.sh python /main.py "$@"
\ No newline at end of file
+# start the prediction server if the first argument is `serve` and run the CLI otherwise
+if [[ $1 == "serve" ]]; then
+    shift
+    exec /usr/local/bin/_entrypoint.sh python /server.py "$@"
+fi
+
+/usr/local/bin/_entrypoint.sh python /main.py "$@"
@@ -0,0 +1,61 @@
+import argparse
+import sys
+import joblib
+import numpy as np
+import pandas as pd
+from forest import export_forest, ArrayForest
+
+"""
+Exports the pickled random forest into flat arrays (see `forest.py`) and checks that the
+array-based evaluator gives the same probabilities as `predict_proba` of the sklearn
+model. The check uses random genotype matrices drawn from the allele frequencies of the
+target variants (with some genotypes replaced by the AF like for non-calls) as well as
+uniformly random genotypes. Exits with a non-zero status if the results differ so that
+the Docker build fails.
+"""
+
+parser = argparse.ArgumentParser(
+    description="""
+        Export a fitted sklearn random forest to flat NumPy arrays and check that the
+        array-based evaluator reproduces `predict_proba`.
+        """
+)
+parser.add_argument("model", metavar="MODEL_FILE", help="pickled model [required]")
+parser.add_argument(
+    "target_vars", metavar="TARGET_VARS_FILE", help="target variants CSV [required]"
+)
+parser.add_argument("out_dir", metavar="DIR", help="output directory [required]")
+parser.add_argument(
+    "-n",
+    "--n-samples",
+    type=int,
+    default=1000,
+    metavar="INT",
+    help="Number of random samples used for the parity check [default: %(default)d]",
+)
+args = parser.parse_args()
+
+m = joblib.load(args.model)
+export_forest(m, args.out_dir)
+forest = ArrayForest(args.out_dir)
+
+# random genotypes drawn from the AFs (with 10% of the genotypes set to the AF) and
+# uniformly random genotypes
+AFs = pd.read_csv(args.target_vars, index_col=["POS", "REF", "ALT"]).squeeze()
+rng = np.random.default_rng(42)
+shape = (args.n_samples, len(AFs))
+X = (rng.random(shape) < AFs.to_numpy()).astype(float)
+X = np.where(rng.random(shape) < 0.1, AFs.to_numpy(), X)
+X = np.concatenate([X, rng.integers(0, 2, shape).astype(float)])
+X = pd.DataFrame(X, columns=m.feature_names_in_)
+
+expected = m.predict_proba(X)[:, 1]
+observed = forest.predict_proba(X)[:, 1]
+max_diff = np.abs(expected - observed).max()
+print(
+    f"exported {len(forest.roots)} trees with {len(forest.feature)} nodes; max. "
+    f"difference to `predict_proba` for {len(X)} samples: {max_diff:.3g}",
+    file=sys.stderr,
+)
+if not np.allclose(expected, observed, rtol=0, atol=1e-9):
+    sys.exit("ERROR: Array-based evaluator doesn't match `predict_proba`")
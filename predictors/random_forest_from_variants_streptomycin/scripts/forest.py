@@ -0,0 +1,121 @@
+import os
+import concurrent.futures
+import numpy as np
+
+"""
+Array-based replacement for evaluating the fitted sklearn `RandomForestClassifier`. The
+nodes of all trees are flattened into contiguous NumPy arrays (one `.npy` file each)
+that are memory-mapped when loading, which makes loading the model almost instant
+compared to unpickling the whole sklearn object graph. Samples are scored with a
+vectorized traversal of all trees at once instead of dispatching to every estimator
+separately.
+"""
+
+ARRAYS = ["feature", "threshold", "missing_left", "children", "value", "roots"]
+
+
+def export_forest(m, out_dir):
+    """
+    Flattens the trees of a fitted `RandomForestClassifier` into arrays and writes them
+    to `out_dir`. Node indices are offset so that they refer to the concatenated arrays;
+    `children` holds the right and left child of each node (in that order so that it can
+    be indexed with the result of the `<=` comparison), `roots` the index of the root
+    node of each tree, `value` the probability of the positive class (the second entry
+    of `m.classes_`) at each node, and `missing_left` whether missing values (NaN) go to
+    the left child (only set by sklearn versions supporting missing values; they go to
+    the right child otherwise).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {name: [] for name in ARRAYS}
+    offset = 0
+    for estimator in m.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        arrays["roots"].append(offset)
+        # leaves get feature -1 (and point to themselves)
+        arrays["feature"].append(np.where(is_leaf, -1, tree.feature))
+        arrays["threshold"].append(tree.threshold)
+        arrays["missing_left"].append(
+            getattr(tree, "missing_go_to_left", np.zeros(tree.node_count))
+        )
+        node_ids = np.arange(tree.node_count)
+        right = np.where(is_leaf, node_ids, tree.children_right)
+        left = np.where(is_leaf, node_ids, tree.children_left)
+        arrays["children"].append(np.stack([right, left], axis=1) + offset)
+        # the node values hold the (weighted) class counts --> normalize like sklearn
+        counts = tree.value[:, 0, :]
+        normalizer = counts.sum(axis=1)
+        normalizer[normalizer == 0] = 1
+        arrays["value"].append(counts[:, 1] / normalizer)
+        offset += tree.node_count
+    dtypes = {"threshold": np.float64, "value": np.float64, "missing_left": bool}
+    for name, values in arrays.items():
+        values = np.array(values) if name == "roots" else np.concatenate(values)
+        np.save(f"{out_dir}/{name}.npy", values.astype(dtypes.get(name, np.int32)))
+    np.save(f"{out_dir}/feature_names.npy", np.asarray(m.feature_names_in_, dtype=str))
+
+
+class ArrayForest:
+    """
+    Evaluates a forest exported with `export_forest`. Mimics the parts of the sklearn
+    interface used by the prediction code (`predict_proba` and `set_params`).
+    """
+
+    def __init__(self, forest_dir):
+        for name in ARRAYS:
+            # plain array views of the memory-mapped files (indexing `np.memmap`
+            # objects is slower)
+            array = np.load(f"{forest_dir}/{name}.npy", mmap_mode="r")
+            setattr(self, name, array.view(np.ndarray))
+        self.feature_names = np.load(f"{forest_dir}/feature_names.npy")
+        self.n_jobs = 1
+
+    def set_params(self, n_jobs=1):
+        self.n_jobs = n_jobs
+        return self
+
+    def _predict(self, X):
+        # walk down all trees for all samples at once; `nodes` holds the current node
+        # of each (sample, tree) pair and `active` the pairs that haven't reached a leaf
+        # yet (flat indices into `X` and `children` are used since `np.take` is faster
+        # than fancy indexing)
+        n_trees = len(self.roots)
+        nodes = np.tile(self.roots, len(X))
+        sample_offsets = np.repeat(np.arange(len(X)) * X.shape[1], n_trees)
+        children = self.children.ravel()
+        X = X.ravel()
+        has_nan = np.isnan(X).any()
+        active = np.arange(len(nodes))
+        while len(active):
+            current = nodes[active]
+            feature = self.feature.take(current)
+            is_inner = feature >= 0
+            if not is_inner.all():
+                active, current = active[is_inner], current[is_inner]
+                feature = feature[is_inner]
+            values = X.take(sample_offsets[active] + feature)
+            go_left = values <= self.threshold.take(current)
+            if has_nan:
+                go_left |= np.isnan(values) & self.missing_left.take(current)
+            nodes[active] = children.take(2 * current + go_left)
+        return self.value.take(nodes).reshape(-1, n_trees).mean(axis=1)
+
+    def predict_proba(self, X):
+        """
+        Returns the class probabilities (like sklearn, as array of shape (N, 2)). If `X`
+        is a `pd.DataFrame`, its columns are checked against the feature names the model
+        was fitted with.
+        """
+        if hasattr(X, "columns") and list(X.columns) != list(self.feature_names):
+            raise ValueError("Feature names of the input don't match the model")
+        # sklearn evaluates the trees on float32 data
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names):
+            raise ValueError(
+                f"Input must have shape (N, {len(self.feature_names)}), "
+                f"but has {X.shape}"
+            )
+        chunks = np.array_split(X, min(self.n_jobs, len(X)) or 1)
+        with concurrent.futures.ThreadPoolExecutor(self.n_jobs) as pool:
+            probs = np.concatenate(list(pool.map(self._predict, chunks)))
+        return np.stack([1 - probs, probs], axis=1)
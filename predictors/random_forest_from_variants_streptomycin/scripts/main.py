@@ -1,7 +1,14 @@
 import argparse
-import pandas as pd
-import joblib
 import sys
+import instrumentation
+from model import (
+    load_target_vars,
+    load_model,
+    read_variants,
+    predict,
+    read_genotype_matrix,
+    predict_matrix,
+)
 
 """
 Entrypoint for a simple example prediction container with a random forest model fitted
@@ -10,8 +17,24 @@ on streptomycin-resistance data. It expects the following arguments: `--get-targ
 variants (including AFs in the training set) to the output file. In the second case, it
 reads genotypes from FILE, runs the prediction, and then writes the predicted resistance
 status to the output file (if one was provided) or to STDOUT otherwise.
+
+With `--matrix FILE`, the genotypes of many samples are read from a genotype matrix
+(CSV, Parquet, or `.npy`) and predicted at once. The result is then written as a table
+with the columns 'sample,resistance_probability,resistance_status'.
 """
 
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
 parser = argparse.ArgumentParser(
     description="""
         A Random Forest classifier to predict Mtb resistance to streptomycin from a CSV
@@ -19,7 +42,8 @@ parser = argparse.ArgumentParser(
         get the variants + allele frequencies of the training dataset (then you need to
         specify an output file with '-o' or '--output') or pass a filename for
         predicting resistance. In the latter case the output file is optional (the
-        prediction is written to STDOUT if none is provided).
+        prediction is written to STDOUT if none is provided). Pass a genotype matrix
+        with '--matrix' to predict many samples at once.
         """
 )
 parser.add_argument(
@@ -38,6 +62,28 @@ parser.add_argument(
         "(required if '--get-target-vars' was not passed)"
     ),
 )
+parser.add_argument(
+    "--matrix",
+    type=str,
+    metavar="FILE",
+    help=(
+        "Genotype matrix with one row per sample and one column per variant (CSV or "
+        "Parquet with the sample names in the first column and the variants named "
+        "'POS_REF_ALT', or `.npy` with the variants in the order of "
+        "'--get-target-vars') to predict many samples at once"
+    ),
+)
+parser.add_argument(
+    "-j",
+    "--n-jobs",
+    type=check_positive_int,
+    metavar="INT",
+    default=1,
+    help=(
+        "Number of threads used to evaluate the trees with '--matrix' "
+        "[default: %(default)d]"
+    ),
+)
 parser.add_argument(
     "-o",
     "--output",
@@ -48,18 +94,35 @@ parser.add_argument(
         "(required if '--get-target-vars' was passed; otherwise optional)"
     ),
 )
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "Write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage (loading the model, reading the input, etc.) as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="Profile the Python code with cProfile and write the stats to this file",
+)
 args = parser.parse_args()
-if not args.get_target_vars and args.file is None:
+has_input = args.file is not None or args.matrix is not None
+if not args.get_target_vars and not has_input:
     parser.error("Provide a filename or pass '--get-target-vars'.")
-if args.get_target_vars and args.file is not None:
+if args.get_target_vars and has_input:
     parser.error("Don't provide an input file when passing '--get-target-vars'.")
+if args.file is not None and args.matrix is not None:
+    parser.error("Provide either a single input file or '--matrix'.")
 if args.get_target_vars and args.output is None:
     parser.error("Provide an output file when passing '--get-target-vars'.")
+instrumentation.init(args.resource_report, args.profile)
 
 # get the variants the model has been fitted on
-target_vars = pd.read_csv(
-    "/internal_data/target_vars.csv", index_col=["POS", "REF", "ALT"]
-).squeeze()
+target_vars = load_target_vars()
 
 # write the target variants if requested
 if args.get_target_vars:
@@ -68,24 +131,22 @@ if args.get_target_vars:
 else:
     # "--get-target-vars" was not passed and we have an input file (as checked above)
     # --> all looks good, we can load the model and predict
-    m = joblib.load("/internal_data/model.pkl")
-    # load the input variants
-    X = pd.read_csv(args.file, index_col=["POS", "REF", "ALT"], comment="#")
-    # make sure the dimensions match up and X has only one column
-    if X.shape[1] != 1:
-        raise ValueError(
-            "ERROR: The input variants need to be provided in the format "
-            "'POS,REF,ALT,GT' with a header line."
-        )
-    # make sure the variant order is as expected
-    X = X.loc[target_vars.index]
-    # the model was fitted on a genotype matrix that had feature names of the format:
-    # `POS_REF_ALT` --> create a corresponding index (sklearn will throw a warning
-    # otherwise)
-    X.index = ["_".join(str(x) for x in idx) for idx in X.index]
-    # the model expects a DataFrame with a single row --> transpose
-    X = X.T
-    # predict the probability for resistance and write the result
-    ypred = pd.Series(m.predict_proba(X)[:, 1], index=["resistance_probability"])
-    ypred["resistance_status"] = "S" if ypred["resistance_probability"] < 0.5 else "R"
-    ypred.to_csv(args.output or sys.stdout, header=False)
+    with instrumentation.stage("loading model"):
+        m = load_model()
+    if args.matrix is not None:
+        # predict all samples in the genotype matrix at once and write one row per
+        # sample
+        with instrumentation.stage("reading input"):
+            samples, X = read_genotype_matrix(args.matrix, target_vars)
+        with instrumentation.stage("predicting"):
+            res = predict_matrix(m, target_vars, samples, X, args.n_jobs)
+        with instrumentation.stage("writing output"):
+            res.to_csv(args.output or sys.stdout)
+    else:
+        # load the input variants
+        with instrumentation.stage("reading input"):
+            X = read_variants(args.file)
+        # predict the probability for resistance and write the result
+        with instrumentation.stage("predicting"):
+            ypred = predict(m, target_vars, X)
+        ypred.to_csv(args.output or sys.stdout, header=False)
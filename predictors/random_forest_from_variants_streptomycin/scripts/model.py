@@ -0,0 +1,131 @@
+import os
+import pandas as pd
+import numpy as np
+from forest import ArrayForest
+
+"""
+Model-related code shared by the CLI (`main.py`) and the prediction server
+(`server.py`): loading the target variants and the model, and predicting (for single
+samples or for whole genotype matrices). joblib (and sklearn) are only imported when the
+pickled model has to be loaded.
+"""
+
+MODEL_FILE = "/internal_data/model.pkl"
+# the model exported to flat arrays (by `export-forest.py` during the Docker build)
+FOREST_DIR = "/internal_data/forest"
+TARGET_VARS_FILE = "/internal_data/target_vars.csv"
+
+
+def load_target_vars():
+    """
+    Reads the variants the model has been fitted on (together with their allele
+    frequencies in the training data).
+    """
+    return pd.read_csv(TARGET_VARS_FILE, index_col=["POS", "REF", "ALT"]).squeeze()
+
+
+def load_model():
+    """
+    Loads the memory-mapped array-based forest if it has been exported and falls back to
+    unpickling the sklearn model otherwise.
+    """
+    if os.path.isdir(FOREST_DIR):
+        return ArrayForest(FOREST_DIR)
+    import joblib
+
+    return joblib.load(MODEL_FILE)
+
+
+def feature_names(target_vars):
+    """
+    The model was fitted on a genotype matrix with feature names of the format
+    `POS_REF_ALT` --> create them from the index of the target variants.
+    """
+    return ["_".join(str(x) for x in idx) for idx in target_vars.index]
+
+
+def read_variants(filename):
+    """
+    Reads the genotypes of a sample from a CSV file (or file-like object) in the format
+    'POS,REF,ALT,GT'.
+    """
+    X = pd.read_csv(filename, index_col=["POS", "REF", "ALT"], comment="#")
+    # make sure the dimensions match up and X has only one column
+    if X.shape[1] != 1:
+        raise ValueError(
+            "ERROR: The input variants need to be provided in the format "
+            "'POS,REF,ALT,GT' with a header line."
+        )
+    return X
+
+
+def predict(m, target_vars, X):
+    """
+    Predicts the resistance probability for a single sample and returns it together with
+    the resistance status ('R' or 'S') as `pd.Series`.
+    """
+    # make sure the variant order is as expected
+    X = X.loc[target_vars.index]
+    # use the feature names the model was fitted with (sklearn will throw a warning
+    # otherwise)
+    X.index = feature_names(target_vars)
+    # the model expects a DataFrame with a single row --> transpose
+    X = X.T
+    # predict the probability for resistance
+    ypred = pd.Series(m.predict_proba(X)[:, 1], index=["resistance_probability"])
+    ypred["resistance_status"] = "S" if ypred["resistance_probability"] < 0.5 else "R"
+    return ypred
+
+
+def read_genotype_matrix(filename, target_vars):
+    """
+    Reads a genotype matrix with one row per sample and one column per variant (as
+    written by the variants container with `--manifest`) and returns the sample names
+    and the genotypes as `np.ndarray` with the columns in the order expected by the
+    model. CSV and Parquet files need the sample names in the first column (or the
+    index) and the variants as columns named `POS_REF_ALT`; `.npy` files need to hold
+    the target variants in the order of `--get-target-vars` already (the samples are
+    then simply numbered).
+    """
+    if filename.endswith(".npy"):
+        X = np.load(filename, mmap_mode="r")
+        if X.ndim != 2 or X.shape[1] != len(target_vars):
+            raise ValueError(
+                f"Input array must have shape (N, {len(target_vars)}), but has "
+                f"{X.shape} ({filename})"
+            )
+        return pd.RangeIndex(len(X), name="sample"), X
+    if filename.endswith(".parquet"):
+        df = pd.read_parquet(filename)
+        if isinstance(df.index, pd.RangeIndex):
+            df = df.set_index(df.columns[0])
+    else:
+        df = pd.read_csv(filename, index_col=0)
+    df.index.name = "sample"
+    # align the features once as an integer permutation of the columns
+    perm = df.columns.get_indexer(feature_names(target_vars))
+    if (perm == -1).any():
+        missing = np.array(feature_names(target_vars))[perm == -1]
+        raise ValueError(
+            f"{len(missing)} target variants are missing in {filename} "
+            f"(e.g. {', '.join(missing[:5])})"
+        )
+    return df.index, df.to_numpy(dtype=np.float64)[:, perm]
+
+
+def predict_matrix(m, target_vars, samples, X, n_jobs=1):
+    """
+    Predicts the resistance probability for all samples in a genotype matrix (with the
+    columns in the order of the target variants) in a single call (using `n_jobs`
+    threads) and returns a `pd.DataFrame` with the columns
+    'resistance_probability' and 'resistance_status'.
+    """
+    m.set_params(n_jobs=n_jobs)
+    probs = m.predict_proba(pd.DataFrame(X, columns=feature_names(target_vars)))[:, 1]
+    return pd.DataFrame(
+        {
+            "resistance_probability": probs,
+            "resistance_status": np.where(probs < 0.5, "S", "R"),
+        },
+        index=samples,
+    )
@@ -0,0 +1,41 @@
+import io
+import argparse
+import prediction_server
+from model import load_target_vars, load_model, read_variants, predict
+
+"""
+Long-lived prediction server for the random forest container. The model is loaded only
+once at startup and kept in memory. Prediction requests are accepted over HTTP (on a TCP
+port or a Unix socket) so that clients don't have to pay the interpreter start, the
+sklearn import and unpickling the model for every sample (see `prediction_server.py`
+for the server). Endpoints:
+
+GET  /health        returns 'ok'
+GET  /target-vars   returns the target variants CSV (like `--get-target-vars`)
+POST /predict       expects the 'POS,REF,ALT,GT' CSV as request body and returns the
+                    prediction in the same CSV format as the CLI (or as JSON when called
+                    with `?format=json`)
+
+Requests are handled one at a time.
+"""
+
+
+def predict_sample(body):
+    return predict(model, target_vars, read_variants(io.BytesIO(body)))
+
+
+parser = argparse.ArgumentParser(
+    description="""
+        Starts a server that keeps the model in memory and accepts prediction requests
+        via HTTP. Listens on a TCP port by default or on a Unix socket if '--socket' is
+        passed. POST the CSV file with the genotypes ('POS,REF,ALT,GT') to '/predict' to
+        get the prediction.
+        """
+)
+prediction_server.add_arguments(parser)
+args = parser.parse_args()
+
+# load the model and target variants once and keep them in memory
+model = load_model()
+target_vars = load_target_vars()
+prediction_server.serve(args, predict_sample, {"/target-vars": target_vars.to_csv})
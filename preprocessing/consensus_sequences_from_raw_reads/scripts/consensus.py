@@ -0,0 +1,111 @@
+import gzip
+import bisect
+import numpy as np
+
+"""
+In-process replacement for running `samtools faidx ... | bcftools consensus ...` once
+per target region. The reference is memory-mapped and regions are extracted via the
+offsets in the `.fai` index. The (normalized) VCF is streamed only once and each record
+is applied to all target regions it falls into.
+"""
+
+
+def read_fai(fai_file):
+    """
+    Reads a `.fai` index into a dict mapping the sequence names to tuples of (length,
+    offset, bases per line, bytes per line).
+    """
+    fai = {}
+    with open(fai_file) as f:
+        for line in f:
+            name, length, offset, line_bases, line_width = line.split("\t")[:5]
+            fai[name] = (int(length), int(offset), int(line_bases), int(line_width))
+    return fai
+
+
+def fetch_region(ref, fai, chrom, start, end):
+    """
+    Extracts the bases between `start` and `end` (1-based, inclusive; like `samtools
+    faidx ref chrom:start-end`) from the memory-mapped reference as bytes.
+    """
+    length, offset, line_bases, line_width = fai[chrom]
+    start, end = max(start, 1), min(end, length)
+    if end < start:
+        return b""
+
+    def byte_pos(pos):
+        # byte offset of a 0-based position in the FASTA file
+        return offset + pos // line_bases * line_width + pos % line_bases
+
+    chunk = ref[byte_pos(start - 1) : byte_pos(end - 1) + 1]
+    return chunk[(chunk != ord("\n")) & (chunk != ord("\r"))].tobytes()
+
+
+def read_vcf_records(vcf_file, sample):
+    """
+    Streams the records of a (bgzipped) VCF and yields the ones where `sample` carries a
+    non-reference allele as tuples of (chrom, pos, ref, alt). Missing genotypes,
+    symbolic alleles, and `*` alleles are skipped (like `bcftools consensus` does by
+    default).
+    """
+    sample_idx = None
+    with gzip.open(vcf_file, "rt") as f:
+        for line in f:
+            if line.startswith("##"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if line.startswith("#"):
+                if sample not in fields[9:]:
+                    raise ValueError(f"Sample '{sample}' not found in {vcf_file}")
+                sample_idx = fields.index(sample)
+                continue
+            chrom, pos, _, ref, alts = fields[:5]
+            fmt = fields[8].split(":")
+            gt = dict(zip(fmt, fields[sample_idx].split(":"))).get("GT", ".")
+            allele = gt.replace("|", "/").split("/")[0]
+            if allele in (".", "0"):
+                continue
+            alt = alts.split(",")[int(allele) - 1]
+            if alt.startswith("<") or alt == "*":
+                continue
+            yield chrom, int(pos), ref, alt
+
+
+def build_consensus(ref_file, vcf_file, regions, sample="sample", chrom="Chromosome"):
+    """
+    Builds the consensus sequences for a list of regions (tuples of name, start, and end
+    with 1-based inclusive coordinates) in one pass over the VCF. Records overlapping a
+    previously applied record or not lying fully inside a region are skipped. Returns a
+    dict mapping the region names to the consensus sequences (as str).
+    """
+    fai = read_fai(f"{ref_file}.fai")
+    ref = np.memmap(ref_file, dtype=np.uint8, mode="r")
+    regions = sorted(regions, key=lambda x: x[1])
+    starts = [start for _, start, _ in regions]
+    # the sequence pieces of each region and the position up to which it has been built
+    pieces = {name: [] for name, _, _ in regions}
+    built_until = {name: start - 1 for name, start, _ in regions}
+    for rec_chrom, pos, rec_ref, alt in read_vcf_records(vcf_file, sample):
+        if rec_chrom != chrom:
+            continue
+        rec_end = pos + len(rec_ref) - 1
+        # check all regions starting before the record (regions might overlap)
+        for name, start, end in regions[: bisect.bisect_right(starts, pos)]:
+            if rec_end > end or pos <= built_until[name]:
+                continue
+            ref_allele = fetch_region(ref, fai, chrom, pos, rec_end)
+            if ref_allele.upper() != rec_ref.upper().encode():
+                raise ValueError(
+                    f"REF allele of the record at {chrom}:{pos} ({rec_ref}) does not "
+                    "match the reference"
+                )
+            pieces[name].append(
+                fetch_region(ref, fai, chrom, built_until[name] + 1, pos - 1)
+            )
+            pieces[name].append(alt.encode())
+            built_until[name] = rec_end
+    consensus = {}
+    for name, start, end in regions:
+        pieces[name].append(fetch_region(ref, fai, chrom, built_until[name] + 1, end))
+        consensus[name] = b"".join(pieces[name]).decode()
+    return consensus
@@ -1,3 +1,5 @@
 #!/bin/bash
 
-/usr/local/bin/_entrypoint.sh python /scripts/main.py "$@"
\ No newline at end of file
+# replace the shell so that signals (e.g. from `docker stop`) reach Python and the
+# intermediate files are cleaned up
+exec /usr/local/bin/_entrypoint.sh python /scripts/main.py "$@"
\ No newline at end of file
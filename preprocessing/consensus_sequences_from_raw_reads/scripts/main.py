@@ -1,6 +1,12 @@
 import argparse
-import subprocess
+import os
+import sys
 import pandas as pd
+from consensus import build_consensus
+from result_cache import ResultCache
+import instrumentation
+from workdir import make_workdir
+import read_filter
 
 ref_file = "/internal_data/refgenome.fa"
 
@@ -10,7 +16,8 @@ raw reads in a list of target regions. It requires the reads, a CSV file with
 coordinates of the target regions, and a name for the output FASTA file. `bwa-mem2` is
 used for aligning the reads against H37Rv (asm19595v2) and variants are called with
 `freebayes`. The CSV file with the target regions is required and should have the header
-line 'locus,start,end'.
+line 'locus,start,end'. The consensus sequences of all target regions are then built in a
+single pass over the called variants.
 """
 
 
@@ -54,6 +61,17 @@ parser.add_argument(
     help="number of threads to use",
     default=1,
 )
+parser.add_argument(
+    "--bwa-index-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory holding bwa-mem2 indices of the reference genome (e.g. a mounted "
+        "cache shared between runs); the index is only built if there is none for the "
+        "checksum of the reference yet [default: %(default)s]"
+    ),
+    default="/internal_data/bwa-index",
+)
 parser.add_argument(
     "-r",
     "--regions",
@@ -70,42 +88,153 @@ parser.add_argument(
     help="output FASTA file [required]",
     required=True,
 )
+read_filter.add_arguments(parser)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory for caching the aligned reads, the called variants, and the output "
+        "(keyed by the checksums of the inputs; can be shared between runs via a "
+        "mounted volume); no caching if not provided"
+    ),
+)
+parser.add_argument(
+    "--cache-size",
+    type=check_positive_int,
+    metavar="INT",
+    default=10240,
+    help=(
+        "maximum size of the cache in MB (least recently used entries are removed) "
+        "[default: %(default)d]"
+    ),
+)
+parser.add_argument(
+    "--workdir",
+    "--scratch",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory in which a unique directory for the intermediate files is created "
+        "and removed afterwards (e.g. a tmpfs mount to keep them in memory); only the "
+        "final output is written to the working directory [default: $TMPDIR or /tmp]"
+    ),
+)
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage (and of the tools in the pipelines) as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="profile the Python code with cProfile and write the stats to this file",
+)
 # parse arguments
 args = parser.parse_args()
+read_filter.check_arguments(parser, args)
+instrumentation.init(args.resource_report, args.profile)
+workdir = make_workdir(args.workdir)
 
-# transform targets csv to bed file
-targets = pd.read_csv(args.regions, index_col=0)
-targets.sub(1).reset_index().eval('locus = "Chromosome"').to_csv(
-    "target_loci.bed", index=False, header=False, sep="\t"
+bam_files = {
+    file: f"{workdir}/{file}" for file in ["reads.sorted.bam", "reads.sorted.bam.bai"]
+}
+vcf_files = {
+    file: f"{workdir}/{file}" for file in ["variants.vcf.gz", "variants.vcf.gz.csi"]
+}
+prefilter, prefilter_params = read_filter.alignment_params(args)
+cache = (
+    ResultCache(args.cache_dir, args.cache_size)
+    if args.cache_dir is not None
+    else None
 )
+if cache is not None:
+    # the alignment only depends on the reads and the reference (and with the prefilter
+    # also on the regions; the subsampling parameters are part of `prefilter_params`)
+    # and the variants and the output also on the regions (the number of threads
+    # doesn't change the results) --> we are done if the output has been cached already
+    # (unless the prefilter is to be validated)
+    inputs = [args.forward_reads, args.reverse_reads, ref_file]
+    output_key = cache.key("consensus", inputs + [args.regions], prefilter_params)
+    if not args.validate_prefilter and cache.get(output_key, {"output": args.output}):
+        sys.exit(0)
+    variants_key = cache.key("variants", inputs + [args.regions], prefilter_params)
+    alignment_key = cache.key(
+        "alignment", inputs + ([args.regions] if prefilter else []), prefilter_params
+    )
 
-# run variant-calling pipeline
-subprocess.run(
-    [
-        "/bin/bash",
-        "/scripts/variant-calling-pipeline.sh",
-        args.forward_reads,
-        args.reverse_reads,
-        ref_file,
-        "target_loci.bed",
-        str(args.threads),
-    ]
-)
+# transform targets csv to bed file (with 0-based, half-open intervals; the coordinates
+# in the CSV are 1-based, but the end is exclusive)
+targets = pd.read_csv(args.regions, index_col=0)
+regions = [(locus, start - 1, end - 1) for locus, (start, end) in targets.iterrows()]
+read_filter.write_bed(regions, f"{workdir}/target_loci.bed")
+
+if cache is None or args.validate_prefilter or not cache.get(variants_key, vcf_files):
+    if (
+        cache is None
+        or args.validate_prefilter
+        or not cache.get(alignment_key, bam_files)
+    ):
+        # run the mapping pipeline (the pipelines write their results to their working
+        # directory --> use absolute paths)
+        mapping_args = [
+            os.path.abspath(args.forward_reads),
+            os.path.abspath(args.reverse_reads),
+            ref_file,
+            str(args.threads),
+            os.path.abspath(args.bwa_index_dir),
+        ]
+        # arguments for the read filter (see `filter-reads.py`)
+        mapping_args += read_filter.mapping_args(args, regions, workdir)
+        instrumentation.run(
+            "alignment",
+            ["/bin/bash", "/scripts/mapping-pipeline.sh"] + mapping_args,
+            cwd=workdir,
+            check=True,
+        )
+        if cache is not None:
+            cache.put(alignment_key, bam_files)
+        if args.validate_prefilter:
+            read_filter.validate_prefilter(
+                f"{workdir}/reads.sorted.bam", f"{workdir}/target_loci.bed", workdir
+            )
+    if args.max_depth is not None:
+        read_filter.report_depth(
+            f"{workdir}/reads.sorted.bam", f"{workdir}/target_loci.bed", targets.index
+        )
+    # call the variants in the target regions
+    instrumentation.run(
+        "variant calling",
+        [
+            "/bin/bash",
+            "/scripts/variant-calling-pipeline.sh",
+            ref_file,
+            "target_loci.bed",
+        ],
+        cwd=workdir,
+        check=True,
+    )
+    if cache is not None:
+        cache.put(variants_key, vcf_files)
 
 # get the consensus sequence for each target locus and write all to multi-fasta file
-with open(args.output, "w") as f:
-    for locus, (start, end) in targets.iterrows():
-        seq = subprocess.run(
-            [
-                "/bin/bash",
-                "/scripts/get-aligned-consensus-sequence.sh",
-                ref_file,
-                "variants.vcf.gz",
-                f"Chromosome:{start}-{end}",
-                f"alignment-files/{locus}.fasta",
-            ],
-            capture_output=True,
-            text=True,
-        ).stdout
+with instrumentation.stage("consensus"):
+    consensus = build_consensus(
+        ref_file,
+        f"{workdir}/variants.vcf.gz",
+        [(locus, start, end) for locus, (start, end) in targets.iterrows()],
+    )
+with instrumentation.stage("writing output"), open(args.output, "w") as f:
+    for locus in targets.index:
         f.write(f">{locus}\n")
-        f.write(seq)
+        # wrap lines after 60 bases (like `bcftools consensus`)
+        seq = consensus[locus]
+        for i in range(0, len(seq), 60):
+            f.write(f"{seq[i : i + 60]}\n")
+if cache is not None:
+    cache.put(output_key, {"output": args.output})
@@ -1,45 +1,26 @@
 #!/bin/bash
 
-fw_reads=$1
-rv_reads=$2
-refgenome=$3
-targets=$4
-threads=${5:-1}
+# calls the variants in the target regions in the reads aligned by
+# `mapping-pipeline.sh` (`reads.sorted.bam`)
 
-# READ TRIMMING
-trimmomatic PE "$fw_reads" "$rv_reads" \
-    -threads "$threads" \
-    -phred33 \
-    -baseout trimmed.fq.gz \
-    LEADING:3 \
-    TRAILING:3 \
-    SLIDINGWINDOW:4:20 \
-    MINLEN:36
+# set flags for "strict" mode (so that the script fails if any of the stages fails)
+set -Eeuo pipefail
 
-# MAPPING
-bwa-mem2 index "$refgenome" > /dev/null
+refgenome=$1
+targets=$2
 
-bwa-mem2 mem \
-    -t "$threads" \
-    -R "@RG\tID:sample\tSM:sample\tPL:Illumina" \
-    "$refgenome" \
-    trimmed_1P.fq.gz \
-    trimmed_2P.fq.gz |
-    samtools view -bhS |
-    samtools fixmate -@ "$threads" -m - - |
-    samtools sort -@ "$threads" - -o reads.sorted.bam
+# `measure NAME CMD [ARGS...]` records the resource usage of a command if
+# instrumentation is enabled
+source "$(dirname "${BASH_SOURCE[0]}")/measure.sh"
 
-samtools index reads.sorted.bam
-
-# VARIANT-CALLING
-freebayes reads.sorted.bam \
+measure freebayes freebayes reads.sorted.bam \
     -f "$refgenome" \
     -t "$targets" \
     -p 1 |
-    bcftools sort -Ou |
-    bcftools norm -f "$refgenome" -m- -Ou |
-    bcftools norm -d none \
+    measure "bcftools sort" bcftools sort -Ou |
+    measure "bcftools norm" bcftools norm -f "$refgenome" -m- -Ou |
+    measure "bcftools norm -d" bcftools norm -d none \
         -Oz -o variants.vcf.gz \
         2> >(grep -v ^Lines)
 
-bcftools index variants.vcf.gz -f
+measure "bcftools index" bcftools index variants.vcf.gz -f
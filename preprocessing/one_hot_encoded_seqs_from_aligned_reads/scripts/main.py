@@ -1,18 +1,77 @@
 import argparse
-import subprocess
 import pandas as pd
-import io
+import numpy as np
+import pysam
+import os
+import shlex
+import sys
+from pileup import one_hot_consensus
+from result_cache import ResultCache
+import instrumentation
+from workdir import make_workdir
 
 """
-Entrypoint for a Docker container which uses `sambamba` to generate one-hot-encoded
-sequences from a SAM/BAM file. The start and end coordinates of the sequences are read
-from a CSV file (which is required and should have the header line 'locus,start,end').
-The sequences are concatenated without any gaps.
+Entrypoint for a Docker container which generates one-hot-encoded sequences from a
+SAM/BAM/CRAM file. The reads overlapping the target regions are piled up in-process and
+the consensus base at each position is one-hot-encoded. If the input is a BAM/CRAM file
+sorted by coordinate, the target regions are read from it directly (using an existing
+index if there is one); otherwise, only the reads overlapping the target regions are
+extracted and sorted. The start and end coordinates of the sequences are read from a CSV
+file (which is required and should have the header line 'locus,start,end'). The
+sequences are concatenated without any gaps (in coordinate order). The output is written
+as CSV or, if the name of the output file ends with `.npy` or `.npz`, as binary uint8
+array (`.npz` also holds the locus boundaries).
 """
 
+
+def write_one_hot(one_hot, locus_lengths, filename):
+    """
+    Writes the one-hot-encoded sequences (a `uint8` array) to a CSV file or, if the
+    filename ends with `.npy` or `.npz`, as binary array. `.npy` files can be
+    memory-mapped by the consumer; `.npz` files also hold the names of the loci and the
+    (exclusive) end of each locus in the concatenated sequence.
+    """
+    if filename.endswith(".npy"):
+        np.save(filename, one_hot)
+    elif filename.endswith(".npz"):
+        np.savez(
+            filename,
+            one_hot=one_hot,
+            loci=np.array(list(locus_lengths.keys()), dtype=str),
+            locus_ends=np.cumsum(list(locus_lengths.values())),
+        )
+    else:
+        pd.DataFrame(one_hot, columns=list("ACGT")).to_csv(filename, index=False)
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def find_index(filename):
+    """
+    Returns the path of an existing (and not outdated) index of a BAM/CRAM file or
+    `None` if there is none.
+    """
+    for ext in (".bai", ".csi", ".crai"):
+        for index_file in (filename + ext, os.path.splitext(filename)[0] + ext):
+            if os.path.isfile(index_file) and os.path.getmtime(
+                index_file
+            ) >= os.path.getmtime(filename):
+                return index_file
+    return None
+
+
 parser = argparse.ArgumentParser(
     description="""Extract one-hot-encoded consensus sequences from aligned reads. Needs
-                a SAM/BAM file and a CSV file with the coordinates of the regions
+                a SAM/BAM/CRAM file and a CSV file with the coordinates of the regions
                 to extract. Writes the output to a CSV file. Providing an output file is
                 required."""
 )
@@ -21,7 +80,7 @@ parser.add_argument(
     "--bam",
     type=str,
     metavar="FILE",
-    help="alignment file (SAM/BAM) [required]",
+    help="alignment file (SAM/BAM/CRAM) [required]",
     required=True,
 )
 parser.add_argument(
@@ -37,51 +96,148 @@ parser.add_argument(
     "--output",
     type=str,
     metavar="FILE",
-    help="output file [required]",
+    help=(
+        "output file [required]; the one-hot-encoded sequences are written as binary "
+        "uint8 array if the filename ends with '.npy' or '.npz' and as CSV otherwise"
+    ),
     required=True,
 )
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=check_positive_int,
+    metavar="INT",
+    help="number of threads to use [default: %(default)d]",
+    default=1,
+)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory for caching the output (keyed by the checksums of the inputs; can "
+        "be shared between runs via a mounted volume); no caching if not provided"
+    ),
+)
+parser.add_argument(
+    "--cache-size",
+    type=check_positive_int,
+    metavar="INT",
+    default=1024,
+    help=(
+        "maximum size of the cache in MB (least recently used entries are removed) "
+        "[default: %(default)d]"
+    ),
+)
+parser.add_argument(
+    "--workdir",
+    "--scratch",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory in which a unique directory for the intermediate files is created "
+        "and removed afterwards (e.g. a tmpfs mount to keep them in memory); only the "
+        "final output is written to the working directory [default: $TMPDIR or /tmp]"
+    ),
+)
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="profile the Python code with cProfile and write the stats to this file",
+)
 args = parser.parse_args()
+instrumentation.init(args.resource_report, args.profile)
+workdir = make_workdir(args.workdir)
 
-# check if the aligned reads are in a BAM file and create one if not
-if not args.bam.endswith(".bam"):
-    subprocess.run(
-        ["samtools", "view", "-b", "-h", "-o", "reads.bam", args.bam],
+cache = (
+    ResultCache(args.cache_dir, args.cache_size)
+    if args.cache_dir is not None
+    else None
+)
+if cache is not None:
+    # the output only depends on the aligned reads, the regions, and the output format
+    # (not on the number of threads) --> we are done if it has been cached already
+    output_format = os.path.splitext(args.output)[1]
+    output_key = cache.key(
+        "one-hot",
+        [args.bam, args.regions],
+        {"format": output_format if output_format in (".npy", ".npz") else ".csv"},
     )
-    input_reads = "reads.bam"
-else:
-    input_reads = args.bam
-# sort the BAM file
-subprocess.run(["samtools", "sort", input_reads, "-o", "reads.sorted.bam"])
-# index the sorted BAM file
-subprocess.run(["samtools", "index", "reads.sorted.bam"])
-# get the name of the reference sequence that was used to generate the SAM/BAM file
-ref_seq_name = subprocess.run(
-    ["samtools", "idxstats", "reads.sorted.bam"], capture_output=True, text=True
-).stdout.split()[0]
+    if cache.get(output_key, {"output": args.output}):
+        sys.exit(0)
 
-# sambamba needs a BED file --> convert the CSV
 regions = pd.read_csv(args.regions)
-regions["chr"] = ref_seq_name
-regions[["start", "end"]] -= 1
-regions[["chr", "start", "end", "locus"]].to_csv(
-    "regions.bed", index=False, header=False, sep="\t"
-)
+with pysam.AlignmentFile(args.bam) as f:
+    # get the name of the reference sequence that was used to generate the alignment
+    # file and check whether it is sorted
+    ref_seq_name = f.references[0]
+    is_sorted = f.header.to_dict().get("HD", {}).get("SO") == "coordinate"
+    is_sam = f.is_sam
+index_file = find_index(args.bam)
+if is_sorted and not is_sam:
+    # the reads can be read by region directly; only create an index (in the directory
+    # for the intermediate files) if there is none yet
+    input_reads = args.bam
+    if index_file is None:
+        index_ext = "crai" if args.bam.endswith(".cram") else "bai"
+        index_file = f"{workdir}/reads.{index_ext}"
+        instrumentation.run(
+            "indexing",
+            ["samtools", "index", "-@", str(args.threads), args.bam, index_file],
+            check=True,
+        )
+else:
+    # extract only the reads overlapping the target regions (this needs a BED file) and
+    # sort and index just those
+    bed = regions[["locus", "start", "end"]].assign(chr=ref_seq_name)
+    bed[["start", "end"]] -= 1
+    bed[["chr", "start", "end", "locus"]].to_csv(
+        f"{workdir}/regions.bed", index=False, header=False, sep="\t"
+    )
+    instrumentation.run(
+        "extracting reads",
+        [
+            "bash",
+            "-o",
+            "pipefail",
+            "-c",
+            f"samtools view -u -L regions.bed -@ {args.threads} "
+            f"{shlex.quote(os.path.abspath(args.bam))} | "
+            f"samtools sort -@ {args.threads} -o reads.sorted.bam - && "
+            "samtools index reads.sorted.bam",
+        ],
+        cwd=workdir,
+        check=True,
+    )
+    input_reads = f"{workdir}/reads.sorted.bam"
+    index_file = f"{workdir}/reads.sorted.bam.bai"
 
-# now run sambamba and parse the output to produce one-hot encoding
-sambamba_output = pd.read_csv(
-    io.StringIO(
-        subprocess.run(
-            ["sambamba", "depth", "base", "-L", "regions.bed", "reads.sorted.bam"],
-            capture_output=True,
-            text=True,
-        ).stdout
-    ),
-    sep="\t",
-    usecols=["REF", "POS", "A", "C", "G", "T", "DEL"],
-    index_col=[0, 1],
-)
-consensus_seq = sambamba_output.idxmax(axis=1)
-# drop deletions if there were any
-consensus_seq = consensus_seq[consensus_seq != "DEL"]
-res = pd.get_dummies(consensus_seq)[["A", "C", "G", "T"]]
-res.to_csv(args.output, index=False)
+# pile up the reads in the target regions (the coordinates in the CSV are 1-based, but
+# the end is exclusive) and get the one-hot-encoded consensus sequence
+with instrumentation.stage("pileup"):
+    one_hot, locus_lengths = one_hot_consensus(
+        input_reads,
+        ref_seq_name,
+        [
+            (locus, start - 1, end - 1)
+            for locus, start, end in regions[["locus", "start", "end"]].itertuples(
+                index=False
+            )
+        ],
+        args.threads,
+        index_file,
+    )
+with instrumentation.stage("writing output"):
+    write_one_hot(one_hot, locus_lengths, args.output)
+if cache is not None:
+    cache.put(output_key, {"output": args.output})
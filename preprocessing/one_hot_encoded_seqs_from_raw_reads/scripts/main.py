@@ -1,19 +1,49 @@
 import argparse
-import subprocess
 import pandas as pd
-import io
+import numpy as np
+from pileup import one_hot_consensus
+from result_cache import ResultCache
+import instrumentation
+from workdir import make_workdir
+import read_filter
 import os
+import sys
 
 ref_file = "/internal_data/refgenome.fa"
 
 """
-Entrypoint for a Docker container which uses `sambamba` to generate one-hot-encoded
-sequences from raw M. tuberculosis reads (after aligning them to the M. tuberculosis
-genome with `bwa-mem2`). The reference genome is H37Rv (asm19595v2). The start and end
-coordinates of the sequences are read from a CSV file (which is required and should have
-the header line 'locus,start,end'). The sequences are concatenated without any gaps.
+Entrypoint for a Docker container which generates one-hot-encoded sequences from raw M.
+tuberculosis reads (after aligning them to the M. tuberculosis genome with `bwa-mem2`).
+The reference genome is H37Rv (asm19595v2). The reads overlapping the target regions are
+piled up in-process and the consensus base at each position is one-hot-encoded. The
+start and end coordinates of the sequences are read from a CSV file (which is required
+and should have the header line 'locus,start,end'). The sequences are concatenated
+without any gaps (in coordinate order). The output is written as CSV or, if the name of
+the output file ends with `.npy` or `.npz`, as binary uint8 array (`.npz` also holds the
+locus boundaries).
 """
 
+
+def write_one_hot(one_hot, locus_lengths, filename):
+    """
+    Writes the one-hot-encoded sequences (a `uint8` array) to a CSV file or, if the
+    filename ends with `.npy` or `.npz`, as binary array. `.npy` files can be
+    memory-mapped by the consumer; `.npz` files also hold the names of the loci and the
+    (exclusive) end of each locus in the concatenated sequence.
+    """
+    if filename.endswith(".npy"):
+        np.save(filename, one_hot)
+    elif filename.endswith(".npz"):
+        np.savez(
+            filename,
+            one_hot=one_hot,
+            loci=np.array(list(locus_lengths.keys()), dtype=str),
+            locus_ends=np.cumsum(list(locus_lengths.values())),
+        )
+    else:
+        pd.DataFrame(one_hot, columns=list("ACGT")).to_csv(filename, index=False)
+
+
 parser = argparse.ArgumentParser(
     description="""
         Aligns raw reads to the M. tuberculosis H37Rv genome (asm19595v2) and then
@@ -56,6 +86,17 @@ parser.add_argument(
     help="number of threads to use",
     default=1,
 )
+parser.add_argument(
+    "--bwa-index-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory holding bwa-mem2 indices of the reference genome (e.g. a mounted "
+        "cache shared between runs); the index is only built if there is none for the "
+        "checksum of the reference yet [default: %(default)s]"
+    ),
+    default="/internal_data/bwa-index",
+)
 parser.add_argument(
     "-r",
     "--regions",
@@ -69,78 +110,143 @@ parser.add_argument(
     "--output",
     type=str,
     metavar="FILE",
-    help="output file [required]",
+    help=(
+        "output file [required]; the one-hot-encoded sequences are written as binary "
+        "uint8 array if the filename ends with '.npy' or '.npz' and as CSV otherwise"
+    ),
     required=True,
 )
+read_filter.add_arguments(parser)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory for caching the aligned reads and the output (keyed by the "
+        "checksums of the inputs; can be shared between runs via a mounted volume); no "
+        "caching if not provided"
+    ),
+)
+parser.add_argument(
+    "--cache-size",
+    type=check_positive_int,
+    metavar="INT",
+    default=10240,
+    help=(
+        "maximum size of the cache in MB (least recently used entries are removed) "
+        "[default: %(default)d]"
+    ),
+)
+parser.add_argument(
+    "--workdir",
+    "--scratch",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory in which a unique directory for the intermediate files is created "
+        "and removed afterwards (e.g. a tmpfs mount to keep them in memory); only the "
+        "final output is written to the working directory [default: $TMPDIR or /tmp]"
+    ),
+)
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage (and of the tools in the pipelines) as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="profile the Python code with cProfile and write the stats to this file",
+)
 # parse arguments
 args = parser.parse_args()
+read_filter.check_arguments(parser, args)
+instrumentation.init(args.resource_report, args.profile)
+workdir = make_workdir(args.workdir)
 
-# trim reads
-subprocess.run(
-    [
-        "trimmomatic",
-        "PE",
-        "-threads",
-        str(args.threads),
-        "-phred33",
-        "-baseout",
-        "./trimmed",
-        args.forward_reads,
-        args.reverse_reads,
-        "LEADING:3",
-        "TRAILING:3",
-        "SLIDINGWINDOW:4:20",
-        "MINLEN:36",
-    ]
+bam_files = {
+    file: f"{workdir}/{file}" for file in ["reads.sorted.bam", "reads.sorted.bam.bai"]
+}
+# the target regions as 0-based, half-open intervals (the coordinates in the CSV are
+# 1-based, but the end is exclusive)
+regions = pd.read_csv(args.regions)
+targets = [
+    (locus, start - 1, end - 1)
+    for locus, start, end in regions[["locus", "start", "end"]].itertuples(index=False)
+]
+prefilter, prefilter_params = read_filter.alignment_params(args)
+cache = (
+    ResultCache(args.cache_dir, args.cache_size)
+    if args.cache_dir is not None
+    else None
 )
+if cache is not None:
+    # the alignment only depends on the reads and the reference (and with the prefilter
+    # also on the regions; the subsampling parameters are part of `prefilter_params`)
+    # and the output also on the regions and the output format (the number of threads
+    # doesn't change the results) --> we are done if the output has been cached already
+    # (unless the prefilter is to be validated)
+    inputs = [args.forward_reads, args.reverse_reads, ref_file]
+    output_format = os.path.splitext(args.output)[1]
+    output_key = cache.key(
+        "one-hot",
+        inputs + [args.regions],
+        {
+            "format": output_format if output_format in (".npy", ".npz") else ".csv",
+            **prefilter_params,
+        },
+    )
+    if not args.validate_prefilter and cache.get(output_key, {"output": args.output}):
+        sys.exit(0)
+    alignment_key = cache.key(
+        "alignment", inputs + ([args.regions] if prefilter else []), prefilter_params
+    )
 
-# mapping
-subprocess.run(
-    [
-        "bash",
-        "/mapping-pipeline.sh",
-        "trimmed_1P",
-        "trimmed_2P",
-        "/internal_data/refgenome.fa",
+if cache is None or args.validate_prefilter or not cache.get(alignment_key, bam_files):
+    # trim the reads and stream them into the mapping pipeline (which writes the BAM to
+    # its working directory --> use absolute paths)
+    mapping_args = [
+        os.path.abspath(args.forward_reads),
+        os.path.abspath(args.reverse_reads),
+        ref_file,
         str(args.threads),
+        os.path.abspath(args.bwa_index_dir),
     ]
-)
-
-# sambamba needs a BED file --> convert the CSV
-regions = pd.read_csv(args.regions)
-regions["chr"] = "Chromosome"
-regions[["start", "end"]] -= 1
-regions[["chr", "start", "end", "locus"]].to_csv(
-    "regions.bed", index=False, header=False, sep="\t"
-)
-
-# now run sambamba and parse the output to produce the one-hot encoding
-sambamba_output = pd.read_csv(
-    io.StringIO(
-        subprocess.run(
-            ["sambamba", "depth", "base", "-L", "regions.bed", "reads.sorted.bam"],
-            capture_output=True,
-            text=True,
-        ).stdout
-    ),
-    sep="\t",
-    usecols=["REF", "POS", "A", "C", "G", "T", "DEL"],
-    index_col=[0, 1],
-)
-consensus_seq = sambamba_output.idxmax(axis=1)
-# drop deletions if there were any
-consensus_seq = consensus_seq[consensus_seq != "DEL"]
-res = pd.get_dummies(consensus_seq)[["A", "C", "G", "T"]]
-res.to_csv(args.output, index=False)
+    # arguments for the read filter (see `filter-reads.py`)
+    mapping_args += read_filter.mapping_args(args, targets, workdir)
+    instrumentation.run(
+        "alignment",
+        ["bash", "/mapping-pipeline.sh"] + mapping_args,
+        cwd=workdir,
+        check=True,
+    )
+    if cache is not None:
+        cache.put(alignment_key, bam_files)
+    if args.validate_prefilter:
+        read_filter.write_bed(targets, f"{workdir}/targets.bed")
+        read_filter.validate_prefilter(
+            f"{workdir}/reads.sorted.bam", f"{workdir}/targets.bed", workdir
+        )
+if args.max_depth is not None:
+    read_filter.write_bed(targets, f"{workdir}/targets.bed")
+    read_filter.report_depth(
+        f"{workdir}/reads.sorted.bam",
+        f"{workdir}/targets.bed",
+        [locus for locus, _, _ in targets],
+    )
 
-# clean up
-for file in [
-    "trimmed_1P",
-    "trimmed_1U",
-    "trimmed_2P",
-    "trimmed_2U",
-    "reads.sorted.bam",
-    "reads.sorted.bam.bai",
-    "regions.bed",
-]:
-    os.remove(file)
+# pile up the reads in the target regions and get the one-hot-encoded consensus
+# sequence
+with instrumentation.stage("pileup"):
+    one_hot, locus_lengths = one_hot_consensus(
+        f"{workdir}/reads.sorted.bam", "Chromosome", targets, args.threads
+    )
+with instrumentation.stage("writing output"):
+    write_one_hot(one_hot, locus_lengths, args.output)
+if cache is not None:
+    cache.put(output_key, {"output": args.output})
@@ -0,0 +1,55 @@
+#!/bin/bash
+# set flags for "strict" mode
+set -Eeuxo pipefail
+
+# store paths in variables
+bam_file=$1
+target_vars_file=$2
+# directory for the intermediate files (defaults to the working directory)
+workdir=${3:-.}
+vcf_header=/internal_data/vcf_header.txt
+refgenome=/internal_data/refgenome.fa
+
+# `measure NAME CMD [ARGS...]` records the resource usage of a command if
+# instrumentation is enabled
+source "$(dirname "${BASH_SOURCE[0]}")/measure.sh"
+
+# write the target variants to a dummy VCF and a dummy BED file
+cp $vcf_header "$workdir/vars.vcf"
+sed '1d' "$target_vars_file" | awk -F',' \
+    'BEGIN{OFS="\t"}
+    {print "Chromosome", $1, ".", $2, $3, ".", ".", "AF=1"}' |
+    sort -k2,2 -n >>"$workdir/vars.vcf"
+grep -v "#" "$workdir/vars.vcf" | awk -F'\t' \
+    'BEGIN{OFS="\t"}
+    {print "Chromosome", $2-1, $2, ".", ".", $3, $4, ".", "AF=1"}' |
+    sort -k2,2 -n >"$workdir/vars.bed"
+
+# extract the reads overlapping with the variants of interest; if the input is sorted,
+# use its index (and only create one if there is none yet) to read just the target
+# regions; otherwise (or for SAM files) stream through the file and sort only the
+# extracted reads
+index_file=""
+for ext in bai csi crai; do
+    for candidate in "$bam_file.$ext" "${bam_file%.*}.$ext"; do
+        if [[ -z $index_file && -f $candidate && ! $candidate -ot $bam_file ]]; then
+            index_file=$candidate
+        fi
+    done
+done
+header=$(samtools view -H "$bam_file" -T $refgenome)
+if [[ $bam_file != *.sam ]] && grep -qP '^@HD\t.*SO:coordinate' <<<"$header"; then
+    if [[ -z $index_file ]]; then
+        # write the index to the directory for the intermediate files (and not next to
+        # the input)
+        index_file=$workdir/input.$([[ $bam_file == *.cram ]] && echo crai || echo bai)
+        measure "samtools index" samtools index "$bam_file" "$index_file"
+    fi
+    measure "samtools view" samtools view -bML "$workdir/vars.bed" -T $refgenome \
+        -X "$bam_file" "$index_file" >"$workdir/extracted.bam"
+else
+    measure "samtools view" \
+        samtools view -uL "$workdir/vars.bed" -T $refgenome "$bam_file" |
+        measure "samtools sort" \
+            samtools sort -T "$workdir/sort" -o "$workdir/extracted.bam" -
+fi
@@ -0,0 +1,39 @@
+import pandas as pd
+
+"""
+Turns the raw calls of the samples (as returned by `get_genotypes` in `main.py`) into a
+genotype matrix with the target variants as columns. This is kept out of `main.py` so
+that it can be used without running the CLI.
+"""
+
+
+def process_genotypes(variants, AFs, DP_threshold):
+    """
+    Takes the raw calls of all samples (a dict of DataFrames as returned by
+    `get_genotypes`) and returns the genotype matrix (samples x target variants) with
+    non-calls, calls with DP below the threshold, and missing variants replaced by the
+    corresponding allele frequencies together with a table of stats (one row per
+    sample). All steps are vectorized across samples.
+    """
+    samples = pd.Index(variants.keys(), name="sample")
+    calls = pd.concat(variants, names=["sample"])
+    # get the first char from the `x/x` genotype field and replace non-calls with NA
+    GT = calls["GT"].astype(str).str[0].replace(".", pd.NA)
+    # declare variants with DP < threshold also as non-calls
+    GT[pd.to_numeric(calls["DP"].replace(".", -1)) < DP_threshold] = pd.NA
+    # collect basic stats on how many variants had to be replaced etc.
+    is_target = pd.Series(
+        calls.index.droplevel("sample").isin(AFs.index), index=calls.index
+    )
+    stats = pd.DataFrame(index=samples)
+    stats["shared_variants"] = is_target.groupby("sample").sum()
+    stats["dropped_variants"] = (~is_target).groupby("sample").sum()
+    stats["noncalls"] = GT.isna().groupby("sample").sum()
+    stats = stats.fillna(0).astype(int)
+    stats.insert(2, "missing_variants", len(AFs) - stats["shared_variants"])
+    stats["variants_set_to_AF"] = stats[["noncalls", "missing_variants"]].sum(axis=1)
+    # make a matrix with the variants in the order expected by the model and replace
+    # non-calls and missing variants with the corresponding AF values
+    GT = GT[is_target].unstack(["POS", "REF", "ALT"])
+    GT = GT.reindex(index=samples, columns=AFs.index).fillna(AFs).astype(float)
+    return GT, stats
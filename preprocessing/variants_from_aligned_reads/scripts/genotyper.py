@@ -0,0 +1,102 @@
+import pysam
+import pandas as pd
+
+"""
+Simple targeted genotyper used as a fast alternative to running `freebayes` with
+`--variant-input ... --only-use-input-alleles`. For each target variant, the reads
+spanning the REF allele are piled up and the sequence each read carries over that window
+(including inserted bases) is compared to the REF and ALT alleles. This also covers
+simple indels as long as the reads and target variants are normalized (left-aligned)
+consistently. Genotypes are haploid: a variant is called if the majority of the reads
+spanning it support the ALT allele.
+"""
+
+# reads with any of these flags are ignored (unmapped, secondary, QC fail, duplicate)
+FILTER_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+MATCH_OPS = (pysam.CMATCH, pysam.CEQUAL, pysam.CDIFF)
+REF_ONLY_OPS = (pysam.CDEL, pysam.CREF_SKIP)
+QUERY_ONLY_OPS = (pysam.CINS, pysam.CSOFT_CLIP)
+
+
+def read_allele(read, start, end):
+    """
+    Returns the sequence and the lowest base quality of the bases `read` carries between
+    the reference positions `start` and `end` (0-based, half-open). Bases inserted after
+    any position in the window are included (but not their qualities). Returns `None` if
+    the read doesn't span the window.
+    """
+    if read.reference_start > start or read.reference_end < end:
+        return None
+    seq = read.query_sequence
+    quals = read.query_qualities
+    pieces = []
+    piece_quals = []
+    ref_pos = read.reference_start
+    query_pos = 0
+    for op, length in read.cigartuples:
+        # only an insertion right after the last position of the window is still
+        # relevant once we reached the end
+        if ref_pos > end or (ref_pos == end and op != pysam.CINS):
+            break
+        if op in MATCH_OPS:
+            block_start = max(ref_pos, start)
+            block_end = min(ref_pos + length, end)
+            if block_start < block_end:
+                q_start = query_pos + block_start - ref_pos
+                q_end = query_pos + block_end - ref_pos
+                pieces.append(seq[q_start:q_end])
+                if quals is not None:
+                    piece_quals.extend(quals[q_start:q_end])
+            ref_pos += length
+            query_pos += length
+        elif op in REF_ONLY_OPS:
+            ref_pos += length
+        elif op in QUERY_ONLY_OPS:
+            if op == pysam.CINS and start < ref_pos <= end:
+                pieces.append(seq[query_pos : query_pos + length])
+            query_pos += length
+    return "".join(pieces).upper(), min(piece_quals, default=None)
+
+
+def genotype(
+    bam_file,
+    target_vars,
+    chrom="Chromosome",
+    min_mapping_quality=1,
+    min_base_quality=0,
+    reference_file=None,
+):
+    """
+    Genotypes the target variants (a DataFrame with the columns `POS`, `REF`, and `ALT`)
+    in a sorted and indexed BAM/CRAM file. Returns a DataFrame with the columns `GT`
+    (`0`, `1`, or `.` if no read spans the variant) and `DP` (the number of reads
+    spanning the variant that passed the filters) indexed by `POS`, `REF`, and `ALT`.
+    """
+    res = []
+    with pysam.AlignmentFile(bam_file, reference_filename=reference_file) as bam:
+        for pos, ref, alt in target_vars[["POS", "REF", "ALT"]].itertuples(index=False):
+            start, end = pos - 1, pos - 1 + len(ref)
+            depth = alt_support = 0
+            for read in bam.fetch(chrom, start, end):
+                if (
+                    read.flag & FILTER_FLAGS
+                    or read.mapping_quality < min_mapping_quality
+                    or read.query_sequence is None
+                ):
+                    continue
+                allele = read_allele(read, start, end)
+                if allele is None:
+                    continue
+                seq, qual = allele
+                if qual is not None and qual < min_base_quality:
+                    continue
+                depth += 1
+                alt_support += seq == alt.upper()
+            if depth == 0:
+                gt = "."
+            else:
+                gt = "1" if alt_support > depth - alt_support else "0"
+            res.append((pos, ref, alt, gt, depth))
+    return pd.DataFrame(res, columns=["POS", "REF", "ALT", "GT", "DP"]).set_index(
+        ["POS", "REF", "ALT"]
+    )
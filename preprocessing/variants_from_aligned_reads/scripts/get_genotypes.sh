@@ -5,29 +5,23 @@ set -Eeuxo pipefail
 # store paths in variables
 bam_file=$1
 target_vars_file=$2
-vcf_header=/internal_data/vcf_header.txt
+# directory for the intermediate files (defaults to the working directory)
+workdir=${3:-.}
 refgenome=/internal_data/refgenome.fa
 
-# write the target variants to a dummy VCF and a dummy BED file
-cp $vcf_header vars.vcf
-sed '1d' "$target_vars_file" | awk -F',' \
-    'BEGIN{OFS="\t"}
-    {print "Chromosome", $1, ".", $2, $3, ".", ".", "AF=1"}' |
-    sort -k2,2 -n >>vars.vcf
-grep -v "#" vars.vcf | awk -F'\t' \
-    'BEGIN{OFS="\t"}
-    {print "Chromosome", $2-1, $2, ".", ".", $3, $4, ".", "AF=1"}' |
-    sort -k2,2 -n >vars.bed
+# `measure NAME CMD [ARGS...]` records the resource usage of a command if
+# instrumentation is enabled
+source "$(dirname "${BASH_SOURCE[0]}")/measure.sh"
 
-# extract the reads overlapping with the variants of interest
-samtools index "$bam_file"
-samtools view -bML vars.bed "$bam_file" -T $refgenome >extracted.bam
+# write the target variants to a dummy VCF and BED file and extract the reads
+# overlapping with them into `extracted.bam`
+bash /extract-reads.sh "$bam_file" "$target_vars_file" "$workdir"
 
 # print the header for the result
 echo 'POS,REF,ALT,GT,DP'
 # now run freebayes and format the output
-freebayes -f $refgenome extracted.bam \
-    --variant-input vars.vcf \
+measure freebayes freebayes -f $refgenome "$workdir/extracted.bam" \
+    --variant-input "$workdir/vars.vcf" \
     --only-use-input-alleles |
-    bcftools norm -f $refgenome -m - 2> >(grep -v ^Lines) |
-    bcftools query -f '%POS,%REF,%ALT,[%GT,%DP]\n'
+    measure "bcftools norm" bcftools norm -f $refgenome -m - 2> >(grep -v ^Lines) |
+    measure "bcftools query" bcftools query -f '%POS,%REF,%ALT,[%GT,%DP]\n'
@@ -1,39 +1,204 @@
 import pandas as pd
 import argparse
-import subprocess
+import concurrent.futures
+import functools
+import tempfile
+import os
 import sys
 import io
+import subprocess
+from genotyper import genotype
+from genotype_matrix import process_genotypes
+from result_cache import ResultCache
+import instrumentation
+from workdir import make_workdir
+
+REF_FILE = "/internal_data/refgenome.fa"
 
 """
 Entrypoint for a Docker container holding a simple variant calling pipeline: Parses
 arguments and then calls a shell script containing the pipeline. Expects the name of a
-sorted BAM/CRAM file with M. tuberculosis reads aligned against the reference strain
-H37Rv (ASM19595v2) and a CSV file with target variants (i.e. variants for which we want
-genotypes) in the format `POS,REF,ALT,AF`. This CSV file should also hold allele
-frequencies in the last column which are used to replace missing genotypes / non-calls.
-The container writes the called variants in the format `POS,REF,ALT,GT` to the output
-file. It will also print some simple stats (e.g. the number of missing variants,
-noncalls, etc.) to STDOUT.
+(preferably sorted) BAM/CRAM file with M. tuberculosis reads aligned against the
+reference strain H37Rv (ASM19595v2) and a CSV file with target variants (i.e. variants
+for which we want genotypes) in the format `POS,REF,ALT,AF`. This CSV file should also
+hold allele frequencies in the last column which are used to replace missing genotypes /
+non-calls. The container writes the called variants in the format `POS,REF,ALT,GT` to
+the output file. It will also print some simple stats (e.g. the number of missing
+variants, noncalls, etc.) to STDOUT.
+
+With `--manifest`, many BAM/CRAM files are processed (in parallel with `--processes`)
+and a single genotype matrix with one row per sample and one column per target variant
+(named `POS_REF_ALT`) is written instead. The stats are then printed as a table with one
+row per sample.
 """
 
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def sample_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def read_manifest(manifest):
+    """
+    Reads the paths of the BAM/CRAM files (one per line) from the manifest and returns
+    them in a dict keyed by the sample names (the filenames without extension).
+    """
+    with open(manifest) as f:
+        files = [line.strip() for line in f if line.strip()]
+    samples = {sample_name(file): file for file in files}
+    if len(samples) != len(files):
+        raise ValueError(f"Sample names (filenames) in {manifest} are not unique")
+    return samples
+
+
+def get_genotypes(
+    bam_file,
+    target_vars_file,
+    engine,
+    min_mapping_quality,
+    min_base_quality,
+    cache=None,
+):
+    """
+    Returns the raw calls of the target variants in a single BAM/CRAM file (see
+    `call_genotypes`) from the cache (if provided) or calls them and adds them to the
+    cache.
+    """
+    call = functools.partial(
+        call_genotypes,
+        bam_file,
+        target_vars_file,
+        engine,
+        min_mapping_quality,
+        min_base_quality,
+    )
+    if cache is None:
+        return call()
+    # the calls don't depend on the DP threshold (which is applied later) and the
+    # quality thresholds are only used by the built-in genotyper
+    params = {"engine": engine}
+    if engine == "pileup":
+        params.update(
+            min_mapping_quality=min_mapping_quality, min_base_quality=min_base_quality
+        )
+    key = cache.key("genotypes", [bam_file, target_vars_file, REF_FILE], params)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        calls_file = f"{tmp_dir}/calls.csv"
+        if cache.get(key, {"calls.csv": calls_file}):
+            return pd.read_csv(calls_file, index_col=["POS", "REF", "ALT"])
+        calls = call()
+        calls.to_csv(calls_file)
+        cache.put(key, {"calls.csv": calls_file})
+    return calls
+
+
+def call_genotypes(
+    bam_file, target_vars_file, engine, min_mapping_quality, min_base_quality
+):
+    """
+    Genotypes the target variants in a single BAM/CRAM file and returns the raw calls (a
+    DataFrame with the columns `GT` and `DP` indexed by `POS`, `REF`, and `ALT`). The
+    intermediate files are written to a separate temporary directory so that several
+    samples can be processed side by side.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        if engine == "pileup":
+            # extract the reads overlapping the target variants and genotype them
+            # in-process
+            instrumentation.run(
+                "extracting reads",
+                ["/bin/bash", "/extract-reads.sh", bam_file, target_vars_file, workdir],
+                check=True,
+            )
+            instrumentation.run(
+                "samtools index",
+                ["samtools", "index", f"{workdir}/extracted.bam"],
+                check=True,
+            )
+            with instrumentation.stage("genotyping"):
+                return genotype(
+                    f"{workdir}/extracted.bam",
+                    pd.read_csv(target_vars_file),
+                    min_mapping_quality=min_mapping_quality,
+                    min_base_quality=min_base_quality,
+                    reference_file=REF_FILE,
+                )
+        try:
+            p = instrumentation.run(
+                "genotyping",
+                ["/bin/bash", "/get_genotypes.sh", bam_file, target_vars_file, workdir],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            # the header is printed before freebayes runs, so the output of a failed
+            # pipeline could otherwise be mistaken for a sample without any calls
+            raise RuntimeError(
+                f"Genotyping pipeline failed for {bam_file}:\n{e.stderr}"
+            ) from e
+        try:
+            return pd.read_csv(io.StringIO(p.stdout), index_col=["POS", "REF", "ALT"])
+        except pd.errors.EmptyDataError:
+            raise RuntimeError(
+                f"No variants produced by pipeline for {bam_file}. Error?\n{p.stderr}"
+            )
+
+
 parser = argparse.ArgumentParser(
     description="""
-    Variant calling pipeline accepting a sorted BAM/CRAM file with reads aligned against
+    Variant calling pipeline accepting a BAM/CRAM/SAM file with reads aligned against
     the M. tyberculosis reference genome H37Rv (ASM19595v2) and a CSV of target variants
     (and allele frequencies) in the format `POS,REF,ALT,AF` as input. Calls the
     genotypes specified in the CSV and replaces missing genotypes / noncalls with the
     corresponding allele frequencies. Writes some basic stats to STDOUT and the variants
-    as `POS,REF,ALT,GT` to the output file (specified by '-o').
+    as `POS,REF,ALT,GT` to the output file (specified by '-o'). With '--manifest',
+    many samples are processed and a genotype matrix (samples x variants) is written
+    instead.
     """,
 )
 parser.add_argument(
     "-b",
     "--bam",
     type=str,
-    required=True,
-    help="Sorted BAM/CRAM file of reads aligned against a reference [required]",
+    help=(
+        "BAM/CRAM/SAM file of reads aligned against a reference; if it is sorted, only "
+        "the target regions are read (using an existing index if there is one) "
+        "[required unless '--manifest' is used]"
+    ),
     metavar="FILE",
 )
+parser.add_argument(
+    "--manifest",
+    type=str,
+    help=(
+        "File with the paths of many BAM/CRAM/SAM files (one per line); a single "
+        "genotype matrix with one row per sample (named after the file without "
+        "extension) is written"
+    ),
+    metavar="FILE",
+)
+parser.add_argument(
+    "-p",
+    "--processes",
+    type=check_positive_int,
+    help=(
+        "Number of samples to process in parallel with '--manifest' "
+        "[default: %(default)d]"
+    ),
+    default=1,
+    metavar="INT",
+)
 parser.add_argument(
     "-t",
     "--target-vars",
@@ -60,45 +225,128 @@ parser.add_argument(
     default=10,
     metavar="INT",
 )
+parser.add_argument(
+    "--engine",
+    type=str,
+    choices=["freebayes", "pileup"],
+    help=(
+        "genotyping engine; 'pileup' uses a built-in targeted genotyper which only "
+        "counts the reads supporting the REF and ALT alleles at the target variants "
+        "(haploid calls) and is much faster than 'freebayes' [default: %(default)s]"
+    ),
+    default="freebayes",
+)
+parser.add_argument(
+    "--min-mapping-quality",
+    type=int,
+    help=(
+        "ignore reads with lower mapping quality (only used with '--engine pileup') "
+        "[default: %(default)d]"
+    ),
+    default=1,
+    metavar="INT",
+)
+parser.add_argument(
+    "--min-base-quality",
+    type=int,
+    help=(
+        "ignore reads with a lower base quality at the variant (only used with "
+        "'--engine pileup') [default: %(default)d]"
+    ),
+    default=0,
+    metavar="INT",
+)
+parser.add_argument(
+    "--cache-dir",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory for caching the calls of each sample (keyed by the checksums of the "
+        "inputs; can be shared between runs via a mounted volume); no caching if not "
+        "provided"
+    ),
+)
+parser.add_argument(
+    "--cache-size",
+    type=check_positive_int,
+    help=(
+        "maximum size of the cache in MB (least recently used entries are removed) "
+        "[default: %(default)d]"
+    ),
+    default=1024,
+    metavar="INT",
+)
+parser.add_argument(
+    "--workdir",
+    "--scratch",
+    type=str,
+    metavar="DIR",
+    help=(
+        "directory in which a unique directory for the intermediate files is created "
+        "and removed afterwards (e.g. a tmpfs mount to keep them in memory); only the "
+        "final output is written to the working directory [default: $TMPDIR or /tmp]"
+    ),
+)
+parser.add_argument(
+    "--resource-report",
+    type=str,
+    metavar="FILE",
+    help=(
+        "write the wall time, CPU time, peak RSS, and bytes read / written of each "
+        "stage (and of the tools in the pipelines) as JSON to this file"
+    ),
+)
+parser.add_argument(
+    "--profile",
+    type=str,
+    metavar="FILE",
+    help="profile the Python code with cProfile and write the stats to this file",
+)
 
 args = parser.parse_args()
+instrumentation.init(args.resource_report, args.profile)
+# the temporary directories of the samples are created in here
+workdir = make_workdir(args.workdir)
+if (args.bam is None) == (args.manifest is None):
+    parser.error("Provide either a BAM/CRAM file (with '-b') or '--manifest'")
 # read the data
 AFs = pd.read_csv(args.target_vars, index_col=["POS", "REF", "ALT"]).squeeze()
-try:
-    variants = pd.read_csv(
-        io.StringIO(
-            (
-                p := subprocess.run(
-                    ["/bin/bash", "/get_genotypes.sh", args.bam, args.target_vars],
-                    capture_output=True,
-                    text=True,
-                )
-            ).stdout
-        ),
-        index_col=["POS", "REF", "ALT"],
-    )
-except pd.errors.EmptyDataError:
-    raise RuntimeError(f"No variants produced by pipeline. Error?\n{p.stderr}")
-# get the first char from the `x/x` genotype field and replace non-calls with NA
-variants["GT"] = variants["GT"].apply(lambda x: x[0]).replace(".", pd.NA)
-# declare variants with DP < threshold also as non-calls
-variants.loc[
-    variants["DP"].replace(".", -1).astype(int) < args.DP_threshold, "GT"
-] = pd.NA
-# collect basic stats on how many variants had to be replaed etc.
-stats = pd.Series(dtype=object)
-stats["shared_variants"] = len(AFs.index.intersection(variants.index))
-stats["dropped_variants"] = len(variants.index.difference(AFs.index))
-stats["missing_variants"] = len(AFs.index.difference(variants.index))
-stats["noncalls"] = variants["GT"].isna().sum()
-stats["variants_set_to_AF"] = stats[["noncalls", "missing_variants"]].sum()
-# replace non-calls and missing variants with the corresponding AF values
-variants = variants["GT"].fillna(AFs).astype(float)
-variants = pd.concat((variants, AFs[AFs.index.difference(variants.index)]))
-# make sure the order is as expected by the model
-variants = variants[AFs.index]
-
-# write to the variants to the output file and the stats to STDOUT
-variants.name = "GT"
-variants.to_csv(args.output)
-stats.to_csv(sys.stdout, header=False)
+if args.manifest is not None:
+    samples = read_manifest(args.manifest)
+else:
+    samples = {sample_name(args.bam): args.bam}
+# genotype the samples (the pipeline runs in temporary directories --> use absolute
+# paths)
+call = functools.partial(
+    get_genotypes,
+    target_vars_file=os.path.abspath(args.target_vars),
+    engine=args.engine,
+    min_mapping_quality=args.min_mapping_quality,
+    min_base_quality=args.min_base_quality,
+    cache=(
+        ResultCache(args.cache_dir, args.cache_size)
+        if args.cache_dir is not None
+        else None
+    ),
+)
+bam_files = [os.path.abspath(file) for file in samples.values()]
+if args.processes > 1 and len(bam_files) > 1:
+    with concurrent.futures.ProcessPoolExecutor(args.processes) as pool:
+        variants = dict(zip(samples, pool.map(call, bam_files)))
+else:
+    variants = {sample: call(bam_file) for sample, bam_file in zip(samples, bam_files)}
+with instrumentation.stage("processing genotypes"):
+    GT, stats = process_genotypes(variants, AFs, args.DP_threshold)
+
+with instrumentation.stage("writing output"):
+    if args.manifest is None:
+        # write to the variants to the output file and the stats to STDOUT
+        variants = GT.iloc[0]
+        variants.name = "GT"
+        variants.to_csv(args.output)
+        stats.iloc[0].to_csv(sys.stdout, header=False)
+    else:
+        # name the columns like the features of the prediction models (`POS_REF_ALT`)
+        GT.columns = ["_".join(str(x) for x in idx) for idx in GT.columns]
+        GT.to_csv(args.output)
+        stats.to_csv(sys.stdout)
@@ -0,0 +1,37 @@
+#!/bin/bash
+# Prints the prefix of the bwa-mem2 index of a reference genome. The index is kept in
+# `$index_dir/<sha256 of the reference>/` and is only built if there is no complete
+# index for the checksum of the reference yet. A lock on the index directory makes sure
+# that concurrent runs sharing it (e.g. via a mounted volume) don't race on building it.
+
+# set flags for "strict" mode
+set -Eeuo pipefail
+
+ref_fasta=$1
+index_dir=$2
+
+# `measure NAME CMD [ARGS...]` records the resource usage of a command if
+# instrumentation is enabled
+source "$(dirname "${BASH_SOURCE[0]}")/measure.sh"
+
+checksum=$(sha256sum "$ref_fasta" | cut -d ' ' -f 1)
+ref_name=$(basename "$ref_fasta")
+
+if [[ ! -f "$index_dir/$checksum/complete" ]]; then
+    mkdir -p "$index_dir"
+    (
+        flock 9
+        # check again in case another run built the index while we were waiting
+        if [[ ! -f "$index_dir/$checksum/complete" ]]; then
+            # build in a temporary directory and move it in place once complete
+            tmp_dir=$(mktemp -d "$index_dir/$checksum.tmp.XXXXXX")
+            measure "bwa-mem2 index" \
+                bwa-mem2 index -p "$tmp_dir/$ref_name" "$ref_fasta" >/dev/null 2>&1
+            touch "$tmp_dir/complete"
+            rm -rf "${index_dir:?}/$checksum"
+            mv "$tmp_dir" "$index_dir/$checksum"
+        fi
+    ) 9>"$index_dir/$checksum.lock"
+fi
+
+echo "$index_dir/$checksum/$ref_name"
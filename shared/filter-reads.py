@@ -0,0 +1,474 @@
+import os
+import sys
+import gzip
+import stat
+import zlib
+import queue
+import argparse
+import itertools
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+
+"""
+Streaming filter for paired FASTQ files which writes the selected pairs to the output
+files (e.g. the named pipes read by `trim-reads.py`) so that the other pairs are removed
+before trimming and alignment. Pairs can be selected in two ways (or both):
+
+- k-mer prefilter (`--regions`): builds the set of k-mers (of both strands) of the
+  target regions (plus flanks) of the reference genome and keeps only the pairs where at
+  least one mate shares a k-mer with the targets.
+- subsampling (`--max-depth`): estimates the sequencing depth from the first records
+  and the sizes of the input files and keeps a matching fraction of the pairs. Whether a
+  pair is kept only depends on its name and the seed, so the same pairs are selected in
+  every run (regardless of the number of threads or the order of the reads).
+
+The k-mers are kept in an open-addressing hash table (a single `uint64` array) so that
+all k-mers of a batch of reads can be encoded and looked up with vectorized operations.
+The batches are processed by a pool of threads (numpy releases the GIL) while the input
+files are read and the output files are written by separate threads. The output is
+written in the order of the input and each file has its own writer thread so that a
+consumer reading the two files in lockstep is never blocked.
+
+With `--keep-all`, the k-mer prefilter doesn't remove any pairs and only the names of
+the pairs passing it are recorded (with `--names`) so that it can be validated against
+the full alignment.
+"""
+
+# number of read pairs per batch, number of batches to buffer per file, and size of the
+# blocks read from the input files
+BATCH_SIZE = 20000
+MAX_BATCHES = 16
+BLOCK_SIZE = 4 * 1024**2
+# only the k-mers at every `STRIDE`-th position of a read are looked up; reads within
+# the flanked targets still have many chances to hit (even with sequencing errors) as
+# long as the flanks are longer than the reads
+STRIDE = 4
+# size of the chunk at the start of each input file used to estimate the depth
+SAMPLE_SIZE = 8 * 1024**2
+
+# 2-bit codes of the bases; other characters (e.g. `N`) are treated like `A` (this can
+# at most let a few extra pairs pass the filter)
+CODES = np.zeros(256, dtype=np.uint64)
+for i, bases in enumerate(["Aa", "Cc", "Gg", "Tt"]):
+    for base in bases:
+        CODES[ord(base)] = i
+COMPLEMENT = bytes.maketrans(b"ACGTacgt", b"TGCAtgca")
+# multiplier for Fibonacci hashing and marker of empty slots in the hash table (k-mers
+# have at most 62 bits and can't collide with it)
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+EMPTY = np.uint64(2**64 - 1)
+# constants of the SplitMix64 finalizer (used for hashing the read names)
+MIX_CONSTANTS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+class KmerSet:
+    """
+    Hash set of 2-bit encoded k-mers with linear probing. The table holds at least four
+    times as many slots as k-mers so that most lookups are resolved by the first probe.
+    """
+
+    def __init__(self, kmers):
+        kmers = np.unique(kmers)
+        self.bits = max(int(np.ceil(np.log2(4 * len(kmers) + 1))), 4)
+        self.mask = np.uint64((1 << self.bits) - 1)
+        self.table = np.full(1 << self.bits, EMPTY, dtype=np.uint64)
+        slots = self._slots(kmers)
+        while len(kmers):
+            # of several k-mers probing the same free slot, only the first one gets it
+            # and the others move on like those that found their slot taken
+            free = np.flatnonzero(self.table[slots] == EMPTY)
+            _, first = np.unique(slots[free], return_index=True)
+            placed = free[first]
+            self.table[slots[placed]] = kmers[placed]
+            rest = np.ones(len(kmers), dtype=bool)
+            rest[placed] = False
+            kmers, slots = kmers[rest], (slots[rest] + np.uint64(1)) & self.mask
+
+    def _slots(self, kmers):
+        return (kmers * HASH_MULTIPLIER) >> np.uint64(64 - self.bits)
+
+    def contains(self, kmers):
+        """
+        Returns a boolean array indicating which of the k-mers (a 1D array) are in the
+        set.
+        """
+        slots = self._slots(kmers)
+        entries = self.table[slots]
+        found = entries == kmers
+        # keep probing while the slot is taken by another k-mer
+        idx = np.flatnonzero(~found & (entries != EMPTY))
+        slots = slots[idx]
+        while len(idx):
+            slots = (slots + np.uint64(1)) & self.mask
+            entries = self.table[slots]
+            hit = entries == kmers[idx]
+            found[idx[hit]] = True
+            rest = ~hit & (entries != EMPTY)
+            idx, slots = idx[rest], slots[rest]
+        return found
+
+
+def encode_kmers(seqs, k, stride=1):
+    """
+    Returns the 2-bit encoded k-mers at every `stride`-th position of equally long
+    sequences (a 2D `uint8` array of ASCII codes with one row per sequence). The result
+    has one row per position and one column per sequence.
+    """
+    # one row per position so that the rolling update works on contiguous memory
+    codes = CODES[seqs.T]
+    mask = np.uint64((1 << (2 * k)) - 1)
+    kmers = np.empty(((len(codes) - k) // stride + 1, codes.shape[1]), dtype=np.uint64)
+    kmer = np.zeros(codes.shape[1], dtype=np.uint64)
+    for i, row in enumerate(codes):
+        kmer = ((kmer << np.uint64(2)) | row) & mask
+        pos = i - k + 1
+        if pos >= 0 and pos % stride == 0:
+            kmers[pos // stride] = kmer
+    return kmers
+
+
+def read_fasta(filename):
+    """
+    Returns the sequences of a FASTA file as dict of `bytes` keyed by the names.
+    """
+    seqs = {}
+    with open(filename, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                name = line[1:].split()[0].decode()
+                seqs[name] = []
+            else:
+                seqs[name].append(line.strip())
+    return {name: b"".join(lines) for name, lines in seqs.items()}
+
+
+def target_kmers(ref_file, bed_file, k):
+    """
+    Returns the k-mers of both strands of the regions in the BED file.
+    """
+    ref = read_fasta(ref_file)
+    kmers = []
+    with open(bed_file) as f:
+        for line in f:
+            chrom, start, end = line.split("\t")[:3]
+            seq = ref[chrom][max(int(start), 0) : int(end)].upper()
+            for strand in (seq, seq.translate(COMPLEMENT)[::-1]):
+                if len(strand) >= k:
+                    arr = np.frombuffer(strand, dtype=np.uint8)[np.newaxis]
+                    kmers.append(encode_kmers(arr, k).ravel())
+    return np.concatenate(kmers) if kmers else np.empty(0, dtype=np.uint64)
+
+
+def decompress_chunk(data):
+    """
+    Decompresses a chunk of gzipped data (which can hold several members like BGZF files
+    and end with a truncated member).
+    """
+    decompressed = []
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressed.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b"".join(decompressed)
+
+
+def estimate_bases(filename):
+    """
+    Estimates the number of bases in a (gzipped) FASTQ file from the number of bases per
+    byte in a chunk at the start of the file and the size of the file (for gzipped files
+    scaled by the compression ratio of that chunk).
+    """
+    if not stat.S_ISREG(os.stat(filename).st_mode):
+        sys.exit(f"ERROR: Can't estimate the depth of '{filename}' (not a file).")
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        chunk = f.read(SAMPLE_SIZE)
+    if chunk[:2] == b"\x1f\x8b":
+        sample = decompress_chunk(chunk)
+        size *= len(sample) / len(chunk)
+    else:
+        sample = chunk
+    # only use complete records
+    lines = sample.split(b"\n")
+    lines = lines[: (len(lines) - 1) // 4 * 4]
+    sample_size = sum(len(line) + 1 for line in lines)
+    bases = sum(len(line.rstrip()) for line in lines[1::4])
+    return size * bases / max(sample_size, 1)
+
+
+def mix(x):
+    """
+    SplitMix64 finalizer (a bijection of `uint64` arrays with good avalanche behaviour).
+    """
+    x = (x ^ (x >> np.uint64(30))) * MIX_CONSTANTS[0]
+    x = (x ^ (x >> np.uint64(27))) * MIX_CONSTANTS[1]
+    return x ^ (x >> np.uint64(31))
+
+
+def pair_name(header):
+    """
+    Returns the name of a read without comment and `/1` suffix (like in the alignment).
+    """
+    name = header[1:].split()[0]
+    return name[:-2] if name.endswith(b"/1") else name
+
+
+def pair_hashes(headers, seed):
+    """
+    Returns 64-bit hashes of the names of the reads (uniformly distributed and depending
+    on the seed).
+    """
+    hashes = np.fromiter(
+        (zlib.crc32(pair_name(header)) for header in headers),
+        dtype=np.uint64,
+        count=len(headers),
+    )
+    return mix(hashes ^ mix(np.array([seed], dtype=np.uint64)))
+
+
+def filter_batch(batch, kmer_set, k, threshold, seed):
+    """
+    Returns the indices of the pairs in a batch (a tuple with the lines of both FASTQ
+    files) that are kept by the subsampling (i.e. whose hashes are below the threshold;
+    all pairs if it is `None`) and, of these, the indices of the pairs where at least
+    one mate shares a k-mer with the set (the same if there is no set).
+    """
+    sampled = np.arange(len(batch[0]) // 4)
+    if threshold is not None:
+        sampled = sampled[pair_hashes(batch[0][0::4], seed) < threshold]
+    if kmer_set is None or not len(sampled):
+        return sampled, sampled
+    hits = np.zeros(len(sampled), dtype=bool)
+    for lines in batch:
+        seqs = [lines[4 * i + 1].rstrip() for i in sampled]
+        lengths = np.array([len(seq) for seq in seqs])
+        length = max(lengths.max(), k)
+        # pad shorter reads; the k-mers overlapping the padding are ignored below
+        arr = np.frombuffer(
+            b"".join(seq.ljust(length, b"N") for seq in seqs), dtype=np.uint8
+        ).reshape(len(seqs), length)
+        kmers = encode_kmers(arr, k, STRIDE)
+        found = kmer_set.contains(kmers.ravel()).reshape(kmers.shape)
+        positions = np.arange(len(kmers)) * STRIDE
+        found &= positions[:, np.newaxis] <= lengths - k
+        hits |= found.any(axis=0)
+    return sampled, sampled[hits]
+
+
+def iter_lines(f):
+    """
+    Yields the lines of a file (without line breaks). Reading large blocks and splitting
+    them is much faster than reading line by line (especially for gzipped files).
+    """
+    rest = b""
+    while block := f.read(BLOCK_SIZE):
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def read_batches(filename, batches):
+    try:
+        with open(filename, "rb") as raw:
+            f = gzip.open(raw) if raw.peek(2)[:2] == b"\x1f\x8b" else raw
+            lines = iter_lines(f)
+            while True:
+                batch = list(itertools.islice(lines, 4 * BATCH_SIZE))
+                batches.put(batch)
+                if not batch:
+                    break
+    except Exception as e:
+        # pass the error (e.g. of a truncated gzip file) on to the main thread (which
+        # would otherwise wait for the next batch forever)
+        batches.put(e)
+
+
+def write_batches(f, batches, errors):
+    try:
+        with f:
+            while (lines := batches.get()) is not None:
+                if lines:
+                    f.write(b"\n".join(lines) + b"\n")
+    except Exception as e:
+        errors.append(e)
+        # keep consuming so that the main thread doesn't block
+        while batches.get() is not None:
+            pass
+
+
+parser = argparse.ArgumentParser(
+    description="""
+        Writes the read pairs where at least one mate shares a k-mer with the regions of
+        the reference listed in a BED file and / or a deterministic random subsample of
+        the read pairs to the output files. The input files can be gzipped.
+        """
+)
+parser.add_argument("ref", metavar="FASTA", help="reference genome")
+parser.add_argument("fw_reads", metavar="FASTQ_FW", help="forward reads")
+parser.add_argument("rv_reads", metavar="FASTQ_RV", help="reverse reads")
+parser.add_argument("fw_out", metavar="OUT_FW", help="output for the forward reads")
+parser.add_argument("rv_out", metavar="OUT_RV", help="output for the reverse reads")
+parser.add_argument(
+    "--regions",
+    metavar="BED",
+    help="only keep pairs sharing a k-mer with these target regions (plus flanks)",
+)
+parser.add_argument(
+    "-k",
+    type=int,
+    default=31,
+    metavar="INT",
+    help="k-mer size (at most 32) [default: %(default)d]",
+)
+parser.add_argument(
+    "--max-depth",
+    type=int,
+    metavar="INT",
+    help=(
+        "subsample the pairs so that the depth (estimated from the start and the sizes "
+        "of the input files) is at most about this value"
+    ),
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=0,
+    metavar="INT",
+    help="seed for the subsampling [default: %(default)d]",
+)
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=int,
+    default=1,
+    metavar="INT",
+    help="number of threads for processing the reads [default: %(default)d]",
+)
+parser.add_argument(
+    "--keep-all",
+    action="store_true",
+    help="don't remove pairs with the k-mer prefilter (to validate it with '--names')",
+)
+parser.add_argument(
+    "--names",
+    metavar="FILE",
+    help="write the names of the pairs passing the k-mer prefilter to this file",
+)
+args = parser.parse_args()
+if not 1 <= args.k <= 32:
+    parser.error("k must be between 1 and 32")
+if args.max_depth is not None and args.max_depth < 1:
+    parser.error("the maximum depth must be positive")
+if not 0 <= args.seed < 2**64:
+    parser.error("the seed must be between 0 and 2^64 - 1")
+
+# open the outputs right away (in parallel, as the reader of named pipes might open them
+# in any order) so that a reader sees the end of the files if anything below fails
+# (instead of waiting for them to be opened forever)
+with concurrent.futures.ThreadPoolExecutor(2) as pool:
+    out_files = list(pool.map(open, (args.fw_out, args.rv_out), ("wb", "wb")))
+
+kmer_set = (
+    KmerSet(target_kmers(args.ref, args.regions, args.k))
+    if args.regions is not None
+    else None
+)
+threshold = None
+if args.max_depth is not None:
+    genome_length = sum(len(seq) for seq in read_fasta(args.ref).values())
+    depth = sum(map(estimate_bases, (args.fw_reads, args.rv_reads))) / genome_length
+    fraction = args.max_depth / max(depth, 1e-9)
+    if fraction < 1:
+        # keep the pairs whose hashes fall into the first `fraction` of the range
+        threshold = np.uint64(int(fraction * 2**64))
+    print(
+        f"subsampling: estimated depth of {depth:.1f}x; keeping about "
+        f"{min(fraction, 1):.2%} of the read pairs",
+        file=sys.stderr,
+    )
+
+in_batches = [queue.Queue(MAX_BATCHES), queue.Queue(MAX_BATCHES)]
+out_batches = [queue.Queue(MAX_BATCHES), queue.Queue(MAX_BATCHES)]
+errors = []
+for filename, batches in zip((args.fw_reads, args.rv_reads), in_batches):
+    threading.Thread(target=read_batches, args=(filename, batches), daemon=True).start()
+writers = [
+    threading.Thread(target=write_batches, args=(f, batches, errors), daemon=True)
+    for f, batches in zip(out_files, out_batches)
+]
+for writer in writers:
+    writer.start()
+names_file = open(args.names, "wb") if args.names is not None else None
+
+
+def write_output(batch, future):
+    """
+    Passes the pairs of a batch that were selected (with `--keep-all` also those that
+    didn't pass the k-mer prefilter) on to the writer threads and returns the numbers of
+    pairs kept by the subsampling and passing the k-mer prefilter.
+    """
+    sampled, passed = future.result()
+    idx = sampled if args.keep_all else passed
+    for lines, batches in zip(batch, out_batches):
+        if len(idx) == len(lines) // 4:
+            batches.put(lines)
+        else:
+            batches.put([line for i in idx for line in lines[4 * i : 4 * i + 4]])
+    if names_file is not None:
+        for i in passed:
+            names_file.write(pair_name(batch[0][4 * i]) + b"\n")
+    return np.array([len(sampled), len(passed)])
+
+
+n_pairs = 0
+# the numbers of pairs kept by the subsampling and passing the k-mer prefilter
+n_selected = np.zeros(2, dtype=int)
+with concurrent.futures.ThreadPoolExecutor(args.threads) as pool:
+    # keep a limited number of batches in flight and write them in input order
+    pending = collections.deque()
+    while True:
+        batch = tuple(batches.get() for batches in in_batches)
+        for filename, lines in zip((args.fw_reads, args.rv_reads), batch):
+            if isinstance(lines, Exception):
+                sys.exit(f"ERROR: Failed to read '{filename}': {lines}")
+        if errors:
+            # no need to go on if the output can't be written
+            sys.exit(f"ERROR: {errors[0]}")
+        if len(batch[0]) != len(batch[1]):
+            sys.exit("ERROR: The FASTQ files hold different numbers of reads.")
+        if not batch[0]:
+            break
+        n_pairs += len(batch[0]) // 4
+        future = pool.submit(
+            filter_batch, batch, kmer_set, args.k, threshold, args.seed
+        )
+        pending.append((batch, future))
+        while pending and (len(pending) > 2 * args.threads or pending[0][1].done()):
+            n_selected += write_output(*pending.popleft())
+    while pending:
+        n_selected += write_output(*pending.popleft())
+n_sampled, n_passed = n_selected
+for batches in out_batches:
+    batches.put(None)
+for writer in writers:
+    writer.join()
+if names_file is not None:
+    names_file.close()
+if errors:
+    sys.exit(f"ERROR: {errors[0]}")
+if args.max_depth is not None:
+    print(
+        f"subsampling: kept {n_sampled} of {n_pairs} read pairs "
+        f"({n_sampled / max(n_pairs, 1):.2%})",
+        file=sys.stderr,
+    )
+if kmer_set is not None:
+    print(
+        f"k-mer prefilter: {n_passed} of {n_sampled} read pairs share a k-mer with the "
+        f"target regions ({n_passed / max(n_sampled, 1):.2%})",
+        file=sys.stderr,
+    )
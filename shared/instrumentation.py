@@ -0,0 +1,234 @@
+import atexit
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+"""
+Records the wall time, CPU time, peak RSS, and bytes read / written of the stages of a
+container run and writes them as JSON report. Stages are either Python phases (`with
+stage(name): ...`) or subprocesses (`run(name, cmd, ...)` as replacement for
+`subprocess.run`). Commands in the shell pipelines are measured by running them via this
+script (`python instrumentation.py NAME CMD [ARGS...]`; see the `measure` function in
+the shell scripts) and show up as steps of the subprocess they were started by.
+
+The records are appended to a log file (whose path is passed on to all child processes
+via the environment) as they are completed so that stages running in other threads or
+processes (and pipelines running concurrently) are captured as well. The report is
+assembled from the log when the main process exits (also on errors). Without a report
+file, nothing is recorded and the commands are run directly.
+
+The usage of subprocesses is taken from `wait4()` and includes all their descendants;
+the peak RSS is that of the largest single process. The usage of Python phases is
+process-wide (i.e. it also includes other threads active at the same time and child
+processes that have been waited for during the phase). Bytes read / written are the
+block I/O accounted by the kernel (i.e. excluding reads served from the page cache).
+"""
+
+LOG_VAR = "INSTRUMENTATION_LOG"
+PARENT_VAR = "INSTRUMENTATION_PARENT"
+
+
+def enabled():
+    return LOG_VAR in os.environ
+
+
+def init(report_file=None, profile_file=None):
+    """
+    Starts recording if a report file is given and profiling the Python code (of the
+    main thread) with `cProfile` if a profile file is given. The report and the profile
+    are written when the process exits.
+    """
+    start = time.time()
+    if report_file is not None:
+        fd, log_file = tempfile.mkstemp(prefix="instrumentation-", suffix=".jsonl")
+        os.close(fd)
+        os.environ[LOG_VAR] = log_file
+        atexit.register(write_report, report_file, log_file, start, os.getpid())
+    if profile_file is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+
+        atexit.register(dump_profile)
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS of the process (`VmHWM`) so that the peak of a stage can be
+    measured. Returns `False` if that is not possible.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+
+
+def usage_record(usage, before=None):
+    """
+    Converts a `resource.getrusage()` result (or its difference to an earlier one) into
+    the fields of a record.
+    """
+    fields = ["ru_utime", "ru_stime", "ru_inblock", "ru_oublock"]
+    values = {field: getattr(usage, field) for field in fields}
+    if before is not None:
+        values = {field: values[field] - getattr(before, field) for field in fields}
+    return {
+        "cpu_time": values["ru_utime"] + values["ru_stime"],
+        "user_time": values["ru_utime"],
+        "system_time": values["ru_stime"],
+        "bytes_read": values["ru_inblock"] * 512,
+        "bytes_written": values["ru_oublock"] * 512,
+    }
+
+
+def append_record(record):
+    # a single short write to a file opened in append mode is atomic --> the records of
+    # concurrent processes don't get mixed up
+    with open(os.environ[LOG_VAR], "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Records a Python phase (including the child processes waited for during it).
+    """
+    if not enabled():
+        yield
+        return
+    can_reset = reset_peak_rss()
+    start = time.time()
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+        yield
+    finally:
+        self_after = resource.getrusage(resource.RUSAGE_SELF)
+        usage = usage_record(self_after, self_before)
+        children_usage = usage_record(
+            resource.getrusage(resource.RUSAGE_CHILDREN), children_before
+        )
+        append_record(
+            {
+                "id": uuid.uuid4().hex,
+                "parent": os.environ.get(PARENT_VAR),
+                "name": name,
+                "kind": "python",
+                "pid": os.getpid(),
+                "start": start,
+                "wall_time": time.time() - start,
+                **{key: value + children_usage[key] for key, value in usage.items()},
+                # `ru_maxrss` is in kB on Linux
+                "max_rss_mb": (
+                    peak_rss_mb() if can_reset else self_after.ru_maxrss / 1024
+                ),
+            }
+        )
+
+
+def run(name, cmd, **kwargs):
+    """
+    Like `subprocess.run`, but records the resource usage of the command (by running it
+    via this script) if instrumentation is enabled.
+    """
+    if enabled():
+        cmd = [sys.executable, os.path.abspath(__file__), name] + list(cmd)
+    return subprocess.run(cmd, **kwargs)
+
+
+def write_report(report_file, log_file, start, pid):
+    if os.getpid() != pid:
+        # don't write the report from forked child processes
+        return
+    records = {}
+    with open(log_file) as f:
+        for line in f:
+            record = json.loads(line)
+            records[record["id"]] = record
+    stages = []
+    for record in sorted(records.values(), key=lambda x: x["start"]):
+        parent = records.get(record.pop("parent"))
+        record["start"] -= start
+        if parent is None:
+            stages.append(record)
+        else:
+            parent.setdefault("steps", []).append(record)
+    for record in records.values():
+        del record["id"]
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    total = usage_record(self_usage)
+    for key, value in usage_record(children_usage).items():
+        total[key] += value
+    # the peak RSS of the process is reset by the Python stages --> also take the peaks
+    # of the stages into account
+    max_rss = max(
+        [self_usage.ru_maxrss / 1024, children_usage.ru_maxrss / 1024]
+        + [record["max_rss_mb"] for record in records.values()]
+    )
+    with open(report_file, "w") as f:
+        json.dump(
+            {
+                "command": sys.argv,
+                "total": {
+                    "wall_time": time.time() - start,
+                    **total,
+                    "max_rss_mb": max_rss,
+                },
+                "stages": stages,
+            },
+            f,
+            indent=2,
+        )
+    os.remove(log_file)
+
+
+if __name__ == "__main__":
+    # run a command and record its usage (usage: `python instrumentation.py NAME CMD
+    # [ARGS...]`)
+    name, cmd = sys.argv[1], sys.argv[2:]
+    if not enabled():
+        os.execvp(cmd[0], cmd)
+    record_id = uuid.uuid4().hex
+    start = time.time()
+    p = subprocess.Popen(cmd, env={**os.environ, PARENT_VAR: record_id})
+    _, status, usage = os.wait4(p.pid, 0)
+    # decode the status by hand (`os.waitstatus_to_exitcode` needs Python 3.9, but some
+    # images have an older one)
+    exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    append_record(
+        {
+            "id": record_id,
+            "parent": os.environ.get(PARENT_VAR),
+            "name": name,
+            "kind": "subprocess",
+            "pid": p.pid,
+            "start": start,
+            "wall_time": time.time() - start,
+            **usage_record(usage),
+            # `ru_maxrss` is in kB on Linux
+            "max_rss_mb": usage.ru_maxrss / 1024,
+            "exit_code": exit_code,
+        }
+    )
+    sys.exit(exit_code if exit_code >= 0 else 128 - exit_code)
@@ -0,0 +1,78 @@
+#!/bin/bash
+# set flags for "strict" mode (so that the script fails if any of the stages fails)
+set -Eeuo pipefail
+
+fw_reads=$1
+rv_reads=$2
+refgenome=$3
+threads=${4:-1}
+index_dir=${5:-/internal_data/bwa-index}
+# optional: arguments for `filter-reads.py` (k-mer prefilter and / or subsampling; see
+# there); the reads are only streamed through it if there are any
+filter_args=("${@:6}")
+
+# `measure NAME CMD [ARGS...]` records the resource usage of a command if
+# instrumentation is enabled
+source "$(dirname "${BASH_SOURCE[0]}")/measure.sh"
+
+# BWA-MEM2 INDEX
+# get the prebuilt index (it's only built if there is none for this reference yet)
+bwa_index=$(bash "$(dirname "$0")/bwa-index.sh" "$refgenome" "$index_dir")
+
+# READ TRIMMING AND MAPPING
+# the filter writes into named pipes that are read by the trimming step
+fifo_dir=$(mktemp -d)
+filter_pid=""
+cleanup() {
+    # if another stage failed, the filter might still wait for the trimming step to
+    # open the named pipes --> open them once (for reading and writing, which doesn't
+    # block) so that it fails with a broken pipe instead of waiting forever
+    if [[ -n $filter_pid ]] && kill -0 "$filter_pid" 2>/dev/null; then
+        for fifo in "$fifo_dir"/filtered_*; do
+            : <>"$fifo"
+        done
+    fi
+    rm -rf "$fifo_dir"
+}
+trap cleanup EXIT
+
+# only pass on the pairs where a mate shares a k-mer with the target regions and / or a
+# subsample of the pairs
+if [[ ${#filter_args[@]} -gt 0 ]]; then
+    mkfifo "$fifo_dir/filtered_1" "$fifo_dir/filtered_2"
+    measure "filtering reads" python "$(dirname "$0")/filter-reads.py" \
+        "$refgenome" \
+        "$fw_reads" \
+        "$rv_reads" \
+        "$fifo_dir/filtered_1" \
+        "$fifo_dir/filtered_2" \
+        -t "$threads" \
+        "${filter_args[@]}" &
+    filter_pid=$!
+    fw_reads=$fifo_dir/filtered_1
+    rv_reads=$fifo_dir/filtered_2
+fi
+
+# the trimmed pairs (both reads need to survive) are written interleaved to STDOUT and
+# streamed into bwa-mem2 so that no intermediate FASTQ files are written to disk (see
+# `trim-reads.py` for the trimming steps)
+measure trimming python "$(dirname "$0")/trim-reads.py" \
+    "$fw_reads" \
+    "$rv_reads" \
+    -t "$threads" |
+    measure bwa-mem2 bwa-mem2 mem \
+        -p \
+        -t "$threads" \
+        -R "@RG\tID:sample\tSM:sample\tPL:Illumina" \
+        "$bwa_index" \
+        - |
+    measure "samtools view" samtools view -@ "$threads" -bhS |
+    measure "samtools fixmate" samtools fixmate -@ "$threads" -m - - |
+    measure "samtools sort" samtools sort -@ "$threads" - -o reads.sorted.bam
+
+# wait for the filter to finish (and fail if it did)
+if [[ -n $filter_pid ]]; then
+    wait "$filter_pid"
+fi
+
+measure "samtools index" samtools index reads.sorted.bam
@@ -0,0 +1,10 @@
+# records the resource usage of a command if instrumentation is enabled (see
+# `instrumentation.py`); sourced by the shell scripts of the containers (usage:
+# `measure NAME CMD [ARGS...]`)
+measure() {
+    if [[ -n ${INSTRUMENTATION_LOG:-} ]]; then
+        python "$(dirname "${BASH_SOURCE[0]}")/instrumentation.py" "$@"
+    else
+        "${@:2}"
+    fi
+}
@@ -0,0 +1,107 @@
+import concurrent.futures
+import numpy as np
+import pysam
+
+"""
+Pileup engine counting the bases (A, C, G, T) and deletions of the reads overlapping a
+list of target regions in an indexed BAM/CRAM file. The counts of all regions are
+accumulated in a single preallocated array and the one-hot-encoded consensus sequence is
+derived from it with a vectorized argmax. It replaces running `sambamba depth base` and
+parsing its output and follows its defaults: reads that are unmapped, secondary,
+duplicates, failed QC, or have a mapping quality of 0 are ignored and positions without
+coverage are skipped.
+"""
+
+# columns of the counts array
+COLUMNS = ["A", "C", "G", "T", "DEL", "other"]
+DEL = COLUMNS.index("DEL")
+# lookup table from ASCII code to the column in the counts array (non-ACGT characters
+# like `N` are counted as 'other')
+BASE_LUT = np.full(256, COLUMNS.index("other"), dtype=np.intp)
+for i, base in enumerate("ACGT"):
+    BASE_LUT[ord(base)] = i
+    BASE_LUT[ord(base.lower())] = i
+# reads with any of these flags are ignored
+FILTER_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+# CIGAR operations
+MATCH_OPS = (pysam.CMATCH, pysam.CEQUAL, pysam.CDIFF)
+QUERY_ONLY_OPS = (pysam.CINS, pysam.CSOFT_CLIP)
+
+
+def count_region(bam_file, chrom, start, end, counts, index_file=None):
+    """
+    Counts the bases and deletions of all reads overlapping the region between `start`
+    and `end` (0-based, half-open) and adds them to `counts` (an array of shape
+    (end - start, 6)). Opens its own handle of the BAM/CRAM file so that it can run in a
+    separate thread.
+    """
+    with pysam.AlignmentFile(bam_file, index_filename=index_file) as bam:
+        for read in bam.fetch(chrom, start, end):
+            if read.flag & FILTER_FLAGS or read.mapping_quality == 0:
+                continue
+            if read.query_sequence is None:
+                continue
+            codes = BASE_LUT[np.frombuffer(read.query_sequence.encode(), np.uint8)]
+            ref_pos = read.reference_start
+            query_pos = 0
+            for op, length in read.cigartuples:
+                if op in MATCH_OPS or op == pysam.CDEL:
+                    # clip the block to the region
+                    block_start = max(ref_pos, start)
+                    block_end = min(ref_pos + length, end)
+                    if block_start < block_end:
+                        rows = np.arange(block_start - start, block_end - start)
+                        if op == pysam.CDEL:
+                            counts[rows, DEL] += 1
+                        else:
+                            offset = query_pos + block_start - ref_pos
+                            counts[rows, codes[offset : offset + len(rows)]] += 1
+                    ref_pos += length
+                    if op != pysam.CDEL:
+                        query_pos += length
+                elif op == pysam.CREF_SKIP:
+                    ref_pos += length
+                elif op in QUERY_ONLY_OPS:
+                    query_pos += length
+
+
+def one_hot_consensus(bam_file, chrom, regions, threads=1, index_file=None):
+    """
+    Piles up the reads in the target regions (tuples of name, start, and end with
+    0-based, half-open coordinates) and returns the one-hot-encoded consensus sequence
+    (as uint8 array with the columns A, C, G, and T) and the number of positions of each
+    region in it. Like with `sambamba`, the regions are reported in coordinate order,
+    deletions are dropped from the consensus, and positions without coverage are
+    skipped. Regions are processed in parallel by up to `threads` threads. The index is
+    looked up next to `bam_file` unless `index_file` is given.
+    """
+    regions = sorted(regions, key=lambda x: x[1])
+    offsets = np.cumsum([0] + [end - start for _, start, end in regions])
+    counts = np.zeros((offsets[-1], len(COLUMNS)), dtype=np.int32)
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        futures = [
+            pool.submit(
+                count_region,
+                bam_file,
+                chrom,
+                start,
+                end,
+                counts[offset:next_offset],
+                index_file,
+            )
+            for (_, start, end), offset, next_offset in zip(
+                regions, offsets[:-1], offsets[1:]
+            )
+        ]
+        for future in futures:
+            future.result()
+    # get the consensus (ties are resolved in favour of the first column like
+    # `pd.DataFrame.idxmax` would) and drop positions without coverage and deletions
+    consensus = counts[:, : DEL + 1].argmax(axis=1)
+    keep = (counts.sum(axis=1) > 0) & (consensus != DEL)
+    one_hot = np.eye(4, dtype=np.uint8)[consensus[keep]]
+    region_lengths = {
+        name: np.count_nonzero(keep[offset:next_offset])
+        for (name, _, _), offset, next_offset in zip(regions, offsets[:-1], offsets[1:])
+    }
+    return one_hot, region_lengths
@@ -0,0 +1,143 @@
+import os
+import sys
+import signal
+import argparse
+import http.server
+import socketserver
+import traceback
+import urllib.parse
+
+"""
+HTTP server shared by the prediction servers (`server.py`) of the predictor containers.
+The model-specific parts (loading the model, parsing the request body, and predicting)
+are passed to `serve` by each `server.py`. The server listens on a TCP port or a Unix
+socket and handles requests one at a time. Endpoints:
+
+GET  /health        returns 'ok'
+GET  /<resource>    returns the CSV of a resource of the container (e.g. the target
+                    loci; see `serve`)
+POST /predict       expects the input of a single sample as request body and returns
+                    the prediction in the same CSV format as the CLI (or as JSON when
+                    called with `?format=json`)
+"""
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def add_arguments(parser):
+    """
+    Adds the arguments for the address to listen on to an `argparse.ArgumentParser`.
+    """
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="0.0.0.0",
+        help="Address to listen on [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=8000,
+        metavar="INT",
+        help="Port to listen on [default: %(default)d]",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        metavar="FILE",
+        help="Listen on this Unix socket instead of a TCP port",
+    )
+
+
+class PredictionHandler(http.server.BaseHTTPRequestHandler):
+    def address_string(self):
+        # `client_address` is an empty string for connections via a Unix socket
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix-socket"
+
+    def respond(self, code, body, content_type="text/plain"):
+        body = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == "/health":
+            self.respond(200, "ok\n")
+        elif path in self.server.resources:
+            self.respond(200, self.server.resources[path](), "text/csv")
+        else:
+            self.respond(404, f"Unknown endpoint: {path}\n")
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path != "/predict":
+            self.respond(404, f"Unknown endpoint: {url.path}\n")
+            return
+        fmt = urllib.parse.parse_qs(url.query).get("format", ["csv"])[0]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            res = self.server.predict(body)
+        except (ValueError, KeyError) as e:
+            self.respond(400, f"{e}\n")
+            return
+        except Exception as e:
+            traceback.print_exc()
+            self.respond(500, f"{e}\n")
+            return
+        if fmt == "json":
+            self.respond(200, res.to_json(orient="index"), "application/json")
+        else:
+            self.respond(200, res.to_csv(header=self.server.csv_header), "text/csv")
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    pass
+
+
+def serve(args, predict, resources, csv_header=False):
+    """
+    Listens on the address in `args` (see `add_arguments`) and handles requests until
+    the server is stopped. `predict` is called with the body (`bytes`) of each POST
+    request to `/predict` and returns the prediction as `pd.DataFrame` (which is written
+    as CSV with or without header depending on `csv_header`, like the CLI, or as JSON).
+    `resources` maps the paths of additional GET endpoints (e.g. '/target-loci') to
+    functions returning the CSV to respond with.
+    """
+    if args.socket is not None:
+        # remove a stale socket left over from a previous run
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, PredictionHandler)
+        address = args.socket
+    else:
+        server = http.server.HTTPServer((args.host, args.port), PredictionHandler)
+        address = f"{args.host}:{args.port}"
+    server.predict = predict
+    server.resources = resources
+    server.csv_header = csv_header
+    # make sure the socket is cleaned up when the container is stopped
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Listening on {address}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -0,0 +1,162 @@
+import sys
+import argparse
+import instrumentation
+
+"""
+Options and reports of the read filter (`filter-reads.py`) shared by the containers
+aligning raw reads: the k-mer prefilter keeping only the read pairs that might align to
+the target regions, its validation, and the subsampling to a maximum depth. The mapping
+pipelines pass the arguments returned by `mapping_args` on to `filter-reads.py`.
+"""
+
+# the names of the reads that passed the prefilter (written to the working directory
+# when validating it)
+NAMES_FILE = "prefilter-names.txt"
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+def add_arguments(parser):
+    """
+    Adds the arguments for the prefilter and the subsampling to an
+    `argparse.ArgumentParser`.
+    """
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help=(
+            "only align the read pairs where a mate shares a k-mer with the target "
+            "regions (plus flanks); much faster for whole-genome sequencing runs"
+        ),
+    )
+    parser.add_argument(
+        "--prefilter-flank",
+        type=check_positive_int,
+        metavar="INT",
+        default=1000,
+        help=(
+            "length of the flanks added to the target regions for the prefilter (should "
+            "be longer than the reads) [default: %(default)d]"
+        ),
+    )
+    parser.add_argument(
+        "--validate-prefilter",
+        action="store_true",
+        help=(
+            "align all reads, but report how many of the reads aligned to the target "
+            "regions would have been removed by the prefilter"
+        ),
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=check_positive_int,
+        metavar="INT",
+        help=(
+            "randomly subsample the read pairs (before trimming and alignment) so that "
+            "the depth is at most about this value (estimated from the sizes of the "
+            "FASTQ files) and report the mean depth at the target loci [default: no "
+            "subsampling]"
+        ),
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        metavar="INT",
+        default=0,
+        help=(
+            "seed for the subsampling (the same pairs are selected in every run with "
+            "the same seed) [default: %(default)d]"
+        ),
+    )
+
+
+def check_arguments(parser, args):
+    if args.seed < 0:
+        parser.error("the seed must not be negative")
+
+
+def alignment_params(args):
+    """
+    Returns whether the reads are prefiltered before the alignment and the parameters
+    of the filter the alignment depends on (for the keys of the result cache). When
+    validating the prefilter, the reads go through it, but all of them are aligned.
+    """
+    prefilter = args.prefilter and not args.validate_prefilter
+    params = {"prefilter_flank": args.prefilter_flank} if prefilter else {}
+    if args.max_depth is not None:
+        params.update(max_depth=args.max_depth, seed=args.seed)
+    return prefilter, params
+
+
+def write_bed(regions, filename, flank=0):
+    """
+    Writes regions (tuples of name, 0-based start, and exclusive end) to a BED file
+    after adding flanks of the given length on both sides.
+    """
+    with open(filename, "w") as f:
+        for _, start, end in regions:
+            f.write(f"Chromosome\t{max(start - flank, 0)}\t{end + flank}\n")
+
+
+def mapping_args(args, regions, workdir):
+    """
+    Returns the arguments for the read filter of the mapping pipeline. The target
+    regions plus flanks are written to a BED file in `workdir` for the prefilter.
+    """
+    filter_args = []
+    if args.prefilter or args.validate_prefilter:
+        write_bed(regions, f"{workdir}/prefilter.bed", args.prefilter_flank)
+        filter_args += ["--regions", f"{workdir}/prefilter.bed"]
+        if args.validate_prefilter:
+            filter_args += ["--keep-all", "--names", f"{workdir}/{NAMES_FILE}"]
+    if args.max_depth is not None:
+        filter_args += ["--max-depth", str(args.max_depth), "--seed", str(args.seed)]
+    return filter_args
+
+
+def validate_prefilter(bam_file, bed_file, workdir):
+    """
+    Prints how many of the reads aligned to the target regions (primary alignments only)
+    did not pass the k-mer prefilter (i.e. would have been lost) to STDERR.
+    """
+    with open(f"{workdir}/{NAMES_FILE}", "rb") as f:
+        passed = set(f.read().split())
+    alignments = instrumentation.run(
+        "validating prefilter",
+        ["samtools", "view", "-F", "0x904", "-M", "-L", bed_file, bam_file],
+        capture_output=True,
+        check=True,
+    ).stdout.splitlines()
+    lost = sum(line.split(b"\t", 1)[0] not in passed for line in alignments)
+    print(
+        f"k-mer prefilter: {lost} of {len(alignments)} reads aligned to the target "
+        f"regions did not pass the filter ({lost / max(len(alignments), 1):.2%})",
+        file=sys.stderr,
+    )
+
+
+def report_depth(bam_file, bed_file, loci):
+    """
+    Prints the mean depth of each target region (from `samtools bedcov`) to STDERR.
+    """
+    bedcov = instrumentation.run(
+        "depth report",
+        ["samtools", "bedcov", bed_file, bam_file],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.splitlines()
+    print("mean depth at the target loci:", file=sys.stderr)
+    for locus, line in zip(loci, bedcov):
+        _, start, end, total = line.split("\t")[:4]
+        depth = int(total) / max(int(end) - int(start), 1)
+        print(f"{locus}\t{depth:.1f}", file=sys.stderr)
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+"""
+Content-addressed on-disk cache for the results of the stages of the pipeline (e.g. the
+sorted BAM, the VCF, or the final output). Entries are keyed by the checksums of the
+input files, the version of the container, the name of the stage, and its parameters,
+and hold one or more files. An entry is written to a temporary directory first which is
+then renamed (an atomic operation) so that the cache can be shared between concurrent
+container runs via a mounted volume; if two runs produce the same entry at the same
+time, the second one is discarded. Reading an entry updates its mtime and when the cache
+grows beyond the size limit, the least recently used entries are removed.
+
+Hashing large inputs (e.g. FASTQ files of whole-genome runs) takes a while. The
+checksums are therefore also kept in the cache (keyed by path, size, inode, and mtime of
+the file) so that repeated invocations with the same files don't need to read them
+again. Checksums that haven't been used for a while and temporary files and directories
+left behind by interrupted runs are removed when the cache is cleaned up.
+"""
+
+# the version of the container (set in the Dockerfile)
+VERSION = os.environ.get("SOFTWARE_VERSION", "unknown")
+# temporary files and directories that haven't been modified for this long (in seconds)
+# are left over from interrupted runs (the files being copied into a new entry are
+# modified continuously)
+STALE_TMP_AGE = 3600
+# checksums of files that haven't been used for this long (in seconds) are removed
+CHECKSUM_MAX_AGE = 30 * 24 * 3600
+
+
+def last_modified(path):
+    """
+    Returns the latest mtime of a file or of a directory and the files in it.
+    """
+    mtimes = [os.stat(path).st_mtime]
+    if os.path.isdir(path):
+        mtimes.extend(entry.stat().st_mtime for entry in os.scandir(path))
+    return max(mtimes)
+
+
+def remove(path):
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        # already removed by a concurrent run
+        pass
+
+
+class ResultCache:
+    def __init__(self, cache_dir, max_size_mb):
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024**2
+        for subdir in ["entries", "checksums", "tmp"]:
+            os.makedirs(f"{cache_dir}/{subdir}", exist_ok=True)
+        # clean up after runs that were interrupted
+        self.evict()
+
+    def file_checksum(self, filename):
+        stat = os.stat(filename)
+        file_id = hashlib.sha256(
+            f"{os.path.realpath(filename)}\0{stat.st_size}\0{stat.st_ino}\0"
+            f"{stat.st_mtime_ns}".encode()
+        ).hexdigest()
+        memo = f"{self.cache_dir}/checksums/{file_id}"
+        try:
+            with open(memo) as f:
+                checksum = f.read()
+            # mark the checksum as recently used
+            os.utime(memo)
+            return checksum
+        except FileNotFoundError:
+            pass
+        checksum = hashlib.sha256()
+        with open(filename, "rb") as f:
+            while chunk := f.read(1024**2):
+                checksum.update(chunk)
+        checksum = checksum.hexdigest()
+        self._write_atomically(memo, checksum)
+        return checksum
+
+    def key(self, stage, input_files, params=None):
+        """
+        Returns the key of the results of a stage run on a list of input files with the
+        given parameters (a dict which should not include things that don't change the
+        results like the number of threads).
+        """
+        key = json.dumps(
+            {
+                "stage": stage,
+                "version": VERSION,
+                "inputs": [self.file_checksum(file) for file in input_files],
+                "params": params or {},
+            },
+            sort_keys=True,
+        )
+        return f"{stage}-{hashlib.sha256(key.encode()).hexdigest()}"
+
+    def get(self, key, files):
+        """
+        Copies the files of an entry to their destinations (`files` is a dict mapping
+        the names in the entry to the destination paths). Returns `True` if the entry
+        was found and `False` otherwise.
+        """
+        entry = f"{self.cache_dir}/entries/{key}"
+        try:
+            for name, dest in files.items():
+                shutil.copyfile(f"{entry}/{name}", dest)
+            # mark the entry as recently used
+            os.utime(entry)
+        except FileNotFoundError:
+            # the entry might also have been evicted by another run in the meantime
+            return False
+        print(f"result cache: using cached results for '{key}'", file=sys.stderr)
+        return True
+
+    def put(self, key, files):
+        """
+        Stores files in a new entry (`files` is a dict mapping the names in the entry to
+        the paths of the files).
+        """
+        if sum(os.path.getsize(file) for file in files.values()) > self.max_size:
+            return
+        entry = f"{self.cache_dir}/entries/{key}"
+        tmp_dir = f"{self.cache_dir}/tmp/{key}.{os.getpid()}.{threading.get_ident()}"
+        os.makedirs(tmp_dir)
+        try:
+            for name, file in files.items():
+                shutil.copyfile(file, f"{tmp_dir}/{name}")
+        except BaseException:
+            # e.g. a full disk or an interrupt (a killed process still leaves the
+            # directory behind, which is removed by `evict` later)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        try:
+            os.rename(tmp_dir, entry)
+        except OSError:
+            # another run has stored the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes stale temporary files and directories, checksums that haven't been used
+        for a while, and then the least recently used entries until the cache is below
+        the size limit. Entries are renamed before they are deleted so that they
+        disappear at once.
+        """
+        now = time.time()
+        for subdir, max_age in [
+            ("tmp", STALE_TMP_AGE),
+            ("checksums", CHECKSUM_MAX_AGE),
+        ]:
+            for entry in os.scandir(f"{self.cache_dir}/{subdir}"):
+                try:
+                    if now - last_modified(entry.path) > max_age:
+                        remove(entry.path)
+                except FileNotFoundError:
+                    continue
+        entries = []
+        for entry in os.scandir(f"{self.cache_dir}/entries"):
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry))
+            except FileNotFoundError:
+                continue
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda x: x[0]):
+            if total_size <= self.max_size:
+                break
+            tmp_dir = f"{self.cache_dir}/tmp/{entry.name}.{os.getpid()}.evicted"
+            try:
+                os.rename(entry.path, tmp_dir)
+                shutil.rmtree(tmp_dir)
+            except FileNotFoundError:
+                # already removed by a concurrent run
+                pass
+            total_size -= size
+
+    def _write_atomically(self, path, content):
+        tmp_path = (
+            f"{self.cache_dir}/tmp/{os.path.basename(path)}.{os.getpid()}."
+            f"{threading.get_ident()}.tmp"
+        )
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
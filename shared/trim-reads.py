@@ -0,0 +1,314 @@
+import sys
+import gzip
+import queue
+import argparse
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+
+"""
+Quality trimming of paired FASTQ files with the same results as `trimmomatic PE
+-phred33 ... LEADING:3 TRAILING:3 SLIDINGWINDOW:4:20 MINLEN:36` (keeping only the pairs
+where both reads survive). The trimmed pairs are written interleaved to STDOUT (e.g. for
+`bwa-mem2 mem -p`), so that no intermediate files are needed.
+
+The steps are applied to the reads in this order:
+
+- LEADING: remove the bases with a quality below 3 from the start of the read.
+- TRAILING: remove the bases with a quality below 3 from the end of the read.
+- SLIDINGWINDOW: scan the read with a window of 4 bases and cut it at the first window
+  with a mean quality below 20 (keeping the last window above the threshold) and then
+  trim back to the last base with a quality of at least 20. Reads where already the
+  first window is below the threshold (or that are shorter than the window) are removed.
+- MINLEN: remove reads with less than 36 bases left.
+
+The qualities of a batch of reads are put into a 2D array (one row per read) so that
+all steps (including the window sums) are computed with vectorized operations. The
+batches are processed by a pool of threads (numpy releases the GIL) and written in the
+order of the input. Both files are read by separate threads so that a producer writing
+them in arbitrary order (like `filter-reads.py` writing into named pipes) is never
+blocked. The tests (`tests/test_trim_reads.py`) compare the results with those of
+trimmomatic.
+"""
+
+# number of read pairs per batch, number of batches to buffer per file, and size of the
+# blocks read from the input files
+BATCH_SIZE = 10000
+MAX_BATCHES = 16
+BLOCK_SIZE = 4 * 1024**2
+PHRED_OFFSET = 33
+NEWLINE = ord("\n")
+# the parameters of the trimming steps (see above)
+LEADING_QUALITY = 3
+TRAILING_QUALITY = 3
+WINDOW_SIZE = 4
+WINDOW_QUALITY = 20
+MIN_LENGTH = 36
+
+
+def first_true(mask):
+    """
+    Returns the index of the first `True` in each row of a 2D boolean array (the number
+    of columns for rows without any).
+    """
+    first = mask.argmax(axis=1)
+    return np.where(mask[np.arange(len(mask)), first], first, mask.shape[1])
+
+
+def last_true(mask):
+    """
+    Returns the index of the last `True` in each row of a 2D boolean array (-1 for rows
+    without any).
+    """
+    return mask.shape[1] - 1 - first_true(mask[:, ::-1])
+
+
+def trim(quals):
+    """
+    Returns the starts and the (exclusive) ends of the parts of the reads kept by the
+    trimming steps (both are 0 for removed reads). `quals` holds the base qualities of
+    the reads (one row per read). Shorter reads are padded with negative values at the
+    end, which are removed by the TRAILING step like low-quality bases.
+    """
+    width = quals.shape[1]
+    pos = np.arange(width)
+    # LEADING and TRAILING
+    start = first_true(quals >= LEADING_QUALITY)
+    end = last_true(quals >= TRAILING_QUALITY) + 1
+    removed = end <= start
+    # SLIDINGWINDOW: the sums of the windows starting at each position (adding shifted
+    # views is much faster than taking differences of the cumulative sums)
+    n_windows = width - WINDOW_SIZE + 1
+    window_sums = sum(quals[:, i : i + n_windows] for i in range(WINDOW_SIZE))
+    window_pos = np.arange(n_windows)
+    failed = (
+        (window_sums < WINDOW_SIZE * WINDOW_QUALITY)
+        & (window_pos >= start[:, np.newaxis])
+        & (window_pos <= (end - WINDOW_SIZE)[:, np.newaxis])
+    )
+    # cut the read after the window before the first failed one (if any)
+    first_failed = first_true(failed)
+    cut = np.where(first_failed < n_windows, first_failed - 1 + WINDOW_SIZE, end)
+    removed |= (end - start < WINDOW_SIZE) | (first_failed == start)
+    # trim back to the last good base
+    good = (
+        (quals >= WINDOW_QUALITY)
+        & (pos >= start[:, np.newaxis])
+        & (pos < cut[:, np.newaxis])
+    )
+    end = last_true(good) + 1
+    # MINLEN (this also removes reads without any good bases left)
+    removed |= end - start < MIN_LENGTH
+    start[removed] = 0
+    end[removed] = 0
+    return start, end
+
+
+def parse_records(chunk):
+    """
+    Returns a chunk of FASTQ records as `uint8` array along with the starts and the ends
+    (i.e. the positions of the line breaks) of the lines as 2D arrays with one row per
+    record.
+    """
+    arr = np.frombuffer(chunk, dtype=np.uint8)
+    ends = np.flatnonzero(arr == NEWLINE)
+    if len(ends) % 4:
+        raise ValueError("Truncated FASTQ record.")
+    starts = np.zeros_like(ends)
+    starts[1:] = ends[:-1] + 1
+    return arr, starts.reshape(-1, 4), ends.reshape(-1, 4)
+
+
+def quality_matrix(arr, starts, ends):
+    """
+    Returns the base qualities of the records (one row per read). Shorter reads are
+    padded with negative values (taken from the line break at the end of the read).
+    """
+    width = max((ends[:, 3] - starts[:, 3]).max(), WINDOW_SIZE)
+    idx = starts[:, 3, np.newaxis] + np.arange(width)
+    np.minimum(idx, ends[:, 3, np.newaxis], out=idx)
+    return arr[idx].astype(np.int16) - PHRED_OFFSET
+
+
+def gather(buffer, offsets, lengths):
+    """
+    Concatenates segments of a buffer (given by their offsets and lengths). Adjacent
+    segments are merged first, so that e.g. untrimmed records are copied in one piece.
+    """
+    non_empty = lengths > 0
+    offsets, lengths = offsets[non_empty], lengths[non_empty]
+    if not len(offsets):
+        return b""
+    ends = offsets + lengths
+    # a new piece starts wherever a segment doesn't continue the previous one
+    new_piece = np.ones(len(offsets), dtype=bool)
+    new_piece[1:] = offsets[1:] != ends[:-1]
+    piece_starts = offsets[new_piece].tolist()
+    piece_ends = ends[np.append(np.flatnonzero(new_piece)[1:] - 1, -1)].tolist()
+    view = memoryview(buffer)
+    return b"".join([view[start:end] for start, end in zip(piece_starts, piece_ends)])
+
+
+def trim_batch(batch):
+    """
+    Trims the reads of a batch (a tuple with chunks of both FASTQ files) and returns the
+    number of pairs, the number of pairs where both reads survived, and their
+    interleaved records.
+    """
+    records = [parse_records(chunk) for chunk in batch]
+    if len(records[0][1]) != len(records[1][1]):
+        raise ValueError("The FASTQ files hold different numbers of reads.")
+    ranges = [trim(quality_matrix(*mate)) for mate in records]
+    kept = np.flatnonzero((ranges[0][1] > 0) & (ranges[1][1] > 0))
+    # each record of the output consists of five segments: the header line, the trimmed
+    # sequence, the line breaks around the third line, the trimmed qualities, and the
+    # final line break (the reverse reads are offset by the length of the first chunk)
+    offsets, lengths = [], []
+    for (_, starts, ends), (trim_start, trim_end), offset in zip(
+        records, ranges, (0, len(batch[0]))
+    ):
+        starts, ends = starts[kept] + offset, ends[kept] + offset
+        trim_start, trim_end = trim_start[kept], trim_end[kept]
+        offsets.append(
+            np.stack(
+                [
+                    starts[:, 0],
+                    starts[:, 1] + trim_start,
+                    ends[:, 1],
+                    starts[:, 3] + trim_start,
+                    ends[:, 3],
+                ],
+                axis=1,
+            )
+        )
+        lengths.append(
+            np.stack(
+                [
+                    ends[:, 0] + 1 - starts[:, 0],
+                    trim_end - trim_start,
+                    ends[:, 2] + 1 - ends[:, 1],
+                    trim_end - trim_start,
+                    np.ones_like(trim_end),
+                ],
+                axis=1,
+            )
+        )
+    # interleave the records of the pairs
+    offsets = np.stack(offsets, axis=1).ravel()
+    lengths = np.stack(lengths, axis=1).ravel()
+    return len(records[0][1]), len(kept), gather(batch[0] + batch[1], offsets, lengths)
+
+
+def read_chunks(filename, chunks):
+    """
+    Reads a (gzipped) FASTQ file in chunks of `BATCH_SIZE` records and puts them into a
+    queue (followed by an empty chunk).
+    """
+    try:
+        with open(filename, "rb") as raw:
+            f = gzip.open(raw) if raw.peek(2)[:2] == b"\x1f\x8b" else raw
+            rest = b""
+            while True:
+                blocks, n_lines = [rest], rest.count(b"\n")
+                while n_lines < 4 * BATCH_SIZE and (block := f.read(BLOCK_SIZE)):
+                    blocks.append(block)
+                    n_lines += block.count(b"\n")
+                data = b"".join(blocks)
+                if n_lines >= 4 * BATCH_SIZE:
+                    # split after the line break ending the last record of the chunk
+                    line_ends = np.flatnonzero(
+                        np.frombuffer(data, dtype=np.uint8) == NEWLINE
+                    )
+                    split = line_ends[4 * BATCH_SIZE - 1] + 1
+                    chunk, rest = data[:split], data[split:]
+                else:
+                    chunk, rest = data, b""
+                    if chunk and not chunk.endswith(b"\n"):
+                        chunk += b"\n"
+                chunks.put(chunk)
+                if not chunk:
+                    break
+    except Exception as e:
+        # pass the error (e.g. of a truncated gzip file) on to the main thread (which
+        # would otherwise wait for the next chunk forever)
+        chunks.put(e)
+
+
+def check_positive_int(val):
+    try:
+        val = int(val)
+        assert val >= 1
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            f"invalid value (must be positive int): '{val}'"
+        )
+    return val
+
+
+parser = argparse.ArgumentParser(
+    description="""
+        Trims paired reads like `trimmomatic PE -phred33 ... LEADING:3 TRAILING:3
+        SLIDINGWINDOW:4:20 MINLEN:36` and writes the pairs where both reads survived
+        interleaved to STDOUT. The input files can be gzipped.
+        """
+)
+parser.add_argument("fw_reads", metavar="FASTQ_FW", help="forward reads")
+parser.add_argument("rv_reads", metavar="FASTQ_RV", help="reverse reads")
+parser.add_argument(
+    "-t",
+    "--threads",
+    type=check_positive_int,
+    default=1,
+    metavar="INT",
+    help="number of threads for trimming [default: %(default)d]",
+)
+args = parser.parse_args()
+
+in_chunks = [queue.Queue(MAX_BATCHES), queue.Queue(MAX_BATCHES)]
+for filename, chunks in zip((args.fw_reads, args.rv_reads), in_chunks):
+    threading.Thread(target=read_chunks, args=(filename, chunks), daemon=True).start()
+
+out = sys.stdout.buffer
+
+
+def write_output(future):
+    """
+    Writes the records of a trimmed batch to STDOUT and returns the numbers of pairs in
+    the batch and of pairs where both reads survived.
+    """
+    try:
+        n_pairs, n_kept, records = future.result()
+    except ValueError as e:
+        sys.exit(f"ERROR: {e}")
+    out.write(records)
+    return np.array([n_pairs, n_kept])
+
+
+counts = np.zeros(2, dtype=int)
+
+
+with concurrent.futures.ThreadPoolExecutor(args.threads) as pool:
+    # keep a limited number of batches in flight and write them in input order
+    pending = collections.deque()
+    while True:
+        batch = tuple(chunks.get() for chunks in in_chunks)
+        for filename, chunk in zip((args.fw_reads, args.rv_reads), batch):
+            if isinstance(chunk, Exception):
+                sys.exit(f"ERROR: Failed to read '{filename}': {chunk}")
+        if not batch[0] or not batch[1]:
+            if batch[0] or batch[1]:
+                sys.exit("ERROR: The FASTQ files hold different numbers of reads.")
+            break
+        pending.append(pool.submit(trim_batch, batch))
+        while pending and (len(pending) > 2 * args.threads or pending[0].done()):
+            counts += write_output(pending.popleft())
+    while pending:
+        counts += write_output(pending.popleft())
+out.flush()
+n_pairs, n_kept = counts
+print(
+    f"trimming: {n_kept} of {n_pairs} read pairs survived "
+    f"({n_kept / max(n_pairs, 1):.2%})",
+    file=sys.stderr,
+)
@@ -0,0 +1,36 @@
+import atexit
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+"""
+Working directory for the intermediate files of a container run. The directory is
+created in a given parent directory (e.g. a tmpfs mount passed with `--workdir`) or in
+the default temporary directory and removed when the process exits.
+"""
+
+
+def make_workdir(parent_dir=None):
+    """
+    Creates a unique directory for the intermediate files (in `parent_dir` or in the
+    default temporary directory) which is removed when the process exits, also on errors
+    and when the container is stopped. It is also made the default temporary directory
+    of the process and its children so that the temporary files of the tools it runs
+    are written there as well.
+    """
+    workdir = tempfile.mkdtemp(prefix="tb-ml-", dir=parent_dir)
+    pid = os.getpid()
+
+    def remove_workdir():
+        # not when forked worker processes exit
+        if os.getpid() == pid:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    atexit.register(remove_workdir)
+    # `docker stop` sends SIGTERM --> exit normally so that the directory is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(128 + signal.SIGTERM))
+    tempfile.tempdir = workdir
+    os.environ["TMPDIR"] = workdir
+    return workdir
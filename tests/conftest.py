@@ -0,0 +1,74 @@
+import os
+import re
+import sys
+import glob
+import shutil
+import importlib.util
+
+"""
+Helpers shared by the tests. The scripts of the containers are flat modules in the
+`scripts` directory of each container (which is copied into the image), so they are
+imported or run from there. The modules and scripts in `shared` are copied into the
+build contexts when the images are built; the modules are put on the path of the tests
+and of the scripts they run.
+"""
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_DIR = os.path.join(REPO_DIR, "shared")
+
+sys.path.insert(0, SHARED_DIR)
+os.environ["PYTHONPATH"] = os.pathsep.join(
+    filter(None, [SHARED_DIR, os.environ.get("PYTHONPATH")])
+)
+
+
+def scripts_dir(container):
+    """
+    Returns the `scripts` directory of a container (e.g. 'predictors/aggreen-mtb-cnn').
+    """
+    return os.path.join(REPO_DIR, container, "scripts")
+
+
+def import_script(container, name):
+    """
+    Imports a module from the `scripts` directory of a container. The modules of
+    different containers can have the same name, so each is imported under a name
+    including the container (with the `scripts` directory on the path for its own
+    imports).
+    """
+    path = scripts_dir(container)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(
+        f"{container.replace('/', '.').replace('-', '_')}.{name}",
+        os.path.join(path, f"{name}.py"),
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def install_scripts(container, root):
+    """
+    Copies the scripts of a container (and the shared ones) into `root` the way the
+    Dockerfile copies them into the image (i.e. into `root/scripts` or directly into
+    `root`). The absolute paths in the scripts (like '/internal_data/refgenome.fa' or
+    '/mapping-pipeline.sh') are changed to point into `root` as well. Returns the
+    directory holding the scripts.
+    """
+    with open(os.path.join(REPO_DIR, container, "Dockerfile")) as f:
+        into_subdir = re.search(r"^COPY scripts /scripts$", f.read(), re.M)
+    dest = os.path.join(root, "scripts") if into_subdir else str(root)
+    os.makedirs(os.path.join(root, "internal_data"), exist_ok=True)
+    os.makedirs(dest, exist_ok=True)
+    abs_path = re.compile(
+        r"(?<=[\"'\s=])/(?=internal_data\b|scripts/|[\w-]+\.(?:sh|py)\b)"
+    )
+    files = glob.glob(os.path.join(scripts_dir(container), "*.*"))
+    for file in files + glob.glob(os.path.join(SHARED_DIR, "*.*")):
+        with open(file) as f:
+            content = f.read()
+        with open(os.path.join(dest, os.path.basename(file)), "w") as f:
+            f.write(abs_path.sub(lambda _: f"{root}/", content))
+        shutil.copymode(file, os.path.join(dest, os.path.basename(file)))
+    return dest
@@ -0,0 +1,89 @@
+import os
+import shutil
+import pytest
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from conftest import REPO_DIR, import_script, install_scripts
+
+"""
+Tests of the fast path of the aggreen container, which projects sequences with only SNPs
+into the alignments without running mafft. It must give the same results as mafft and
+must not be used for sequences with indels (even if they keep the length).
+"""
+
+CONTAINER = "predictors/aggreen-mtb-cnn"
+LOCUS = "katG"
+
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    model = import_script(CONTAINER, "model")
+    monkeypatch.setattr(
+        model,
+        "ALIGNMENTS_DIR",
+        os.path.join(REPO_DIR, CONTAINER, "data_files", "alignments"),
+    )
+    monkeypatch.setattr(
+        model,
+        "MAFFT_SCRIPT",
+        # the script needs the shared ones next to it
+        os.path.join(
+            install_scripts(CONTAINER, tmp_path),
+            "add-to-alignment-with-mafft-and-get-aligned-sequence.sh",
+        ),
+    )
+    model.get_column_map.cache_clear()
+    yield model
+    model.get_column_map.cache_clear()
+
+
+def substitute(seq, positions):
+    seq = list(seq)
+    for pos in positions:
+        seq[pos] = "A" if seq[pos] != "A" else "C"
+    return "".join(seq)
+
+
+def compensating_indels(seq):
+    """
+    Returns a sequence with an insertion and a deletion a few bases apart (i.e. with the
+    same length as the input).
+    """
+    pos = len(seq) // 2
+    return seq[:pos] + "G" + seq[pos : pos + 5] + seq[pos + 6 :]
+
+
+def input_seqs(ref):
+    return {
+        "reference": ref,
+        "one SNP": substitute(ref, [100]),
+        "isolated SNPs": substitute(ref, range(50, len(ref), 200)),
+    }
+
+
+def test_fast_path_only_for_isolated_substitutions(model):
+    ref = model.get_column_map(LOCUS)[0].tobytes().decode()
+    for name, seq in input_seqs(ref).items():
+        assert model.project_seq(SeqRecord(Seq(seq), id=LOCUS)) is not None, name
+    for seq in [
+        compensating_indels(ref),
+        # SNPs close to each other are aligned with mafft as well
+        substitute(ref, [100, 105]),
+        # too many SNPs
+        substitute(ref, range(0, len(ref), 20)),
+        # different length
+        ref[1:],
+    ]:
+        assert model.project_seq(SeqRecord(Seq(seq), id=LOCUS)) is None
+
+
+@pytest.mark.skipif(shutil.which("mafft") is None, reason="needs mafft")
+def test_fast_path_matches_mafft(model):
+    ref = model.get_column_map(LOCUS)[0].tobytes().decode()
+    seqs = input_seqs(ref)
+    seqs["compensating indels"] = compensating_indels(ref)
+    for name, seq in seqs.items():
+        record = SeqRecord(Seq(seq), id=LOCUS)
+        assert model.align_seq(record, fast_path=True) == model.align_seq(
+            record, fast_path=False
+        ), name
@@ -0,0 +1,42 @@
+import os
+import time
+from conftest import import_script
+
+alignment_cache = import_script("predictors/aggreen-mtb-cnn", "alignment_cache")
+
+
+def write_file(path, size, age=0):
+    with open(path, "w") as f:
+        f.write("A" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def test_stale_temporary_files_are_removed(tmp_path):
+    stale = tmp_path / "locus-abc.aln.1.2.tmp"
+    fresh = tmp_path / "locus-def.aln.3.4.tmp"
+    write_file(stale, 10, age=alignment_cache.STALE_TMP_AGE + 60)
+    write_file(fresh, 10)
+    # stale files are removed on startup, but files of writes in progress are kept
+    alignment_cache.AlignmentCache(str(tmp_path), 1)
+    assert not stale.exists()
+    assert fresh.exists()
+
+
+def test_temporary_files_count_against_size_limit(tmp_path):
+    alignment = tmp_path / "alignment.fa"
+    alignment.write_text(">ref\nACGT\n")
+    cache_dir = tmp_path / "cache"
+    cache = alignment_cache.AlignmentCache(str(cache_dir), 1)
+    cache.max_size = 100
+    cache.put("locus", "ACGT", str(alignment), "A" * 40)
+    cache.put("locus", "ACGG", str(alignment), "A" * 40)
+    # make the second entry the least recently used one
+    old = time.time() - 60
+    os.utime(cache.path("locus", "ACGG", str(alignment)), (old, old))
+    # a write in progress of another run takes up space, so that entry needs to go
+    write_file(cache_dir / "locus-xyz.aln.5.6.tmp", 40)
+    cache.evict()
+    assert cache.get("locus", "ACGT", str(alignment)) is not None
+    assert cache.get("locus", "ACGG", str(alignment)) is None
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,115 @@
+import gzip
+import pytest
+from conftest import import_script
+
+consensus = import_script(
+    "preprocessing/consensus_sequences_from_raw_reads", "consensus"
+)
+
+# 60 bases written with 25 bases per line (so that regions span line breaks)
+REF = "ACGTTGCAAC" "GGATCCTTAG" "CATGCATGCA" "TTTTGGGGCC" "AACCGGTTAA" "CCCGGGAAAT"
+LINE_BASES = 25
+
+
+@pytest.fixture
+def ref_file(tmp_path):
+    path = tmp_path / "ref.fa"
+    lines = [REF[i : i + LINE_BASES] for i in range(0, len(REF), LINE_BASES)]
+    header = ">Chromosome\n"
+    path.write_text(header + "\n".join(lines) + "\n")
+    (tmp_path / "ref.fa.fai").write_text(
+        f"Chromosome\t{len(REF)}\t{len(header)}\t{LINE_BASES}\t{LINE_BASES + 1}\n"
+    )
+    return str(path)
+
+
+def write_vcf(path, records):
+    """
+    Writes a gzipped VCF with the records given as tuples of (pos, ref, alt, GT).
+    """
+    with gzip.open(path, "wt") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tsample\n")
+        for pos, ref, alt, gt in records:
+            f.write(f"Chromosome\t{pos}\t.\t{ref}\t{alt}\t.\t.\t.\tGT:DP\t{gt}:20\n")
+    return str(path)
+
+
+def expected(start, end, changes):
+    """
+    Applies the changes (tuples of 1-based position, REF, and ALT) to the region of the
+    reference.
+    """
+    seq = REF[start - 1 : end]
+    for pos, ref, alt in sorted(changes, reverse=True):
+        i = pos - start
+        assert seq[i : i + len(ref)] == ref
+        seq = seq[:i] + alt + seq[i + len(ref) :]
+    return seq
+
+
+def test_fetch_region_spans_line_breaks(ref_file):
+    fai = consensus.read_fai(f"{ref_file}.fai")
+    ref = consensus.np.memmap(ref_file, dtype=consensus.np.uint8, mode="r")
+    assert consensus.fetch_region(ref, fai, "Chromosome", 20, 55) == REF[19:55].encode()
+    # clipped to the sequence
+    assert consensus.fetch_region(ref, fai, "Chromosome", -5, 3) == REF[:3].encode()
+    assert consensus.fetch_region(ref, fai, "Chromosome", 58, 80) == REF[57:].encode()
+    assert consensus.fetch_region(ref, fai, "Chromosome", 10, 9) == b""
+
+
+def test_snps_and_indels(ref_file, tmp_path):
+    snp, deletion, insertion = (5, "T", "A"), (12, "GAT", "G"), (30, "A", "ATTT")
+    vcf = write_vcf(
+        tmp_path / "calls.vcf.gz",
+        [change + ("1",) for change in (snp, deletion, insertion)],
+    )
+    result = consensus.build_consensus(ref_file, vcf, [("locus", 2, 40)])
+    assert result == {"locus": expected(2, 40, [snp, deletion, insertion])}
+
+
+def test_skipped_records(ref_file, tmp_path):
+    applied = (14, "T", "G")
+    vcf = write_vcf(
+        tmp_path / "calls.vcf.gz",
+        [
+            # reference, missing, and `*` alleles are not applied
+            (4, "T", "C", "0"),
+            (6, "G", "A", "."),
+            (8, "A", "*", "1"),
+            # deletion overlapping the end of the region
+            (9, "ACGG", "A", "1"),
+            # deletion overlapping the start of the region
+            (12, "GAT", "G", "1"),
+            applied + ("1",),
+            # overlaps the previous record
+            (14, "TC", "T", "1"),
+            # second ALT allele
+            (17, "T", "C,G", "2"),
+        ],
+    )
+    result = consensus.build_consensus(
+        ref_file, vcf, [("first", 1, 10), ("second", 13, 20)]
+    )
+    assert result == {
+        "first": REF[:10],
+        "second": expected(13, 20, [applied, (17, "T", "G")]),
+    }
+
+
+def test_overlapping_regions(ref_file, tmp_path):
+    snp = (24, "G", "T")
+    vcf = write_vcf(tmp_path / "calls.vcf.gz", [snp + ("1/1",)])
+    regions = [("b", 20, 40), ("a", 10, 30), ("c", 45, 50)]
+    result = consensus.build_consensus(ref_file, vcf, regions)
+    assert result == {
+        "a": expected(10, 30, [snp]),
+        "b": expected(20, 40, [snp]),
+        "c": REF[44:50],
+    }
+
+
+def test_ref_mismatch_raises(ref_file, tmp_path):
+    vcf = write_vcf(tmp_path / "calls.vcf.gz", [(5, "G", "A", "1")])
+    with pytest.raises(ValueError, match="does not match the reference"):
+        consensus.build_consensus(ref_file, vcf, [("locus", 1, 20)])
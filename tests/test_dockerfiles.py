@@ -0,0 +1,70 @@
+import os
+import re
+import ast
+import glob
+import pytest
+from conftest import REPO_DIR, SHARED_DIR
+
+"""
+Checks that the images get all the scripts and modules they use. Most Dockerfiles copy
+the scripts one by one, so a module that is imported by a script (or a script that is
+called by another one) but not copied only fails at runtime. The files in the image are
+derived from the `COPY` instructions (the modules in `shared` are copied into the
+`scripts` directory of the build context before the image is built).
+"""
+
+DOCKERFILES = sorted(glob.glob(os.path.join(REPO_DIR, "*", "*", "Dockerfile")))
+
+
+def image_files(container_dir):
+    """
+    Returns a dict mapping the directories in the image to the names of the scripts
+    copied there.
+    """
+    available = {
+        os.path.basename(path)
+        for path in glob.glob(os.path.join(container_dir, "scripts", "*.*"))
+        + glob.glob(os.path.join(SHARED_DIR, "*.*"))
+    }
+    dirs = {}
+    with open(os.path.join(container_dir, "Dockerfile")) as f:
+        for src, dest in re.findall(r"^COPY (scripts\S*) (\S+)$", f.read(), re.M):
+            if src == "scripts":
+                dirs.setdefault(dest, set()).update(available)
+            else:
+                dirs.setdefault(dest.rstrip("/") or "/", set()).add(
+                    os.path.basename(src)
+                )
+    return dirs, available
+
+
+def used_files(path, available):
+    """
+    Returns the local modules imported by a Python script and the local scripts
+    referenced by name in a script.
+    """
+    with open(path) as f:
+        content = f.read()
+    used = set(re.findall(r"[\w-]+\.(?:py|sh)\b", content))
+    if path.endswith(".py"):
+        for node in ast.walk(ast.parse(content)):
+            if isinstance(node, ast.Import):
+                used.update(f"{alias.name}.py" for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                used.add(f"{node.module}.py")
+    return used & available - {os.path.basename(path)}
+
+
+@pytest.mark.parametrize(
+    "dockerfile", DOCKERFILES, ids=lambda path: os.path.basename(os.path.dirname(path))
+)
+def test_images_contain_used_scripts(dockerfile):
+    container_dir = os.path.dirname(dockerfile)
+    dirs, available = image_files(container_dir)
+    for dest, names in dirs.items():
+        for name in names:
+            path = os.path.join(container_dir, "scripts", name)
+            if not os.path.exists(path):
+                path = os.path.join(SHARED_DIR, name)
+            missing = used_files(path, available) - names
+            assert not missing, f"{name} uses {missing}, which are not copied to {dest}"
@@ -0,0 +1,89 @@
+import os
+import sys
+import gzip
+import subprocess
+import argparse
+import pytest
+import read_filter
+from conftest import SHARED_DIR
+
+READS = "".join(
+    f"@read{i}/{{0}}\nACGTACGTACGTACGT\n+\nIIIIIIIIIIIIIIII\n" for i in range(1000)
+)
+
+
+def test_truncated_gzip_fails(tmp_path):
+    (tmp_path / "ref.fa").write_text(">Chromosome\n" + "ACGT" * 100 + "\n")
+    (tmp_path / "reads_1.fq.gz").write_bytes(gzip.compress(READS.format(1).encode()))
+    # cut off the end of the gzip stream
+    data = gzip.compress(READS.format(2).encode())
+    (tmp_path / "reads_2.fq.gz").write_bytes(data[: len(data) // 2])
+    p = subprocess.run(
+        [sys.executable, os.path.join(SHARED_DIR, "filter-reads.py")]
+        + ["ref.fa", "reads_1.fq.gz", "reads_2.fq.gz", "out_1.fq", "out_2.fq"]
+        + ["--max-depth", "1000"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert p.returncode != 0
+    assert "Failed to read 'reads_2.fq.gz'" in p.stderr
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    read_filter.add_arguments(parser)
+    args = parser.parse_args(args)
+    read_filter.check_arguments(parser, args)
+    return args
+
+
+@pytest.mark.parametrize(
+    "args, expected",
+    [
+        ([], (False, {}, [])),
+        (
+            ["--prefilter", "--prefilter-flank", "50"],
+            (True, {"prefilter_flank": 50}, ["--regions", "{}/prefilter.bed"]),
+        ),
+        # all reads are aligned when validating the prefilter
+        (
+            ["--prefilter", "--validate-prefilter"],
+            (
+                False,
+                {},
+                ["--regions", "{}/prefilter.bed", "--keep-all"]
+                + ["--names", "{}/prefilter-names.txt"],
+            ),
+        ),
+        (
+            ["--max-depth", "100", "--seed", "3"],
+            (
+                False,
+                {"max_depth": 100, "seed": 3},
+                ["--max-depth", "100", "--seed", "3"],
+            ),
+        ),
+    ],
+)
+def test_mapping_args(tmp_path, args, expected):
+    args = parse_args(args)
+    prefilter, params, filter_args = expected
+    assert read_filter.alignment_params(args) == (prefilter, params)
+    regions = [("a", 10, 20), ("b", 2000, 2100)]
+    assert read_filter.mapping_args(args, regions, str(tmp_path)) == [
+        arg.format(tmp_path) for arg in filter_args
+    ]
+    if "--regions" in filter_args:
+        # the flanks are clipped at the start of the genome
+        flank = args.prefilter_flank
+        assert (tmp_path / "prefilter.bed").read_text() == (
+            f"Chromosome\t0\t{20 + flank}\n"
+            f"Chromosome\t{2000 - flank}\t{2100 + flank}\n"
+        )
+
+
+def test_negative_seed_fails():
+    with pytest.raises(SystemExit):
+        parse_args(["--max-depth", "100", "--seed", "-1"])
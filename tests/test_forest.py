@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import import_script
+
+sklearn = pytest.importorskip("sklearn")
+from sklearn.ensemble import RandomForestClassifier  # noqa: E402
+
+forest = import_script("predictors/random_forest_from_variants_streptomycin", "forest")
+
+"""
+The array-based forest (exported with `export_forest` during the Docker build) has to
+give the same probabilities as `predict_proba` of the fitted sklearn model.
+"""
+
+N_FEATURES = 20
+# sklearn can fit forests on data with missing values since version 1.4
+SUPPORTS_NAN = tuple(int(x) for x in sklearn.__version__.split(".")[:2]) >= (1, 4)
+
+
+def genotypes(rng, n_samples, missing=0.0):
+    """
+    Returns random genotypes (0 or 1, with the fraction `missing` of them set to NaN) as
+    DataFrame with feature names like those of the models.
+    """
+    X = rng.integers(0, 2, (n_samples, N_FEATURES)).astype(float)
+    X[rng.random(X.shape) < missing] = np.nan
+    return pd.DataFrame(X, columns=[f"{i}_A_C" for i in range(N_FEATURES)])
+
+
+def export(tmp_path, missing):
+    """
+    Fits a small forest (with a label depending on a few of the features and some
+    noise), exports it, and returns the sklearn model and the array-based one.
+    """
+    rng = np.random.default_rng(42)
+    X = genotypes(rng, 500, missing)
+    signal = X.iloc[:, :3].fillna(0.5).sum(axis=1) + rng.normal(0, 0.5, len(X))
+    m = RandomForestClassifier(n_estimators=25, min_samples_leaf=3, random_state=42)
+    m.fit(X, (signal > 1.5).astype(int))
+    forest.export_forest(m, tmp_path / "forest")
+    return m, forest.ArrayForest(tmp_path / "forest")
+
+
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_same_probabilities_as_sklearn(tmp_path, n_jobs):
+    m, array_forest = export(tmp_path, missing=0.0)
+    rng = np.random.default_rng(0)
+    # also use values between 0 and 1 (non-calls are replaced by the AFs)
+    X = pd.concat([genotypes(rng, 200), genotypes(rng, 50) * rng.random((50, 1))])
+    array_forest.set_params(n_jobs=n_jobs)
+    np.testing.assert_allclose(
+        array_forest.predict_proba(X), m.predict_proba(X), rtol=0, atol=1e-12
+    )
+
+
+@pytest.mark.skipif(not SUPPORTS_NAN, reason="needs sklearn >= 1.4")
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_same_probabilities_as_sklearn_with_missing_values(tmp_path, n_jobs):
+    m, array_forest = export(tmp_path, missing=0.2)
+    X = genotypes(np.random.default_rng(0), 200, missing=0.2)
+    array_forest.set_params(n_jobs=n_jobs)
+    np.testing.assert_allclose(
+        array_forest.predict_proba(X), m.predict_proba(X), rtol=0, atol=1e-12
+    )
+
+
+def test_feature_names_must_match(tmp_path):
+    m, array_forest = export(tmp_path, missing=0.0)
+    X = genotypes(np.random.default_rng(0), 10)
+    with pytest.raises(ValueError, match="Feature names"):
+        array_forest.predict_proba(X[X.columns[::-1]])
+    with pytest.raises(ValueError, match=r"must have shape \(N, 20\)"):
+        array_forest.predict_proba(X.to_numpy()[:, 1:])
@@ -0,0 +1,88 @@
+import pandas as pd
+from conftest import import_script
+
+genotype_matrix = import_script(
+    "preprocessing/variants_from_aligned_reads", "genotype_matrix"
+)
+
+INDEX = ["POS", "REF", "ALT"]
+# the target variants in the order expected by the models
+AFS = pd.DataFrame(
+    [(30, "C", "T", 0.1), (10, "A", "G", 0.2), (20, "GT", "G", 0.3)],
+    columns=INDEX + ["AF"],
+).set_index(INDEX)["AF"]
+
+
+def calls(rows):
+    return pd.DataFrame(rows, columns=INDEX + ["GT", "DP"]).set_index(INDEX)
+
+
+def test_genotype_matrix():
+    variants = {
+        # calls from freebayes (diploid `x/x` genotypes, DP is `.` for non-calls) in a
+        # different order than the target variants and with an additional variant
+        "sample1": calls(
+            [
+                (10, "A", "G", "1/1", "25"),
+                (15, "G", "C", "1/1", "30"),
+                (20, "GT", "G", "0/0", "12"),
+                (30, "C", "T", "./.", "."),
+            ]
+        ),
+        # calls from the built-in genotyper (one with low DP, one variant missing)
+        "sample2": calls([(10, "A", "G", "0", 40), (30, "C", "T", "1", 5)]),
+        "sample3": calls(
+            [(10, "A", "G", "1", 40), (20, "GT", "G", "1", 30), (30, "C", "T", "0", 20)]
+        ),
+    }
+    GT, stats = genotype_matrix.process_genotypes(variants, AFS, DP_threshold=10)
+    # non-calls, calls with low DP, and missing variants are replaced by the AFs
+    expected = pd.DataFrame(
+        [[0.1, 1, 0], [0.1, 0, 0.3], [0, 1, 1]],
+        index=pd.Index(["sample1", "sample2", "sample3"], name="sample"),
+        columns=AFS.index,
+        dtype=float,
+    )
+    pd.testing.assert_frame_equal(GT, expected, check_names=False)
+    assert stats.to_dict("index") == {
+        "sample1": {
+            "shared_variants": 3,
+            "dropped_variants": 1,
+            "missing_variants": 0,
+            "noncalls": 1,
+            "variants_set_to_AF": 1,
+        },
+        "sample2": {
+            "shared_variants": 2,
+            "dropped_variants": 0,
+            "missing_variants": 1,
+            "noncalls": 1,
+            "variants_set_to_AF": 2,
+        },
+        "sample3": {
+            "shared_variants": 3,
+            "dropped_variants": 0,
+            "missing_variants": 0,
+            "noncalls": 0,
+            "variants_set_to_AF": 0,
+        },
+    }
+    assert list(stats.columns) == [
+        "shared_variants",
+        "dropped_variants",
+        "missing_variants",
+        "noncalls",
+        "variants_set_to_AF",
+    ]
+
+
+def test_sample_without_target_variants():
+    variants = {
+        "sample1": calls([(10, "A", "G", "1", 40)]),
+        "sample2": calls([(15, "G", "C", "1", 40)]),
+    }
+    GT, stats = genotype_matrix.process_genotypes(variants, AFS, DP_threshold=10)
+    assert GT.loc["sample1"].tolist() == [0.1, 1, 0.3]
+    assert GT.loc["sample2"].tolist() == AFS.tolist()
+    assert stats.loc["sample2", "missing_variants"] == 3
+    assert stats.loc["sample2", "dropped_variants"] == 1
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pysam
+import pytest
+from conftest import import_script
+
+genotyper = import_script("preprocessing/variants_from_aligned_reads", "genotyper")
+
+"""
+Tests of the built-in targeted genotyper (`--engine pileup`). The reads are simulated
+from a random reference and carry either the REF or the ALT allele (or another one) of a
+target variant, so that the expected haploid majority calls are known.
+"""
+
+REF = "".join(np.random.default_rng(42).choice(list("ACGT"), 700))
+# number of bases the reads extend beyond the variants on each side
+FLANK = 30
+
+
+def other_base(base):
+    return "A" if base != "A" else "C"
+
+
+def make_read(name, pos, ref, alt, mapq=60, flag=0, qual=30):
+    """
+    Returns a read covering the variant at the 1-based position `pos` and carrying the
+    allele `alt` (which can also be the REF allele). Indels need to share the first bases
+    of the alleles (i.e. be left-aligned).
+    """
+    i = pos - 1
+    start = i - FLANK
+    seq = REF[start:i] + alt + REF[i + len(ref) : i + len(ref) + FLANK]
+    if len(ref) == len(alt):
+        cigar = [(pysam.CMATCH, len(seq))]
+    else:
+        indel = pysam.CDEL if len(ref) > len(alt) else pysam.CINS
+        cigar = [
+            (pysam.CMATCH, FLANK + min(len(ref), len(alt))),
+            (indel, abs(len(ref) - len(alt))),
+            (pysam.CMATCH, FLANK),
+        ]
+    read = pysam.AlignedSegment()
+    read.query_name = name
+    read.flag = flag
+    read.reference_id = 0
+    read.reference_start = start
+    read.mapping_quality = mapq
+    read.cigartuples = cigar
+    read.query_sequence = seq
+    read.query_qualities = pysam.qualitystring_to_array(chr(qual + 33) * len(seq))
+    return read
+
+
+def write_bam(path, reads):
+    """
+    Writes the reads to a sorted and indexed BAM file.
+    """
+    header = {"HD": {"VN": "1.6"}, "SQ": [{"SN": "Chromosome", "LN": len(REF)}]}
+    unsorted = f"{path}.unsorted"
+    with pysam.AlignmentFile(unsorted, "wb", header=header) as f:
+        for read in reads:
+            f.write(read)
+    pysam.sort("-o", str(path), unsorted)
+    pysam.index(str(path))
+    return str(path)
+
+
+def run_genotyper(tmp_path, variants, support, **kwargs):
+    """
+    Genotypes the variants (tuples of POS, REF, and ALT) in a BAM with reads carrying
+    the alleles in `support` (a dict mapping the variants to lists of alleles) and
+    returns the calls as list of (GT, DP) tuples.
+    """
+    reads = [
+        make_read(f"{pos}-{j}", pos, ref, allele)
+        for (pos, ref, alt) in variants
+        for j, allele in enumerate(support.get((pos, ref, alt), []))
+    ]
+    bam = write_bam(tmp_path / "reads.bam", reads)
+    target_vars = pd.DataFrame(variants, columns=["POS", "REF", "ALT"])
+    calls = genotyper.genotype(bam, target_vars, **kwargs)
+    return list(calls.itertuples(index=False, name=None))
+
+
+def test_snp_and_indel_calls(tmp_path):
+    snp = (50, REF[49], other_base(REF[49]))
+    deletion = (150, REF[149:152], REF[149])
+    insertion = (250, REF[249], REF[249] + "TTG")
+    variants = [snp, deletion, insertion]
+    calls = run_genotyper(
+        tmp_path, variants, {var: [var[2]] * 6 + [var[1]] * 2 for var in variants}
+    )
+    assert calls == [("1", 8)] * 3
+    # mostly REF
+    calls = run_genotyper(
+        tmp_path, variants, {var: [var[2]] * 2 + [var[1]] * 5 for var in variants}
+    )
+    assert calls == [("0", 7)] * 3
+
+
+def test_majority_calls(tmp_path):
+    # ties are called REF
+    tie = (100, REF[99], other_base(REF[99]))
+    # reads with a third allele count towards the depth, but don't support the ALT (so
+    # that the ALT is the most common allele without being carried by the majority)
+    third_allele = (300, REF[299:302], REF[299])
+    uncovered = (500, REF[499], other_base(REF[499]))
+    calls = run_genotyper(
+        tmp_path,
+        [tie, third_allele, uncovered],
+        {
+            tie: [tie[2]] * 3 + [tie[1]] * 3,
+            third_allele: [REF[299]] * 3 + [REF[299:302]] * 2 + [REF[299:301]] * 2,
+        },
+    )
+    assert calls == [("0", 6), ("0", 7), (".", 0)]
+
+
+@pytest.mark.parametrize(
+    "read_kwargs",
+    [{"flag": 0x400}, {"flag": 0x100}, {"mapq": 0}, {"qual": 10}],
+    ids=["duplicate", "secondary", "low mapping quality", "low base quality"],
+)
+def test_filtered_reads_are_ignored(tmp_path, read_kwargs):
+    pos, ref, alt = 400, REF[399], other_base(REF[399])
+    reads = [make_read(f"ref{j}", pos, ref, ref) for j in range(2)] + [
+        make_read(f"alt{j}", pos, ref, alt, **read_kwargs) for j in range(5)
+    ]
+    bam = write_bam(tmp_path / "reads.bam", reads)
+    target_vars = pd.DataFrame([(pos, ref, alt)], columns=["POS", "REF", "ALT"])
+    calls = genotyper.genotype(bam, target_vars, min_base_quality=20)
+    assert list(calls.itertuples(index=False, name=None)) == [("0", 2)]
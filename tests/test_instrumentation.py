@@ -0,0 +1,41 @@
+import os
+import sys
+import json
+import signal
+import subprocess
+import pytest
+from conftest import REPO_DIR, SHARED_DIR
+
+"""
+The wrappers recording the resource usage of commands have to pass on the exit code of
+the command (or 128 + the signal number if it was killed).
+"""
+
+COMMANDS = [("exit 0", 0), ("exit 3", 3), ("kill -TERM $$", -signal.SIGTERM)]
+
+
+@pytest.mark.parametrize("cmd, exit_code", COMMANDS)
+def test_instrumentation_exit_code(tmp_path, cmd, exit_code):
+    log = tmp_path / "log.jsonl"
+    p = subprocess.run(
+        [sys.executable, os.path.join(SHARED_DIR, "instrumentation.py")]
+        + ["stage", "sh", "-c", cmd],
+        env=dict(os.environ, INSTRUMENTATION_LOG=str(log)),
+        timeout=60,
+    )
+    assert p.returncode == (exit_code if exit_code >= 0 else 128 - exit_code)
+    (record,) = [json.loads(line) for line in log.read_text().splitlines()]
+    assert record["name"] == "stage"
+    assert record["exit_code"] == exit_code
+
+
+@pytest.mark.parametrize("cmd, exit_code", COMMANDS)
+def test_measure_exit_code(tmp_path, cmd, exit_code):
+    metrics = tmp_path / "metrics.json"
+    p = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, "benchmarks", "measure.py")]
+        + [str(metrics), "sh", "-c", cmd],
+        timeout=60,
+    )
+    assert p.returncode == (exit_code if exit_code >= 0 else 128 - exit_code)
+    assert json.loads(metrics.read_text())["exit_code"] == exit_code
@@ -0,0 +1,51 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pytest
+from conftest import REPO_DIR, scripts_dir, import_script
+
+CONTAINER = "predictors/neural_net_from_one_hot_encoded_seqs_13_drugs"
+
+
+def test_duplicate_sample_names(tmp_path):
+    # files with the same name in different directories would give duplicate rows
+    for directory in ("a", "b"):
+        os.mkdir(tmp_path / directory)
+        with open(tmp_path / directory / "sample.csv", "w") as f:
+            f.write("A,C,G,T\n1,0,0,0\n")
+    p = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(scripts_dir(CONTAINER), "main.py"),
+            str(tmp_path / "a" / "sample.csv"),
+            str(tmp_path / "b" / "sample.csv"),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert p.returncode != 0
+    assert "not unique: ['sample']" in p.stderr
+
+
+@pytest.fixture(scope="module")
+def model():
+    tf = pytest.importorskip("tensorflow")
+    return tf.keras.models.load_model(
+        os.path.join(REPO_DIR, CONTAINER, "model"), compile=False
+    )
+
+
+def test_batched_predictions_match_single_predictions(model):
+    # inputs of different lengths must not be padded to a common length (this changed
+    # the predictions of the shorter ones before)
+    predict = import_script(CONTAINER, "model").predict
+    rng = np.random.default_rng(42)
+    lengths = [3000, 3000, 2500, 3000, 2000, 2500, 3000]
+    inputs = [
+        np.eye(4, dtype=np.float32)[rng.integers(0, 4, length)] for length in lengths
+    ]
+    batched = predict(model, inputs, batch_size=4)
+    single = np.concatenate([predict(model, [x], batch_size=1) for x in inputs])
+    # different batch sizes can change the order of the floating point operations
+    np.testing.assert_allclose(batched, single, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,135 @@
+import os
+import sys
+import subprocess
+import pytest
+from conftest import install_scripts
+
+"""
+A failing stage of the pipelines must make the container fail without adding anything
+for that stage to the result cache. The tools the pipelines call are replaced by fakes
+(which pass their input through or just create their output files) and the tools in
+`failing` exit with an error instead.
+"""
+
+FAKE_TOOLS = {
+    "bwa-mem2": """
+        [[ $1 == index ]] && exit 0
+        cat >/dev/null
+        """,
+    "samtools": """
+        case $1 in
+            view) [[ " $* " == *" -H "* ]] && echo '@HD	VN:1.6' || cat ;;
+            fixmate) cat ;;
+            sort) cat >"${@: -1}" ;;
+            index) touch "${3:-$2.bai}" ;;
+        esac
+        """,
+    "freebayes": "echo '##fileformat=VCFv4.2'",
+    "bcftools": """
+        case $1 in
+            index) touch "$2.csi" ;;
+            *) [[ " $* " == *" -o "* ]] && cat >"${@: -1}" || cat ;;
+        esac
+        """,
+}
+
+READS = "@read/{}\nACGTACGTAC\n+\nIIIIIIIIII\n"
+
+
+def install(tmp_path, container, failing=()):
+    """
+    Installs the scripts of a container into a temporary directory together with a
+    dummy reference and inputs and the fake tools (with the tools in `failing` exiting
+    with an error). Returns the directory of the scripts and the environment to run
+    them in.
+    """
+    root = tmp_path / "root"
+    scripts = install_scripts(container, root)
+    (root / "internal_data" / "refgenome.fa").write_text(">Chromosome\n" + "A" * 60)
+    (tmp_path / "reads_1.fq").write_text(READS.format(1))
+    (tmp_path / "reads_2.fq").write_text(READS.format(2))
+    (tmp_path / "regions.csv").write_text("locus,start,end\ngene,10,20\n")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for tool, script in FAKE_TOOLS.items():
+        fake = bin_dir / tool
+        fake.write_text(f"#!/bin/bash\n{'exit 1' if tool in failing else script}")
+        fake.chmod(0o755)
+    return scripts, dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+def run_main(tmp_path, container, args, failing=()):
+    scripts, env = install(tmp_path, container, failing)
+    return subprocess.run(
+        [sys.executable, os.path.join(scripts, "main.py")] + args,
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+
+def cache_entries(cache_dir):
+    return sorted(entry.split("-")[0] for entry in os.listdir(cache_dir / "entries"))
+
+
+@pytest.mark.parametrize("max_depth", [[], ["--max-depth", "5"]])
+def test_failing_alignment_is_not_cached(tmp_path, max_depth):
+    p = run_main(
+        tmp_path,
+        "preprocessing/one_hot_encoded_seqs_from_raw_reads",
+        ["reads_1.fq", "reads_2.fq", "-r", "regions.csv", "-o", "out.npy"]
+        + ["--cache-dir", "cache"]
+        + max_depth,
+        failing=["bwa-mem2"],
+    )
+    assert p.returncode != 0
+    assert cache_entries(tmp_path / "cache") == []
+
+
+def test_failing_filter_fails_mapping_pipeline(tmp_path):
+    # the filter fails (the BED file of the prefilter doesn't exist) while all other
+    # stages succeed
+    scripts, env = install(
+        tmp_path, "preprocessing/one_hot_encoded_seqs_from_raw_reads"
+    )
+    p = subprocess.run(
+        ["bash", os.path.join(scripts, "mapping-pipeline.sh"), "reads_1.fq"]
+        + ["reads_2.fq", "root/internal_data/refgenome.fa", "1", "bwa-index"]
+        + ["--regions", "missing.bed"],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        timeout=120,
+    )
+    assert p.returncode != 0
+    assert b"missing.bed" in p.stderr
+
+
+def test_failing_variant_calling_is_not_cached(tmp_path):
+    p = run_main(
+        tmp_path,
+        "preprocessing/consensus_sequences_from_raw_reads",
+        ["reads_1.fq", "reads_2.fq", "-r", "regions.csv", "-o", "out.fa"]
+        + ["--cache-dir", "cache"],
+        failing=["freebayes"],
+    )
+    assert p.returncode != 0
+    # only the alignment (which succeeded) is cached
+    assert cache_entries(tmp_path / "cache") == ["alignment"]
+
+
+def test_failing_genotyping_is_not_cached(tmp_path):
+    (tmp_path / "reads.bam").write_text("")
+    (tmp_path / "target-vars.csv").write_text("POS,REF,ALT,AF\n15,A,C,0.1\n")
+    p = run_main(
+        tmp_path,
+        "preprocessing/variants_from_aligned_reads",
+        ["-b", "reads.bam", "-t", "target-vars.csv", "-o", "out.csv"]
+        + ["--cache-dir", "cache"],
+        failing=["freebayes"],
+    )
+    assert p.returncode != 0
+    assert "Genotyping pipeline failed" in p.stderr
+    assert cache_entries(tmp_path / "cache") == []
@@ -0,0 +1,72 @@
+import sys
+import socket
+import argparse
+import subprocess
+import http.client
+import pytest
+import prediction_server
+
+# a server predicting the length of the request body (and failing for empty bodies)
+SERVER_SCRIPT = """
+import argparse
+import pandas as pd
+import prediction_server
+
+def predict(body):
+    if not body:
+        raise ValueError("empty input")
+    return pd.DataFrame({"prediction": [len(body)]}, index=["LENGTH"])
+
+parser = argparse.ArgumentParser()
+prediction_server.add_arguments(parser)
+args = parser.parse_args()
+prediction_server.serve(args, predict, {"/target-loci": lambda: "locus,start,end\\n"})
+"""
+
+
+@pytest.fixture(scope="module")
+def port(tmp_path_factory):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    script = tmp_path_factory.mktemp("server") / "server.py"
+    script.write_text(SERVER_SCRIPT)
+    p = subprocess.Popen(
+        [sys.executable, str(script), "--host", "127.0.0.1", "--port", str(port)],
+        stderr=subprocess.PIPE,
+    )
+    # wait until the server is listening
+    assert p.stderr.readline().startswith(b"Listening on")
+    yield port
+    p.terminate()
+    assert p.wait(timeout=10) == 0
+
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request(method, path, body)
+    response = conn.getresponse()
+    return response.status, response.read().decode()
+
+
+def test_get(port):
+    assert request(port, "GET", "/health") == (200, "ok\n")
+    assert request(port, "GET", "/target-loci") == (200, "locus,start,end\n")
+    assert request(port, "GET", "/unknown")[0] == 404
+
+
+def test_predict(port):
+    assert request(port, "POST", "/predict", b"ACGT") == (200, "LENGTH,4\n")
+    assert request(port, "POST", "/predict?format=json", b"ACGT") == (
+        200,
+        '{"LENGTH":{"prediction":4}}',
+    )
+    # invalid inputs are rejected without stopping the server
+    assert request(port, "POST", "/predict", b"") == (400, "empty input\n")
+    assert request(port, "GET", "/health") == (200, "ok\n")
+
+
+@pytest.mark.parametrize("val", ["0", "-1", "two"])
+def test_check_positive_int(val):
+    with pytest.raises(argparse.ArgumentTypeError):
+        prediction_server.check_positive_int(val)
@@ -0,0 +1,110 @@
+import os
+import time
+import pytest
+import result_cache
+
+"""
+Tests of the result cache shared by the preprocessing containers.
+"""
+
+
+def write_file(path, size, age=0):
+    with open(path, "w") as f:
+        f.write("A" * size)
+    set_age(path, age)
+
+
+def set_age(path, age):
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return result_cache.ResultCache(str(tmp_path / "cache"), 1)
+
+
+def test_hit_and_miss(tmp_path, cache):
+    write_file(tmp_path / "input.txt", 10)
+    write_file(tmp_path / "result.txt", 20)
+    key = cache.key("stage", [str(tmp_path / "input.txt")], {"param": 1})
+    dest = str(tmp_path / "dest.txt")
+    assert not cache.get(key, {"result.txt": dest})
+    cache.put(key, {"result.txt": str(tmp_path / "result.txt")})
+    assert cache.get(key, {"result.txt": dest})
+    assert open(dest).read() == "A" * 20
+    # different parameters or input contents give different keys
+    assert cache.key("stage", [str(tmp_path / "input.txt")], {"param": 2}) != key
+    write_file(tmp_path / "input.txt", 11)
+    assert cache.key("stage", [str(tmp_path / "input.txt")], {"param": 1}) != key
+    assert os.listdir(tmp_path / "cache" / "tmp") == []
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, cache):
+    cache.max_size = 100
+    write_file(tmp_path / "result.txt", 40)
+    result = {"result.txt": str(tmp_path / "result.txt")}
+    for key in ["a", "b"]:
+        cache.put(key, result)
+    # make the first entry the least recently used one
+    set_age(tmp_path / "cache" / "entries" / "a", 60)
+    set_age(tmp_path / "cache" / "entries" / "b", 30)
+    assert cache.get("a", {"result.txt": str(tmp_path / "dest.txt")})
+    cache.put("c", result)
+    assert sorted(os.listdir(tmp_path / "cache" / "entries")) == ["a", "c"]
+    # entries larger than the cache are not stored
+    write_file(tmp_path / "large.txt", 101)
+    cache.put("d", {"result.txt": str(tmp_path / "large.txt")})
+    assert sorted(os.listdir(tmp_path / "cache" / "entries")) == ["a", "c"]
+    assert os.listdir(tmp_path / "cache" / "tmp") == []
+
+
+def test_failed_put_is_cleaned_up(tmp_path, cache):
+    write_file(tmp_path / "result.txt", 10)
+    # copying a directory fails after the first file has been copied already
+    (tmp_path / "directory").mkdir()
+    files = {
+        "1.txt": str(tmp_path / "result.txt"),
+        "2.txt": str(tmp_path / "directory"),
+    }
+    with pytest.raises(OSError):
+        cache.put("key", files)
+    assert os.listdir(tmp_path / "cache" / "tmp") == []
+    assert os.listdir(tmp_path / "cache" / "entries") == []
+
+
+def test_stale_files_are_removed(tmp_path):
+    cache_dir = tmp_path / "cache"
+    result_cache.ResultCache(str(cache_dir), 1)
+    tmp = cache_dir / "tmp"
+    stale_age = result_cache.STALE_TMP_AGE + 60
+    # an interrupted put and an interrupted eviction
+    for name in ["key1.1.2", "key2.3.evicted"]:
+        (tmp / name).mkdir()
+        write_file(tmp / name / "result.txt", 10, age=stale_age)
+        set_age(tmp / name, stale_age)
+    write_file(tmp / "checksum.4.5.tmp", 10, age=stale_age)
+    # a put in progress (which is still writing to an old directory)
+    (tmp / "key3.6.7").mkdir()
+    write_file(tmp / "key3.6.7" / "result.txt", 10)
+    set_age(tmp / "key3.6.7", stale_age)
+    # checksums that haven't been used for a long time are removed as well
+    checksums = cache_dir / "checksums"
+    write_file(checksums / "old", 64, age=result_cache.CHECKSUM_MAX_AGE + 60)
+    write_file(checksums / "recent", 64, age=60)
+    result_cache.ResultCache(str(cache_dir), 1)
+    assert os.listdir(tmp) == ["key3.6.7"]
+    assert os.listdir(checksums) == ["recent"]
+
+
+def test_used_checksums_are_kept(tmp_path, cache):
+    write_file(tmp_path / "input.txt", 10)
+    checksum = cache.file_checksum(str(tmp_path / "input.txt"))
+    (memo,) = os.listdir(tmp_path / "cache" / "checksums")
+    memo = tmp_path / "cache" / "checksums" / memo
+    set_age(memo, result_cache.CHECKSUM_MAX_AGE - 60)
+    # the memoized checksum is used (and marked as recently used)
+    assert cache.file_checksum(str(tmp_path / "input.txt")) == checksum
+    assert time.time() - memo.stat().st_mtime < 60
+    cache.evict()
+    assert memo.exists()
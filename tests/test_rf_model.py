@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import import_script
+
+model = import_script("predictors/random_forest_from_variants_streptomycin", "model")
+
+# the target variants in the order expected by the model
+TARGET_VARS = pd.DataFrame(
+    [(30, "C", "T", 0.1), (10, "A", "G", 0.2), (20, "GT", "G", 0.3)],
+    columns=["POS", "REF", "ALT", "AF"],
+).set_index(["POS", "REF", "ALT"])["AF"]
+FEATURES = ["30_C_T", "10_A_G", "20_GT_G"]
+# genotypes of three samples in the order of the target variants
+EXPECTED = np.array([[1, 0, 0.3], [0, 1, 1], [0.1, 0.2, 0]])
+SAMPLES = ["sample1", "sample2", "sample3"]
+
+
+def matrix():
+    """
+    Returns the genotype matrix with the columns in a different order than the target
+    variants and with an additional variant the model doesn't use.
+    """
+    df = pd.DataFrame(EXPECTED, index=SAMPLES, columns=FEATURES)
+    df["15_G_C"] = [1, 1, 0]
+    return df[["20_GT_G", "15_G_C", "30_C_T", "10_A_G"]]
+
+
+def test_feature_names():
+    assert model.feature_names(TARGET_VARS) == FEATURES
+
+
+def test_columns_are_permuted_csv(tmp_path):
+    matrix().to_csv(tmp_path / "matrix.csv")
+    samples, X = model.read_genotype_matrix(str(tmp_path / "matrix.csv"), TARGET_VARS)
+    assert list(samples) == SAMPLES
+    assert samples.name == "sample"
+    assert X.dtype == np.float64
+    np.testing.assert_array_equal(X, EXPECTED)
+
+
+def test_columns_are_permuted_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    # with the sample names in the index and in the first column
+    matrix().to_parquet(tmp_path / "index.parquet")
+    matrix().rename_axis("name").reset_index().to_parquet(tmp_path / "column.parquet")
+    for filename in ["index.parquet", "column.parquet"]:
+        samples, X = model.read_genotype_matrix(str(tmp_path / filename), TARGET_VARS)
+        assert list(samples) == SAMPLES
+        np.testing.assert_array_equal(X, EXPECTED)
+
+
+def test_npy_is_used_as_is(tmp_path):
+    np.save(tmp_path / "matrix.npy", EXPECTED)
+    samples, X = model.read_genotype_matrix(str(tmp_path / "matrix.npy"), TARGET_VARS)
+    assert list(samples) == [0, 1, 2]
+    np.testing.assert_array_equal(X, EXPECTED)
+    np.save(tmp_path / "wrong.npy", EXPECTED[:, :2])
+    with pytest.raises(ValueError, match=r"must have shape \(N, 3\)"):
+        model.read_genotype_matrix(str(tmp_path / "wrong.npy"), TARGET_VARS)
+
+
+def test_missing_target_variants(tmp_path):
+    matrix().drop(columns=["10_A_G", "30_C_T"]).to_csv(tmp_path / "matrix.csv")
+    with pytest.raises(ValueError, match="2 target variants are missing") as e:
+        model.read_genotype_matrix(str(tmp_path / "matrix.csv"), TARGET_VARS)
+    assert "30_C_T, 10_A_G" in str(e.value)
@@ -0,0 +1,219 @@
+import os
+import sys
+import csv
+import json
+import subprocess
+import pytest
+from conftest import REPO_DIR
+
+"""
+Tests of the cohort orchestrator. `docker` is replaced by a fake that runs the arguments
+after the image as command in the working directory of the job (and logs the jobs it
+ran), so the stages of the test chain are simple shell commands.
+"""
+
+SCRIPT = os.path.join(REPO_DIR, "orchestrator", "run_cohort.py")
+SAMPLES = ["s1", "s2", "s3", "s4", "s5"]
+
+FAKE_DOCKER = """#!{python}
+import os, sys, subprocess
+args = sys.argv[1:]
+workdir = args[args.index("-w") + 1]
+with open(os.environ["DOCKER_LOG"], "a") as f:
+    f.write(os.path.relpath(workdir, os.environ["OUTDIR"]) + "\\n")
+# skip the image
+sys.exit(subprocess.run(args[args.index("-w") + 3 :], cwd=workdir).returncode)
+"""
+
+STAGES = [
+    {
+        "name": "targets",
+        "scope": "once",
+        "image": "targets",
+        "args": ["sh", "-c", "echo POS,REF,ALT,AF > {out}/targets.csv"],
+        "outputs": {"vars": "targets.csv"},
+    },
+    {
+        "name": "variants",
+        "image": "variants",
+        # the sample in `$FAIL` fails
+        "args": [
+            "sh",
+            "-c",
+            'test -f {targets.vars} && test {sample} != "$FAIL" && '
+            "printf 'POS,REF,ALT,GT\\n10,A,G,{sample.gt}\\n15,C,T,0\\n' "
+            ">{out}/{sample}.csv",
+        ],
+        "outputs": {"variants": "{sample}.csv"},
+    },
+    {
+        "name": "predict",
+        "scope": "batch",
+        "image": "predict",
+        "args": [
+            "sh",
+            "-c",
+            "cut -d, -f1,2 {matrix:variants.variants} >{out}/predictions.csv && "
+            "cat {manifest:variants.variants} >{out}/files.txt",
+        ],
+        "outputs": {"predictions": "predictions.csv"},
+        "batch_size": 2,
+    },
+]
+
+
+def run(tmp_path, stages, fail=None, extra_args=()):
+    """
+    Runs the orchestrator with the chain and the fake docker and returns the completed
+    process and the working directories of the jobs that were run (relative to the
+    output directory).
+    """
+    (tmp_path / "chain.json").write_text(json.dumps({"stages": stages}))
+    with open(tmp_path / "samples.csv", "w") as f:
+        f.write("sample,gt\n")
+        f.writelines(f"{sample},{i % 2}\n" for i, sample in enumerate(SAMPLES))
+    docker = tmp_path / "docker"
+    docker.write_text(FAKE_DOCKER.format(python=sys.executable))
+    docker.chmod(0o755)
+    log = tmp_path / "docker.log"
+    log.unlink(missing_ok=True)
+    env = dict(os.environ, DOCKER_LOG=str(log), OUTDIR=str(tmp_path / "out"))
+    if fail is not None:
+        env["FAIL"] = fail
+    p = subprocess.run(
+        [sys.executable, SCRIPT, "chain.json", "samples.csv", "-o", "out"]
+        + ["-c", "1", "-m", "4", "--docker", str(docker)]
+        + list(extra_args),
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    jobs = log.read_text().splitlines() if log.exists() else []
+    return p, jobs
+
+
+def read_csv(filename):
+    with open(filename, newline="") as f:
+        return list(csv.reader(f))
+
+
+def batch_dirs(tmp_path):
+    return sorted(
+        d for d in os.listdir(tmp_path / "out" / "predict") if d.startswith("batch-")
+    )
+
+
+def test_batches_are_merged(tmp_path):
+    p, jobs = run(tmp_path, STAGES)
+    assert p.returncode == 0, p.stderr
+    assert jobs[0] == "targets"
+    assert sorted(jobs[1:]) == sorted(
+        [f"variants/{sample}" for sample in SAMPLES]
+        + [f"predict/{batch}" for batch in batch_dirs(tmp_path)]
+    )
+    # batches of two samples (and one with the remaining sample) are predicted while the
+    # other samples are still processed
+    batches = batch_dirs(tmp_path)
+    assert len(batches) == 3
+    assert jobs.index(f"predict/{batches[0]}") < jobs.index("variants/s5")
+    # the matrix and the manifest of a batch
+    assert read_csv(tmp_path / "out" / "predict" / batches[0] / "predictions.csv") == [
+        ["sample", "10_A_G"],
+        ["s1", "0"],
+        ["s2", "1"],
+    ]
+    files = tmp_path / "out" / "predict" / batches[0] / "files.txt"
+    assert files.read_text().splitlines() == [
+        str(tmp_path / "out" / "variants" / sample / f"{sample}.csv")
+        for sample in ["s1", "s2"]
+    ]
+    assert read_csv(tmp_path / "out" / "predict" / "predictions.csv") == [
+        ["sample", "10_A_G"]
+    ] + [[sample, str(i % 2)] for i, sample in enumerate(SAMPLES)]
+
+
+def test_resume_after_failure(tmp_path):
+    p, jobs = run(tmp_path, STAGES, fail="s3")
+    assert p.returncode == 1
+    assert "1 job(s) failed" in p.stderr
+    assert "variants: 4 done, 1 failed" in p.stderr
+    assert "predict: 4 done, 1 failed" in p.stderr
+    merged = tmp_path / "out" / "predict" / "predictions.csv"
+    assert [row[0] for row in read_csv(merged)] == ["sample", "s1", "s2", "s4", "s5"]
+    # only the failed sample is run again (in a new batch; the batches of the previous
+    # run are kept even if they were started within the same second)
+    p, jobs = run(tmp_path, STAGES)
+    assert p.returncode == 0, p.stderr
+    assert jobs[0] == "variants/s3"
+    assert len(jobs) == 2 and jobs[1].startswith("predict/batch-")
+    assert len(batch_dirs(tmp_path)) == 3
+    assert [row[0] for row in read_csv(merged)] == ["sample"] + SAMPLES
+    # nothing is run if everything is done
+    p, jobs = run(tmp_path, STAGES)
+    assert p.returncode == 0, p.stderr
+    assert jobs == []
+
+
+def test_recomputed_inputs_are_predicted_again(tmp_path):
+    p, _ = run(tmp_path, STAGES)
+    assert p.returncode == 0, p.stderr
+    # changing the command of a stage runs it (and everything depending on it) again
+    stages = json.loads(json.dumps(STAGES))
+    stages[1]["args"][2] = stages[1]["args"][2].replace("{sample.gt}", "1")
+    p, jobs = run(tmp_path, stages)
+    assert p.returncode == 0, p.stderr
+    assert "targets" not in jobs
+    assert sum(job.startswith("variants/") for job in jobs) == len(SAMPLES)
+    assert sum(job.startswith("predict/") for job in jobs) == 3
+    # the latest batches take precedence when merging
+    assert len(batch_dirs(tmp_path)) == 6
+    assert read_csv(tmp_path / "out" / "predict" / "predictions.csv") == [
+        ["sample", "10_A_G"]
+    ] + [[sample, "1"] for sample in SAMPLES]
+
+
+def with_args(name, args):
+    stages = json.loads(json.dumps(STAGES))
+    for stage in stages:
+        if stage["name"] == name:
+            stage["args"] = args
+    return stages
+
+
+@pytest.mark.parametrize(
+    "stages, message",
+    [
+        (STAGES + STAGES[-1:], "Duplicate stage name 'predict'"),
+        (with_args("variants", ["{foo.bar}"]), "unknown output 'foo.bar'"),
+        (with_args("variants", ["{variants.missing}"]), "unknown output"),
+        # only outputs of earlier stages can be used
+        (with_args("variants", ["{predict.predictions}"]), "unknown output"),
+        # per-sample outputs need a manifest / matrix in batch stages
+        (with_args("predict", ["{variants.variants}"]), "Invalid placeholder"),
+        (with_args("variants", ["{manifest:targets.vars}"]), "Invalid placeholder"),
+        (with_args("variants", ["{matrix:targets.vars}"]), "Invalid placeholder"),
+        (with_args("predict", ["{list:variants.variants}"]), "Invalid placeholder"),
+        # `{sample}` only for sample stages
+        (with_args("targets", ["{sample}"]), "Invalid placeholder '{sample}'"),
+        (with_args("predict", ["{sample.gt}"]), "Invalid placeholder"),
+        (with_args("variants", ["{manifest:out}"]), "Invalid placeholder"),
+    ],
+)
+def test_invalid_chains(tmp_path, stages, message):
+    p, jobs = run(tmp_path, stages)
+    assert p.returncode == 2
+    assert "Invalid chain definition" in p.stderr
+    assert message in p.stderr
+    assert jobs == []
+
+
+def test_dry_run(tmp_path):
+    p, jobs = run(tmp_path, STAGES, extra_args=["--dry-run"])
+    assert p.returncode == 0, p.stderr
+    assert jobs == []
+    commands = p.stdout.splitlines()
+    assert len(commands) == 1 + len(SAMPLES) + 3
+    assert f"{tmp_path}/out/targets/targets.csv" in commands[1]
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,146 @@
+import os
+import sys
+import gzip
+import shutil
+import subprocess
+import numpy as np
+import pytest
+from conftest import SHARED_DIR
+
+"""
+Tests of `trim-reads.py`. It has to give the same results as trimmomatic (which was
+used by previous versions of the containers), so reads with different quality profiles
+(high quality, degrading towards the end, low-quality stretches at the start or end,
+single low-quality bases, random qualities, and values right at the thresholds of the
+trimming steps) are simulated and trimmed with both tools. trimmomatic is installed in
+the test environment (`environment.yml`), but not in the images.
+"""
+
+TRIMMOMATIC_STEPS = ["LEADING:3", "TRAILING:3", "SLIDINGWINDOW:4:20", "MINLEN:36"]
+BASES = np.frombuffer(b"ACGTN", dtype=np.uint8)
+N_PAIRS = 50000
+
+READS = "".join(f"@read{i}/{{0}}\n{'ACGT' * 10}\n+\n{'I' * 40}\n" for i in range(1000))
+
+
+def simulate_qualities(rng, length):
+    """
+    Returns the Phred qualities of a read with a randomly chosen profile.
+    """
+    pos = np.arange(length)
+    profile = rng.integers(7)
+    if profile == 0:
+        # high quality
+        quals = rng.normal(36, 3, length)
+    elif profile == 1:
+        # degrading towards the end
+        quals = 38 - rng.uniform(0.05, 0.3) * pos + rng.normal(0, 4, length)
+    elif profile == 2:
+        # low-quality stretches at the start and / or the end
+        quals = rng.normal(34, 5, length)
+        quals[: rng.integers(0, 10)] = rng.integers(0, 5)
+        quals[length - rng.integers(0, 30) :] = rng.integers(0, 5)
+    elif profile == 3:
+        # single low-quality bases and short dips
+        quals = rng.normal(34, 4, length)
+        for i in rng.integers(0, length, rng.integers(1, 8)):
+            quals[i : i + rng.integers(1, 4)] = rng.integers(0, 12)
+    elif profile == 4:
+        # random qualities
+        quals = rng.uniform(0, 41, length)
+    elif profile == 5:
+        # values at the thresholds (3 for LEADING and TRAILING, 20 for SLIDINGWINDOW)
+        quals = rng.choice([2, 3, 4, 19, 20, 21, 40], length)
+    else:
+        # windows with a mean right at the threshold
+        quals = np.full(length, 20.0)
+        quals[rng.integers(0, length, rng.integers(1, 5))] = rng.choice([19, 21])
+    return np.clip(np.round(quals), 0, 41).astype(np.uint8)
+
+
+def write_reads(filenames, n_pairs, seed):
+    """
+    Writes simulated read pairs to two FASTQ files (gzipped if the name ends with
+    `.gz`).
+    """
+    rng = np.random.default_rng(seed)
+    files = [
+        gzip.open(filename, "wb") if filename.endswith(".gz") else open(filename, "wb")
+        for filename in filenames
+    ]
+    for i in range(n_pairs):
+        for mate, f in enumerate(files, start=1):
+            # mostly full-length reads, but also some shorter ones
+            length = 150 if rng.random() < 0.7 else int(rng.integers(1, 151))
+            seq = rng.choice(BASES, length, p=[0.24] * 4 + [0.04]).tobytes()
+            qual = (simulate_qualities(rng, length) + 33).tobytes()
+            f.write(b"@sim.%d/%d\n%s\n+\n%s\n" % (i, mate, seq, qual))
+    for f in files:
+        f.close()
+
+
+def read_records(filename):
+    with open(filename, "rb") as f:
+        lines = f.read().splitlines()
+    return [lines[i : i + 4] for i in range(0, len(lines), 4)]
+
+
+def trim_reads(args, cwd, **kwargs):
+    return subprocess.run(
+        [sys.executable, os.path.join(SHARED_DIR, "trim-reads.py")] + args,
+        cwd=cwd,
+        capture_output=True,
+        timeout=600,
+        **kwargs,
+    )
+
+
+@pytest.mark.skipif(shutil.which("trimmomatic") is None, reason="needs trimmomatic")
+def test_same_results_as_trimmomatic(tmp_path):
+    # gzip one of the files to also cover reading compressed input
+    reads = [f"{tmp_path}/reads_1.fastq.gz", f"{tmp_path}/reads_2.fastq"]
+    write_reads(reads, N_PAIRS, seed=42)
+    paired = [f"{tmp_path}/trimmed_1P.fastq", f"{tmp_path}/trimmed_2P.fastq"]
+    subprocess.run(
+        ["trimmomatic", "PE", "-threads", "2", "-phred33"]
+        + reads
+        + [paired[0], "/dev/null", paired[1], "/dev/null"]
+        + TRIMMOMATIC_STEPS,
+        check=True,
+        capture_output=True,
+    )
+    expected = [
+        record
+        for pair in zip(*(read_records(filename) for filename in paired))
+        for record in pair
+    ]
+    p = trim_reads(reads + ["-t", "2"], tmp_path, check=True)
+    observed = p.stdout.splitlines()
+    observed = [observed[i : i + 4] for i in range(0, len(observed), 4)]
+    # compare the records by name first to get a readable report of the differences
+    expected_by_name = {record[0]: record for record in expected}
+    observed_by_name = {record[0]: record for record in observed}
+    differing = [
+        name.decode()
+        for name in sorted(expected_by_name.keys() | observed_by_name.keys())
+        if expected_by_name.get(name) != observed_by_name.get(name)
+    ]
+    assert not differing, f"{len(differing)} trimmed reads differ: {differing[:5]}"
+    # the pairs also have to be in the same order
+    assert observed == expected
+
+
+def test_truncated_gzip_fails(tmp_path):
+    (tmp_path / "reads_1.fq.gz").write_bytes(gzip.compress(READS.format(1).encode()))
+    # cut off the end of the gzip stream
+    data = gzip.compress(READS.format(2).encode())
+    (tmp_path / "reads_2.fq.gz").write_bytes(data[: len(data) // 2])
+    p = trim_reads(["reads_1.fq.gz", "reads_2.fq.gz"], tmp_path, text=True)
+    assert p.returncode != 0
+    assert "Failed to read 'reads_2.fq.gz'" in p.stderr
+
+
+def test_threads_must_be_positive(tmp_path):
+    p = trim_reads(["reads_1.fq", "reads_2.fq", "-t", "0"], tmp_path, text=True)
+    assert p.returncode == 2
+    assert "must be positive int" in p.stderr
@@ -0,0 +1,44 @@
+import os
+import sys
+import signal
+import subprocess
+
+SCRIPT = """
+import os, sys, tempfile, time
+from workdir import make_workdir
+workdir = make_workdir(sys.argv[1])
+# the temporary files of the process and of its children go into the directory
+assert tempfile.mkstemp()[1].startswith(workdir)
+assert os.environ["TMPDIR"] == workdir
+print(workdir, flush=True)
+if sys.argv[2] == "error":
+    raise RuntimeError("failed")
+time.sleep(60)
+"""
+
+
+def test_workdir_is_removed_on_error(tmp_path):
+    p = subprocess.run(
+        [sys.executable, "-c", SCRIPT, str(tmp_path), "error"],
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    assert p.returncode != 0
+    workdir = p.stdout.strip()
+    assert os.path.dirname(workdir) == str(tmp_path)
+    assert not os.path.exists(workdir)
+
+
+def test_workdir_is_removed_on_sigterm(tmp_path):
+    # `docker stop` sends SIGTERM
+    p = subprocess.Popen(
+        [sys.executable, "-c", SCRIPT, str(tmp_path), "sleep"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    workdir = p.stdout.readline().strip()
+    assert os.path.isdir(workdir)
+    p.send_signal(signal.SIGTERM)
+    assert p.wait(timeout=60) == 128 + signal.SIGTERM
+    assert not os.path.exists(workdir)